@@ -0,0 +1,95 @@
+"""Compares the parse times of PLY's LRParser and lalr.Parser.
+
+Both parsers are built from the same tables and grammar rules
+(phpparse.make_parser) and parse every .php file under a directory:
+ - lex+parse: parser.parse(source, lexer=phplex.lexer.clone()), the way
+   SyntaxTree parses a file. lalr.Parser's time includes the files it hands
+   over to PLY because of syntax errors
+ - pre-lexed: the files are lexed into TokenBuffers first, and only the
+   parsing of their tokens is timed (reported per token as well)
+Every measure is the best of a few runs over the whole corpus, with the
+garbage collector enabled as it is in real use. Run from the root of the
+repository:
+
+    python -m src.compiler.php.benchmark examples/php
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+from . import lalr
+from . import phplex
+from . import phpparse
+
+
+def read_corpus(path):
+    """Returns the sources of the .php files under path, sorted by path"""
+    sources = []
+    for root, dirs, files in os.walk(path):
+        for file_name in files:
+            if file_name.endswith('.php'):
+                sources.append(os.path.join(root, file_name))
+    result = []
+    for file_path in sorted(sources):
+        with open(file_path, 'r') as f:
+            result.append(f.read())
+    return result
+
+
+def best_time(function, repeat):
+    """Returns the shortest time of repeat calls of function"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(path, repeat=3):
+    """Measures both parsers on the corpus at path and returns the report
+    as text"""
+    sources = read_corpus(path)
+    ply_parser = phpparse.make_parser(debug=False)
+    parsers = [('PLY', ply_parser), ('lalr', lalr.Parser(ply_parser))]
+    buffers = [phplex.TokenBuffer(source) for source in sources]
+    token_count = sum(len(buffer) for buffer in buffers)
+
+    def lex_and_parse(parser):
+        for source in sources:
+            parser.parse(source, lexer=phplex.lexer.clone())
+
+    def parse_tokens(parser):
+        for buffer in buffers:
+            parser.parse(buffer.source, lexer=buffer.lexer())
+
+    lines = [f"{len(sources)} files, {token_count} tokens, best of {repeat} runs"]
+    results = {}
+    # The error messages of the files with syntax errors are not reported
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        for name, parser in parsers:
+            results[name] = (best_time(lambda: lex_and_parse(parser), repeat),
+                             best_time(lambda: parse_tokens(parser), repeat))
+    for name, (full, tokens) in results.items():
+        lines.append(f"{name:>5}: lex+parse {full:.2f}s, pre-lexed {tokens:.2f}s "
+                     f"({tokens / token_count * 1e6:.2f} us/token)")
+    (ply_full, ply_tokens), (lalr_full, lalr_tokens) = results['PLY'], results['lalr']
+    lines.append(f"lalr.Parser is {(1 - lalr_full / ply_full) * 100:.1f}% faster on "
+                 f"lex+parse, {(1 - lalr_tokens / ply_tokens) * 100:.1f}% on pre-lexed tokens "
+                 f"({parsers[1][1].fallbacks // (2 * repeat)} files fell back to PLY)")
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Parser benchmark")
+    ap.add_argument('-n', '--repeat', dest='repeat', type=int, default=3)
+    ap.add_argument('path', metavar='PATH', type=str)
+    args = ap.parse_args()
+    print(run(args.path, args.repeat))
+
+if __name__ == "__main__":
+    main()
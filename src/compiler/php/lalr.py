@@ -0,0 +1,309 @@
+"""Table driven LALR parse engine for the PHP grammar.
+
+The tables generated by PLY (see parsetab.py) are re-coded with integer
+symbols into dense per-state rows, and the reductions are dispatched
+through a precomputed (kind, rule, left hand side, length) list. The
+grammar rules of phpparse are called with a lightweight Production instead
+of PLY's YaccProduction, without any of the bookkeeping PLY does for error
+recovery and position tracking. Rules that only pass p[1] on (or do
+nothing) are not called at all.
+
+Anything the engine does not handle itself is delegated to the PLY parser
+the tables were taken from, so that the results are always the same:
+ - syntax errors: the input is parsed again by PLY, which reports them and
+   recovers like it always did
+ - parsing with debug or tracking (spans)
+"""
+
+
+def passthrough_rule(p):
+    'symbol : other_symbol'
+    p[0] = p[1]
+
+def empty_rule(p):
+    'symbol : '
+    pass
+
+def same_code(rule, reference):
+    """Checks if the grammar rule does exactly what the reference does"""
+    if rule is None:
+        return False
+    code = rule.__code__
+    reference_code = reference.__code__
+    # The first constant is the docstring
+    return (code.co_code == reference_code.co_code and
+            code.co_consts[1:] == reference_code.co_consts[1:] and
+            code.co_names == reference_code.co_names)
+
+# Kinds of reductions
+CALL, PASSTHROUGH, DISCARD = range(3)
+
+
+class Fallback(Exception):
+    """Raised inside the engine when the input has to be parsed by PLY"""
+    pass
+
+
+class Production(object):
+    """What the grammar rules get as 'p'. Supports the subset of
+    YaccProduction used by phpparse: p[n], len(p), p.lineno(n),
+    p.set_lineno(n, lineno) and p.lexer"""
+
+    __slots__ = ('values', 'linenos', 'lexer')
+
+    def __init__(self, lexer):
+        self.lexer = lexer
+        self.values = None
+        self.linenos = None
+
+    def __getitem__(self, n):
+        return self.values[n]
+
+    def __setitem__(self, n, value):
+        self.values[n] = value
+
+    def __len__(self):
+        return len(self.values)
+
+    def lineno(self, n):
+        return self.linenos[n]
+
+    def set_lineno(self, n, lineno):
+        self.linenos[n] = lineno
+
+
+class Parser(object):
+    """ Parses with the tables and rules of a PLY parser (an LRParser as
+    returned by yacc.yacc)
+
+    Methods:
+        - parse(input, lexer, debug=False, tracking=False): Same as
+          LRParser.parse
+        - statements(input, lexer): Yields the top-level statements one by
+          one instead of returning the list of all of them
+
+    Attributes:
+        - fallbacks: Number of inputs that had to be parsed by PLY
+    """
+
+    def __init__(self, ply_parser):
+        self.ply_parser = ply_parser
+        self.fallbacks = 0
+
+        terminals = set()
+        for row in ply_parser.action.values():
+            terminals.update(row)
+        nonterminals = set()
+        for row in ply_parser.goto.values():
+            nonterminals.update(row)
+        for production in ply_parser.productions:
+            nonterminals.add(production.name)
+
+        self.terminal_ids = dict((name, i) for i, name in enumerate(sorted(terminals)))
+        self.end_id = self.terminal_ids['$end']
+        nonterminal_ids = dict((name, i) for i, name in enumerate(sorted(nonterminals)))
+
+        state_count = max(ply_parser.action) + 1
+        # actions[state][terminal]: > 0 shift to that state, < 0 reduce by
+        # that production, 0 accept, None syntax error
+        self.actions = []
+        for state in range(state_count):
+            row = [None] * len(self.terminal_ids)
+            for name, action in ply_parser.action.get(state, {}).items():
+                row[self.terminal_ids[name]] = action
+            self.actions.append(row)
+
+        # gotos[state][nonterminal]: next state after a reduction. Only the
+        # states that can be uncovered by a reduction have a row
+        self.gotos = [None] * state_count
+        for state, targets in ply_parser.goto.items():
+            if targets:
+                row = [None] * len(nonterminal_ids)
+                for name, target in targets.items():
+                    row[nonterminal_ids[name]] = target
+                self.gotos[state] = row
+
+        # States that reduce without looking at the next token
+        self.defaults = [None] * state_count
+        for state, action in ply_parser.defaulted_states.items():
+            self.defaults[state] = action
+
+        # rules[n]: (kind, grammar rule, id of the left hand side, length)
+        # of production n. Rules that just pass p[1] on or do nothing are
+        # not called
+        self.rules = []
+        for production in ply_parser.productions:
+            kind = CALL
+            if production.len and same_code(production.callable, passthrough_rule):
+                kind = PASSTHROUGH
+            elif same_code(production.callable, empty_rule):
+                kind = DISCARD
+            self.rules.append((kind, production.callable, nonterminal_ids[production.name],
+                               production.len))
+
+        # Action of the reduction appending a statement to the top-level
+        # statement list, where statements() hands the statements out
+        self.statement_action = None
+        for n, production in enumerate(ply_parser.productions):
+            if production.str == 'top_statement_list -> top_statement_list top_statement':
+                self.statement_action = -n
+
+    def parse(self, input=None, lexer=None, debug=False, tracking=False, tokenfunc=None):
+        if debug or tracking or tokenfunc is not None or lexer is None:
+            return self.ply_parser.parse(input, lexer=lexer, debug=debug, tracking=tracking,
+                                         tokenfunc=tokenfunc)
+
+        # Kept untouched in case the input has to be handed over to PLY
+        fallback_lexer = lexer.clone()
+        if input is not None:
+            lexer.input(input)
+        try:
+            return self.run(lexer)
+        except Fallback:
+            self.fallbacks += 1
+            return self.ply_parser.parse(input, lexer=fallback_lexer)
+
+    def statements(self, input=None, lexer=None):
+        """Parses like parse, but yields every top-level statement as soon
+        as it is reduced. The statements are not collected, so memory use
+        does not grow with the number of statements.
+
+        On a syntax error, PLY parses the rest of the input starting from
+        the statement with the error, so the statements already yielded
+        are kept (PLY's recovery on the whole input may drop some of them)
+        """
+        if lexer is None or self.statement_action is None:
+            yield from self.ply_parser.parse(input, lexer=lexer) or []
+            return
+
+        if input is not None:
+            lexer.input(input)
+        # Tokens read since the last statement was yielded
+        read_tokens = []
+        try:
+            yield from self.steps(lexer, self.statement_action, read_tokens)
+        except Fallback:
+            self.fallbacks += 1
+            replay = iter(read_tokens)
+
+            def next_token():
+                t = next(replay, None)
+                return t if t is not None else lexer.token()
+            yield from self.ply_parser.parse(lexer=lexer, tokenfunc=next_token) or []
+
+    def run(self, lexer):
+        steps = self.steps(lexer)
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+    def steps(self, lexer, statement_action=None, read_tokens=None):
+        """Generator doing the actual parsing. Yields the top-level
+        statements if statement_action is given, and returns the result of
+        the parse. The tokens read for the statement being parsed are kept
+        in read_tokens"""
+        actions = self.actions
+        gotos = self.gotos
+        defaults = self.defaults
+        rules = self.rules
+        terminal_ids = self.terminal_ids
+        end_id = self.end_id
+        get_token = lexer.token
+        if read_tokens is not None:
+            lexer_token = get_token
+
+            def get_token():
+                t = lexer_token()
+                if t is not None:
+                    read_tokens.append(t)
+                return t
+        p = Production(lexer)
+
+        # The bottom of the stacks stands for '$end', so that the slices
+        # taken for the rules always have room for p[0]
+        states = [0]
+        values = [None]
+        linenos = [0]
+        state = 0
+        token = None
+        token_id = None
+
+        while True:
+            action = defaults[state]
+            if action is None:
+                if token_id is None:
+                    token = get_token()
+                    if token is None:
+                        token_id = end_id
+                    else:
+                        token_id = terminal_ids.get(token.type)
+                        if token_id is None:
+                            raise Fallback()
+                action = actions[state][token_id]
+                if action is None:
+                    raise Fallback()
+
+            if action > 0:
+                # Shift
+                state = action
+                states.append(state)
+                values.append(token.value)
+                linenos.append(token.lineno)
+                token_id = None
+                continue
+
+            if action < 0:
+                kind, rule, lhs, length = rules[-action]
+                if action == statement_action and len(states) == 3:
+                    # The statement list is at the bottom of the stack, so
+                    # this is a top-level statement. The list stays empty
+                    yield values[-1]
+                    del read_tokens[:]
+                    if token_id is not None and token is not None:
+                        # The lookahead belongs to the next statement
+                        read_tokens.append(token)
+                    kind = PASSTHROUGH
+                if kind != CALL:
+                    value = values[-length] if kind == PASSTHROUGH else None
+                    if length:
+                        del values[-length:]
+                        del linenos[-length:]
+                        del states[-length:]
+                    state = gotos[states[-1]][lhs]
+                    states.append(state)
+                    values.append(value)
+                    linenos.append(0)
+                    continue
+
+                if length == 1:
+                    rule_values = [None, values.pop()]
+                    rule_linenos = [0, linenos.pop()]
+                    states.pop()
+                elif length:
+                    rule_values = values[-length - 1:]
+                    rule_values[0] = None
+                    rule_linenos = linenos[-length - 1:]
+                    # Without tracking PLY gives nonterminals no line number
+                    rule_linenos[0] = 0
+                    del values[-length:]
+                    del linenos[-length:]
+                    del states[-length:]
+                else:
+                    rule_values = [None]
+                    rule_linenos = [0]
+                p.values = rule_values
+                p.linenos = rule_linenos
+                try:
+                    rule(p)
+                except SyntaxError:
+                    # PLY turns this into error recovery
+                    raise Fallback()
+                state = gotos[states[-1]][lhs]
+                states.append(state)
+                values.append(rule_values[0])
+                linenos.append(rule_linenos[0])
+                continue
+
+            # Accept
+            return values[-1]
@@ -1,5 +1,11 @@
+from hashlib import blake2b
+
 class Node(object):
     fields = []
+    # Offsets of the first and past the last character of the node in the
+    # source code. Only set when the tree was parsed with spans
+    lexpos = None
+    endlexpos = None
 
     def __init__(self, *args, **kwargs):
         assert len(self.fields) == len(args), \
@@ -21,40 +27,202 @@ class Node(object):
         return type(self).__name__
 
     def accept(self, visitor, recurse_depth=0):
-        visitor.visit(self)
-        if recurse_depth > 0:
-            for field in self.fields:
-                value = getattr(self, field)
-                if isinstance(value, Node):
-                    value.accept(visitor)
-                elif isinstance(value, list):
-                    for item in value:
-                        if isinstance(item, Node):
-                            item.accept(visitor)
+        """Calls visitor.visit on this node and, if recurse_depth > 0, on
+        the nodes up to recurse_depth levels below it (in pre-order)"""
+        stack = [(self, recurse_depth)]
+        while stack:
+            node, depth = stack.pop()
+            visitor.visit(node)
+            if depth > 0:
+                stack.extend((child, depth - 1) for child in reversed(node.children()))
 
-    def generic(self, with_lineno=False):
-        values = {}
-        if with_lineno:
-            values['lineno'] = self.lineno
+    def children(self):
+        """Returns the nodes held directly in the fields of this node"""
+        children = []
         for field in self.fields:
             value = getattr(self, field)
-            if hasattr(value, 'generic'):
-                 value = value.generic(with_lineno)
+            if isinstance(value, Node):
+                children.append(value)
             elif isinstance(value, list):
-                items = value
-                value = []
-                for item in items:
-                    if hasattr(item, 'generic'):
-                        item = item.generic(with_lineno)
-                    value.append(item)
-            values[field] = value
-        return (self.__class__.__name__, values)
+                children.extend(item for item in value if isinstance(item, Node))
+        return children
+
+    def generic(self, with_lineno=False):
+        # Built bottom-up with an explicit stack instead of recursing, so
+        # that deep trees do not hit the recursion limit. Maps ids of the
+        # nodes to their generic form
+        results = {}
+        stack = [(self, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if not children_done:
+                stack.append((node, True))
+                for field in node.fields:
+                    value = getattr(node, field)
+                    if hasattr(value, 'generic'):
+                        stack.append((value, False))
+                    elif isinstance(value, list):
+                        stack.extend((item, False) for item in value if hasattr(item, 'generic'))
+                continue
+
+            values = {}
+            if with_lineno:
+                values['lineno'] = getattr(node, 'lineno', None)
+            for field in node.fields:
+                value = getattr(node, field)
+                if hasattr(value, 'generic'):
+                    value = results[id(value)]
+                elif isinstance(value, list):
+                    value = [results[id(item)] if hasattr(item, 'generic') else item
+                             for item in value]
+                values[field] = value
+            results[id(node)] = (node.__class__.__name__, values)
+        return results[id(self)]
+
+    def structural_hash(self, with_lineno=False, with_names=True, with_literals=True):
+        """Returns a digest of the kinds and fields of this subtree. It is a
+        Merkle hash: the digests of the children are hashed into their
+        parent's, so equal subtrees have equal digests and comparing two
+        subtrees takes one comparison. Without names, the identifiers (see
+        identifier_fields) are left out, so subtrees that only use other
+        names are equal as well. Without literals, the same goes for the
+        strings and numbers in expressions (see literal_fields).
+
+        The digests are computed bottom-up in one pass and cached on the
+        nodes. Call clear_structural_hashes after changing a tree. The
+        bodies of expanded includes are other files and are not part of
+        the digests (see hash_fields)"""
+        attribute = hash_attributes[with_lineno, with_names, with_literals]
+        digest = getattr(self, attribute, None)
+        if digest is not None:
+            return digest
+
+        stack = [(self, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if getattr(node, attribute, None) is not None:
+                continue
+            fields = hash_fields.get(type(node), node.fields)
+            if not children_done:
+                stack.append((node, True))
+                for field in fields:
+                    stack.extend((child, False) for child in nested_nodes(getattr(node, field)))
+                continue
+
+            digest = blake2b(type(node).__name__.encode(), digest_size=16)
+            if with_lineno:
+                digest.update(b'@%r;' % getattr(node, 'lineno', None))
+            for field in fields:
+                anonymous = not with_names and field in identifier_fields
+                abstract = not with_literals and field in literal_fields
+                hash_value(digest, getattr(node, field), attribute, anonymous, abstract)
+            setattr(node, attribute, digest.digest())
+        return getattr(self, attribute)
+
+def nested_nodes(value):
+    """Returns the nodes in value, which may be a (nested) list"""
+    if isinstance(value, Node):
+        return [value]
+    nodes = []
+    if isinstance(value, (list, tuple)):
+        stack = [value]
+        while stack:
+            for item in stack.pop():
+                if isinstance(item, Node):
+                    nodes.append(item)
+                elif isinstance(item, (list, tuple)):
+                    stack.append(item)
+    return nodes
+
+# Fields holding the names of variables, functions, classes, etc. Left out
+# of the structural hashes computed without names
+identifier_fields = frozenset(['name', 'alias', 'class_', 'extends', 'implements', 'traits'])
+
+# Fields holding expressions, where strings and numbers are literals. Left
+# out of the structural hashes computed without literals
+literal_fields = frozenset(['expr', 'node', 'nodes', 'left', 'right', 'key', 'value', 'initial',
+                            'default', 'iftrue', 'iffalse', 'data'])
+
+# Names of the attributes caching the structural hashes, by (with_lineno,
+# with_names, with_literals)
+hash_attributes = {
+    (False, True, True): '_structural_hash',
+    (True, True, True): '_structural_hash_lineno',
+    (False, False, True): '_structural_hash_anonymous',
+    (True, False, True): '_structural_hash_lineno_anonymous',
+    (False, True, False): '_structural_hash_abstract',
+    (True, True, False): '_structural_hash_lineno_abstract',
+    (False, False, False): '_structural_hash_anonymous_abstract',
+    (True, False, False): '_structural_hash_lineno_anonymous_abstract',
+}
+
+def hash_value(digest, value, attribute, anonymous=False, abstract=False):
+    """Feeds a field value to digest. Nodes must have their hash (cached
+    in attribute) already. anonymous leaves out the strings, abstract the
+    strings and numbers"""
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, Node):
+            digest.update(b'N')
+            digest.update(getattr(value, attribute))
+        elif isinstance(value, (list, tuple)):
+            digest.update(b'L%d;' % len(value))
+            stack.extend(reversed(value))
+        elif abstract and type(value) in (str, int, float):
+            digest.update(b'C')
+        elif isinstance(value, str):
+            if anonymous:
+                digest.update(b'I')
+                continue
+            data = value.encode('utf-8', 'surrogatepass')
+            digest.update(b'S%d;' % len(data))
+            digest.update(data)
+        else:
+            digest.update(b'V%s:%r;' % (type(value).__name__.encode(), value))
+
+def clear_structural_hashes(value):
+    """Forgets the structural hashes cached in the nodes of value"""
+    stack = nested_nodes(value)
+    seen = set()
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        for attribute in hash_attributes.values():
+            if hasattr(node, attribute):
+                delattr(node, attribute)
+        for field in node.fields:
+            stack.extend(nested_nodes(getattr(node, field)))
 
 def node(name, fields):
     attrs = {'fields': fields}
     return type(name, (Node,), attrs)
 
-InlineHTML = node('InlineHTML', ['data'])
+class InlineHTML(Node):
+    """HTML outside of the PHP tags. When the node shares the source code
+    (see share_source), data is sliced out of it on demand instead of being
+    kept as a copy"""
+    fields = ['data']
+    source = None
+
+    @property
+    def data(self):
+        if self.source is not None:
+            return self.source[self.lexpos:self.endlexpos]
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self.source = None
+
+    def share_source(self, source):
+        if source[self.lexpos:self.endlexpos] == self._data:
+            self._data = None
+            self.source = source
+
 Block = node('Block', ['nodes'])
 Assignment = node('Assignment', ['node', 'expr', 'is_ref'])
 ListAssignment = node('ListAssignment', ['nodes', 'expr'])
@@ -97,6 +265,14 @@ Empty = node('Empty', ['expr'])
 Eval = node('Eval', ['expr'])
 Include = node('Include', ['expr', 'once', 'body'])
 Require = node('Require', ['expr', 'once', 'body'])
+
+# Fields in the structural hashes of the node classes that do not hash all
+# their fields. The body of an include is set by DependencyResolver, after
+# digests may have been cached, and is the tree of another file
+hash_fields = {
+    Include: ['expr', 'once'],
+    Require: ['expr', 'once'],
+}
 Exit = node('Exit', ['expr', 'type'])
 Silence = node('Silence', ['expr'])
 MagicConstant = node('MagicConstant', ['name', 'value'])
@@ -134,9 +310,82 @@ ConstantDeclaration = node('ConstantDeclaration', ['name', 'initial'])
 TraitUse = node('TraitUse', ['name', 'renames'])
 TraitModifier = node('TraitModifier', ['from', 'to', 'visibility'])
 
+class Concat(Node):
+    """'a . b . c' as a flat list of operands. Only built by parsers made
+    with concat=True, the default parsers build BinaryOp('.') chains"""
+    fields = ['nodes']
+
+    def as_binary_op(self):
+        """Returns the left-deep BinaryOp('.') chain the default parsers
+        build for this node"""
+        result = self.nodes[0]
+        for operand in self.nodes[1:]:
+            result = BinaryOp('.', result, operand, lineno=self.lineno)
+        return result
+
+class InterpolatedString(Concat):
+    """A double quoted string, heredoc or backtick string with variables
+    in it. nodes holds the literal parts and the interpolated expressions
+    in order"""
+    fields = ['nodes']
+
+def expand_concats(value):
+    """Compatibility view of a tree parsed with concat nodes: returns value
+    with every Concat and InterpolatedString replaced by the BinaryOp('.')
+    chain the default parsers build. Subtrees without any concat nodes are
+    shared with value, the others are copied"""
+    # Each frame is [value, children, index of the next child, changed]
+    # where children are the field values (or items) of value
+    stack = [[value, None, 0, False]]
+    while True:
+        frame = stack[-1]
+        current, children, index, changed = frame
+        if children is None:
+            if isinstance(current, Node):
+                children = [getattr(current, field) for field in current.fields]
+            elif isinstance(current, list):
+                children = list(current)
+            else:
+                children = []
+            frame[1] = children
+
+        if index < len(children):
+            frame[2] = index + 1
+            child = children[index]
+            if isinstance(child, (Node, list)):
+                stack.append([child, None, 0, False])
+            continue
+
+        # All the children are done
+        stack.pop()
+        if changed:
+            if isinstance(current, Node):
+                copy = current.__class__.__new__(current.__class__)
+                copy.__dict__.update(current.__dict__)
+                for attribute in hash_attributes.values():
+                    copy.__dict__.pop(attribute, None)
+                for field, child in zip(current.fields, children):
+                    setattr(copy, field, child)
+                current = copy
+            else:
+                current = children
+        if isinstance(current, Concat):
+            current = current.as_binary_op()
+            changed = True
+        if not stack:
+            return current
+        parent = stack[-1]
+        if changed:
+            parent[1][parent[2] - 1] = current
+            parent[3] = True
+
 def resolve_magic_constants(nodes):
     current = {}
-    def visitor(node):
+    # Pre-order walk with an explicit stack, the names seen last are the
+    # current ones
+    stack = [node for node in reversed(nodes) if isinstance(node, Node)]
+    while stack:
+        node = stack.pop()
         if isinstance(node, Namespace):
             current['namespace'] = node.name
         elif isinstance(node, Class):
@@ -166,6 +415,4 @@ def resolve_magic_constants(nodes):
                 if current.get('namespace'):
                     node.value = '%s\\%s' % (current.get('namespace'),
                                              node.value)
-    for node in nodes:
-        if isinstance(node, Node):
-            node.accept(visitor)
+        stack.extend(reversed(node.children()))
@@ -1,6 +1,10 @@
 
 import ply.lex as lex
 import re
+import sys
+
+from array import array
+from bisect import bisect_right
 
 
 states = (
@@ -93,7 +97,6 @@ tokens = reserved + unparsed + (
 # Newlines
 def t_php_WHITESPACE(t):
     r'[ \t\r\n]+'
-    t.lexer.lineno += t.value.count("\n")
     return t
 
 # Operators
@@ -194,12 +197,10 @@ t_php_UNSET_CAST           = r'\([ \t]*[Uu][Nn][Ss][Ee][Tt][ \t]*\)'
 
 def t_php_DOC_COMMENT(t):
     r'/\*\*(.|\n)*?\*/'
-    t.lexer.lineno += t.value.count("\n")
     return t
 
 def t_php_COMMENT(t):
     r'/\*(.|\n)*?\*/ | //([^?%\n]|[?%](?!>))*\n? | \#([^?%\n]|[?%](?!>))*\n?'
-    t.lexer.lineno += t.value.count("\n")
     return t
 
 # Escaping from HTML
@@ -207,19 +208,16 @@ def t_php_COMMENT(t):
 def t_OPEN_TAG(t):
     r'<[?%](([Pp][Hh][Pp][ \t\r\n]?)|=)?'
     if '=' in t.value: t.type = 'OPEN_TAG_WITH_ECHO'
-    t.lexer.lineno += t.value.count("\n")
     t.lexer.begin('php')
     return t
 
 def t_php_CLOSE_TAG(t):
     r'[?%]>\r?\n?'
-    t.lexer.lineno += t.value.count("\n")
     t.lexer.begin('INITIAL')
     return t
 
 def t_INLINE_HTML(t):
     r'([^<]|<(?![?%]))+'
-    t.lexer.lineno += t.value.count("\n")
     return t
 
 # Identifiers and reserved words
@@ -267,7 +265,6 @@ def t_php_LNUMBER(t):
 # String literal
 def t_php_CONSTANT_ENCAPSED_STRING(t):
     r"'([^\\']|\\(.|\n))*'"
-    t.lexer.lineno += t.value.count("\n")
     return t
 
 def t_php_QUOTE(t):
@@ -282,7 +279,6 @@ def t_quoted_QUOTE(t):
 
 def t_quoted_ENCAPSED_AND_WHITESPACE(t):
     r'( [^"\\${] | \\(.|\n) | \$(?![A-Za-z_{]) | \{(?!\$) )+'
-    t.lexer.lineno += t.value.count("\n")
     return t
 
 def t_quoted_VARIABLE(t):
@@ -321,7 +317,6 @@ def t_quotedvar_OBJECT_OPERATOR(t):
 
 def t_quotedvar_ENCAPSED_AND_WHITESPACE(t):
     r'( [^"\\${] | \\(.|\n) | \$(?![A-Za-z_{]) | \{(?!\$) )+'
-    t.lexer.lineno += t.value.count("\n")
     t.lexer.pop_state()
     return t
 
@@ -367,7 +362,6 @@ def t_property_STRING(t):
 
 def t_php_START_HEREDOC(t):
     r'<<<[ \t]*(?P<label>[A-Za-z_][\w_]*)\r?\n'
-    t.lexer.lineno += t.value.count("\n")
     t.lexer.push_state('heredoc')
     t.lexer.heredoc_label = t.lexer.lexmatch.group('label')
     return t
@@ -383,7 +377,6 @@ def t_heredoc_END_HEREDOC(t):
 
 def t_php_START_NOWDOC(t):
     r'''<<<[ \t]*'(?P<label>[A-Za-z_][\w_]*)'\r?\n'''
-    t.lexer.lineno += t.value.count("\n")
     t.lexer.push_state('nowdoc')
     t.lexer.nowdoc_label = t.lexer.lexmatch.group('label')
     return t
@@ -399,12 +392,10 @@ def t_nowdoc_END_NOWDOC(t):
 
 def t_nowdoc_ENCAPSED_AND_WHITESPACE(t):
     r'[^\n]*\n'
-    t.lexer.lineno += t.value.count("\n")
     return t
 
 def t_heredoc_ENCAPSED_AND_WHITESPACE(t):
     r'( [^\n\\${] | \\. | \$(?![A-Za-z_{]) | \{(?!\$) )+\n? | \\?\n'
-    t.lexer.lineno += t.value.count("\n")
     return t
 
 def t_heredoc_VARIABLE(t):
@@ -417,7 +408,6 @@ t_heredoc_DOLLAR_OPEN_CURLY_BRACES = t_quoted_DOLLAR_OPEN_CURLY_BRACES
 
 def t_heredocvar_ENCAPSED_AND_WHITESPACE(t):
     r'( [^\n\\${] | \\. | \$(?![A-Za-z_{]) | \{(?!\$) )+\n? | \\?\n'
-    t.lexer.lineno += t.value.count("\n")
     t.lexer.pop_state()
     return t
 
@@ -435,7 +425,6 @@ def t_php_BACKTICK(t):
 
 def t_backticked_ENCAPSED_AND_WHITESPACE(t):
     r'( [^`\\${] | \\(.|\n) | \$(?![A-Za-z_{]) | \{(?!\$) )+'
-    t.lexer.lineno += t.value.count("\n")
     return t
 
 def t_backticked_VARIABLE(t):
@@ -465,12 +454,12 @@ t_backtickedvar_DOLLAR_OPEN_CURLY_BRACES = t_quotedvar_DOLLAR_OPEN_CURLY_BRACES
 
 def t_backtickedvar_ENCAPSED_AND_WHITESPACE(t):
     r'( [^`\\${] | \\(.|\n) | \$(?![A-Za-z_{]) | \{(?!\$) )+'
-    t.lexer.lineno += t.value.count("\n")
     t.lexer.pop_state()
     return t
 
 def t_ANY_error(t):
-    raise SyntaxError('illegal character', (None, t.lineno, None, t.value))
+    lineno = t.lineno + t.lexer.lexdata.count("\n", 0, t.lexpos)
+    raise SyntaxError('illegal character', (None, lineno, None, t.value))
 
 def peek(lexer):
     try:
@@ -478,14 +467,48 @@ def peek(lexer):
     except IndexError:
         return ''
 
+# Tokens whose values are names. They are interned (with sys.intern), so that
+# the many occurrences of names like '$this' or 'array' share one string and
+# comparing them with each other (or with names in the code) is a pointer
+# comparison
+interned_tokens = frozenset(['STRING', 'VARIABLE', 'STRING_VARNAME', 'NUM_STRING'] +
+                            list(reserved))
+
+class LineIndex(object):
+    """Offsets at which the lines of a source code start. Line and column
+    numbers are looked up by bisection instead of counting the newlines of
+    every token while lexing"""
+
+    def __init__(self, data, first_line=1):
+        self.first_line = first_line
+        self.starts = [0]
+        self.starts.extend(match.end() for match in re.finditer('\n', data))
+
+    def line(self, offset):
+        return bisect_right(self.starts, offset) - 1 + self.first_line
+
+    def position(self, offset):
+        """Returns (line, column) of offset. Columns start at 1"""
+        index = bisect_right(self.starts, offset) - 1
+        return index + self.first_line, offset - self.starts[index] + 1
+
 class FilteredLexer(object):
+    """Lexer handed to the parser. Drops the tokens the parser does not
+    expect and gives the others their line number (the rules of the
+    underlying lexer don't track lines, see LineIndex).
+
+    Setting lineno before input() sets the number of the first line."""
+
     def __init__(self, lexer):
         self.lexer = lexer
         self.last_token = None
+        self.lines = None
 
     @property
     def lineno(self):
-        return self.lexer.lineno
+        if self.lines is None:
+            return self.lexer.lineno
+        return self.lines.line(self.lexer.lexpos)
 
     @lineno.setter
     def lineno(self, value):
@@ -499,21 +522,34 @@ class FilteredLexer(object):
     def lexpos(self, value):
         self.lexer.lexpos = value
 
+    @property
+    def lexdata(self):
+        return self.lexer.lexdata
+
     def clone(self):
-        return FilteredLexer(self.lexer.clone())
+        clone = FilteredLexer(self.lexer.clone())
+        clone.lines = self.lines
+        return clone
 
     def current_state(self):
         return self.lexer.current_state()
 
     def input(self, input):
         self.lexer.input(input)
+        self.lines = LineIndex(input, self.lexer.lineno)
 
     def next_lexer_token(self):
         """Return next lexer token.
 
         Can be useful to customize parser behavior without need to touch
         parser code in the token method."""
-        return self.lexer.token()
+        t = self.lexer.token()
+        if t is not None:
+            # Offset right after the token, used for the spans of the nodes
+            t.endlexpos = self.lexer.lexpos
+            if t.type in interned_tokens:
+                t.value = sys.intern(t.value)
+        return t
 
     def token(self):
         t = self.next_lexer_token()
@@ -551,6 +587,9 @@ class FilteredLexer(object):
 
             t = self.next_lexer_token()
 
+        if t is not None:
+            lines = self.lines
+            t.lineno = bisect_right(lines.starts, t.lexpos) - 1 + lines.first_line
         self.last_token = t
         return t
 
@@ -564,7 +603,61 @@ class FilteredLexer(object):
             raise StopIteration
         return t
 
-    __next__ = next
+class DeclarationsLexer(FilteredLexer):
+    """FilteredLexer that drops the tokens inside the bodies of functions,
+    methods and closures, so that the parser only builds the declarations
+    (the bodies are parsed as empty blocks)."""
+
+    def __init__(self, lexer):
+        FilteredLexer.__init__(self, lexer)
+        self.in_signature = False
+        self.paren_depth = 0
+        self.body_end = None
+
+    def clone(self):
+        clone = DeclarationsLexer(self.lexer.clone())
+        clone.lines = self.lines
+        return clone
+
+    def token(self):
+        if self.body_end is not None:
+            t, self.body_end = self.body_end, None
+            return t
+
+        t = FilteredLexer.token(self)
+        if t is None:
+            return t
+
+        if t.type == 'FUNCTION':
+            self.in_signature = True
+            self.paren_depth = 0
+        elif self.in_signature:
+            if t.type == 'LPAREN':
+                self.paren_depth += 1
+            elif t.type == 'RPAREN':
+                self.paren_depth -= 1
+            elif self.paren_depth == 0 and t.type == 'SEMI':
+                # Abstract or interface method without a body
+                self.in_signature = False
+            elif self.paren_depth == 0 and t.type == 'LBRACE':
+                self.in_signature = False
+                self.body_end = self.skip_body()
+        return t
+
+    def skip_body(self):
+        """Skips the tokens up to the RBRACE closing the current body and
+        returns that RBRACE"""
+        depth = 1
+        while True:
+            t = FilteredLexer.token(self)
+            if t is None:
+                return None
+            if t.type in ('LBRACE', 'CURLY_OPEN', 'DOLLAR_OPEN_CURLY_BRACES'):
+                depth += 1
+            elif t.type == 'RBRACE':
+                depth -= 1
+                if depth == 0:
+                    return t
 
 full_lexer = lex.lex()
 lexer = FilteredLexer(full_lexer)
@@ -572,5 +665,133 @@ lexer = FilteredLexer(full_lexer)
 full_tokens = tokens
 tokens = [token for token in tokens if token not in unparsed]
 
+# Ids of the token types in a TokenBuffer
+token_ids = dict((name, i) for i, name in enumerate(full_tokens))
+
+class TokenBuffer(object):
+    """The tokens a FilteredLexer hands to the parser for a whole input,
+    stored in parallel arrays (type id, start and end offsets). Values are
+    sliced from the source when they are asked for, so a buffer can be kept
+    around (e.g. to parse the same file again) without holding a LexToken
+    for every token.
+
+    Methods:
+        - lexer(): Returns a BufferLexer that feeds the tokens to the parser
+        - type(i), value(i), span(i), lineno(i): Details of the i-th token
+    """
+
+    def __init__(self, source, source_lexer=None):
+        """source_lexer is the FilteredLexer (or DeclarationsLexer) that
+        the tokens are read with, the default lexer if None"""
+        if source_lexer is None:
+            source_lexer = lexer
+        self.source = source
+        self.types = array('H')
+        self.starts = array('I')
+        self.ends = array('I')
+        # Values that are not the source text of their token
+        self.values = {}
+
+        token_lexer = source_lexer.clone()
+        token_lexer.lineno = 1
+        token_lexer.input(source)
+        self.lines = token_lexer.lines
+
+        types, starts, ends = self.types, self.starts, self.ends
+        while True:
+            t = token_lexer.token()
+            if t is None:
+                break
+            if t.value != source[t.lexpos:t.endlexpos]:
+                self.values[len(types)] = t.value
+            types.append(token_ids[t.type])
+            starts.append(t.lexpos)
+            ends.append(t.endlexpos)
+
+    def __len__(self):
+        return len(self.types)
+
+    def type(self, i):
+        return full_tokens[self.types[i]]
+
+    def value(self, i):
+        value = self.values.get(i)
+        if value is None:
+            value = self.source[self.starts[i]:self.ends[i]]
+            if full_tokens[self.types[i]] in interned_tokens:
+                value = sys.intern(value)
+        return value
+
+    def span(self, i):
+        return self.starts[i], self.ends[i]
+
+    def lineno(self, i):
+        return self.lines.line(self.starts[i])
+
+    def lexer(self):
+        return BufferLexer(self)
+
+class BufferedToken(object):
+    """Token created by a BufferLexer. Its value is only sliced from the
+    source if the parser asks for it"""
+
+    __slots__ = ('type', 'lineno', 'lexpos', 'endlexpos', 'buffer', 'index')
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+        self.type = full_tokens[buffer.types[index]]
+        self.lexpos = buffer.starts[index]
+        self.endlexpos = buffer.ends[index]
+        self.lineno = buffer.lines.line(self.lexpos)
+
+    @property
+    def value(self):
+        return self.buffer.value(self.index)
+
+    def __repr__(self):
+        return 'BufferedToken(%s,%r,%d,%d)' % (self.type, self.value, self.lineno, self.lexpos)
+
+class BufferLexer(object):
+    """Replays the tokens of a TokenBuffer with the interface the parser
+    expects from a lexer. Calling input() rewinds it"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.position = 0
+
+    @property
+    def lexdata(self):
+        return self.buffer.source
+
+    @property
+    def lexpos(self):
+        if self.position == 0:
+            return 0
+        return self.buffer.ends[self.position - 1]
+
+    @property
+    def lineno(self):
+        return self.buffer.lines.line(self.lexpos)
+
+    def input(self, input=None):
+        self.position = 0
+
+    def token(self):
+        if self.position >= len(self.buffer.types):
+            return None
+        t = BufferedToken(self.buffer, self.position)
+        self.position += 1
+        return t
+
+    def clone(self):
+        return BufferLexer(self.buffer)
+
 def run_on_argv1():
-    lex.runmain(full_lexer)
+    with open(sys.argv[1]) as file_handle:
+        data = file_handle.read()
+    full_lexer.input(data)
+    lines = LineIndex(data)
+    for t in full_lexer:
+        line, column = lines.position(t.lexpos)
+        sys.stdout.write('(%s,%r,%d,%d)\n' % (t.type, t.value, line, column))
@@ -1,4 +1,5 @@
 import os
+import re
 import sys
 from . import phplex
 from . import phpast as ast
@@ -42,48 +43,102 @@ precedence = (
     ('right', 'STATIC', 'ABSTRACT', 'FINAL', 'PRIVATE', 'PROTECTED', 'PUBLIC'),
 )
 
-def process_php_string_escapes(s):
-    # TODO: actual processing - turn php escape sequences into actual chars
-    res = ''
-    i = iter(s)
-    for c in i:
-        if c == '\\':
-            c = next(i)
-            if c == 'n':
-                res += '\n'
-            elif c == 'r':
-                res += '\r'
-            elif c == 't':
-                res += '\t'
-            elif c == '"':
-                res += '"'
-            elif c == "'":
-                res += "'"
-            elif c == 'x':
-                try:
-                    x = next(i)
-                except StopIteration:
-                    res += "\\x"
-                    break
-                try:
-                    x += next(i)
-                except StopIteration:
-                    # one character \xH sequence is actually valid in php
-                    pass
-
-                try:
-                    x = int(x, 16)
-                    res += chr(x)
-                except ValueError:
-                    # TODO: find out what php does with broken literals
-                    res += '\\x'+x
-            elif c == '\\':
-                res += '\\'
-            else:
-                res += c
-        else:
-            res += c
-    return res
+# Literals up to this length are interned like the names (see
+# phplex.interned_tokens), longer ones are unlikely to be repeated
+INTERN_MAX_LENGTH = 32
+
+def intern_literal(s):
+    if len(s) <= INTERN_MAX_LENGTH:
+        return sys.intern(s)
+    return s
+
+# Escape sequences of double quoted strings, heredocs and backticks: octal, hex,
+# unicode codepoint or a single character. Splitting on it gives the
+# literal chunks with the escape sequences in between
+php_escape_re = re.compile(r'(\\(?:[0-7]{1,3}|x[0-9A-Fa-f]{1,2}|u\{[0-9A-Fa-f]+\}|.))', re.DOTALL)
+
+# Maps escape sequences to what they decode to in double quoted strings.
+# Filled on the fly, as there are only a few hundred different sequences
+# besides \u{...}
+php_escapes = {
+    '\\n': '\n',
+    '\\r': '\r',
+    '\\t': '\t',
+    '\\v': '\v',
+    '\\e': '\x1b',
+    '\\f': '\f',
+    '\\\\': '\\',
+    '\\$': '$',
+    '\\"': '"',
+}
+
+# Like in php, only the delimiter of a string can be escaped: \" keeps its
+# backslash in heredocs and backticks, and \` is a backtick in backticks.
+# Maps the delimiters (None for heredocs) to their escape tables
+php_escape_tables = {
+    '"': php_escapes,
+    None: dict(php_escapes, **{'\\"': '\\"'}),
+    '`': dict(php_escapes, **{'\\"': '\\"', '\\`': '`'}),
+}
+
+def decode_php_escape(sequence, escapes=php_escapes):
+    kind = sequence[1]
+    if kind in '01234567':
+        # php wraps octal escapes above \377 around
+        char = chr(int(sequence[1:], 8) & 0xff)
+    elif kind == 'x' and len(sequence) > 2:
+        char = chr(int(sequence[2:], 16))
+    elif kind == 'u' and len(sequence) > 2 and int(sequence[3:-1], 16) <= 0x10ffff:
+        char = chr(int(sequence[3:-1], 16))
+    else:
+        # php keeps unknown (and broken) escape sequences as they are
+        char = sequence
+    if kind != 'u':
+        escapes[sequence] = char
+    return char
+
+def process_php_string_escapes(s, delimiter='"'):
+    """Decodes the escape sequences of the text of a string delimited by
+    delimiter: '"', '`' or None for heredocs"""
+    if '\\' not in s:
+        return s
+    chunks = php_escape_re.split(s)
+    escapes = php_escape_tables[delimiter]
+    chunks[1::2] = [escapes[sequence] if sequence in escapes else
+                    decode_php_escape(sequence, escapes)
+                    for sequence in chunks[1::2]]
+    return ''.join(chunks)
+
+class EncapsedText(str):
+    """Text of an encaps_list with its escape sequences not decoded yet. How
+    they decode depends on the kind of string, which is only known once the
+    whole string is reduced (see decode_encaps)"""
+    __slots__ = ()
+
+def encapsed_text(value, text):
+    """Returns value (the text so far) followed by the text of a token"""
+    if not isinstance(value, EncapsedText):
+        # An already decoded string (e.g. of '${"a"}'), escaped again
+        value = value.replace('\\', '\\\\')
+    return EncapsedText(value + text)
+
+def decode_text(text, delimiter):
+    return process_php_string_escapes(str(text), delimiter)
+
+def decode_encaps(value, delimiter):
+    """Decodes the EncapsedTexts of a reduced encaps_list: the list itself
+    or, in the BinaryOp('.') chain it is made of, the operands on the left
+    spine"""
+    if isinstance(value, EncapsedText):
+        return decode_text(value, delimiter)
+    node = value
+    while isinstance(node, ast.BinaryOp):
+        if isinstance(node.right, EncapsedText):
+            node.right = decode_text(node.right, delimiter)
+        if isinstance(node.left, EncapsedText):
+            node.left = decode_text(node.left, delimiter)
+        node = node.left
+    return value
 
 def p_start(p):
     'start : top_statement_list'
@@ -93,7 +148,8 @@ def p_top_statement_list(p):
     '''top_statement_list : top_statement_list top_statement
                           | empty'''
     if len(p) == 3:
-        p[0] = p[1] + [p[2]]
+        p[0] = p[1]
+        p[0].append(p[2])
     else:
         p[0] = []
 
@@ -131,7 +187,8 @@ def p_use_declarations(p):
     '''use_declarations : use_declarations COMMA use_declaration
                         | use_declaration'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -153,7 +210,8 @@ def p_constant_declarations(p):
     '''constant_declarations : constant_declarations COMMA constant_declaration
                              | constant_declaration'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -165,7 +223,8 @@ def p_inner_statement_list(p):
     '''inner_statement_list : inner_statement_list inner_statement
                             | empty'''
     if len(p) == 3:
-        p[0] = p[1] + [p[2]]
+        p[0] = p[1]
+        p[0].append(p[2])
     else:
         p[0] = []
 
@@ -365,7 +424,8 @@ def p_non_empty_for_expr(p):
     '''non_empty_for_expr : non_empty_for_expr COMMA expr
                           | expr'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -440,7 +500,8 @@ def p_global_var_list(p):
     '''global_var_list : global_var_list COMMA global_var
                        | global_var'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -459,7 +520,8 @@ def p_static_var_list(p):
     '''static_var_list : static_var_list COMMA static_var
                        | static_var'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -475,7 +537,8 @@ def p_echo_expr_list(p):
     '''echo_expr_list : echo_expr_list COMMA expr
                       | expr'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -483,7 +546,8 @@ def p_unset_variables(p):
     '''unset_variables : unset_variables COMMA unset_variable
                        | unset_variable'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -556,7 +620,8 @@ def p_trait_modifiers_list(p):
     '''trait_modifiers_list : trait_modifiers_list trait_modifier
                             | empty'''
     if len(p) == 3:
-        p[0] = p[1] + [p[2]]
+        p[0] = p[1]
+        p[0].append(p[2])
     else:
         p[0] = []
 
@@ -585,7 +650,8 @@ def p_trait_statement_list(p):
                             | empty'''
 
     if len(p) == 3:
-        p[0] = p[1] + [p[2]]
+        p[0] = p[1]
+        p[0].append(p[2])
     else:
         p[0] = []
 
@@ -609,7 +675,8 @@ def p_class_statement_list(p):
                             | empty'''
 
     if len(p) == 3:
-        p[0] = p[1] + [p[2]]
+        p[0] = p[1]
+        p[0].append(p[2])
     else:
         p[0] = []
 
@@ -659,7 +726,8 @@ def p_interface_list(p):
     '''interface_list : interface_list COMMA fully_qualified_class_name
                       | fully_qualified_class_name'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -697,7 +765,8 @@ def p_non_empty_member_modifiers(p):
     '''non_empty_member_modifiers : non_empty_member_modifiers member_modifier
                                   | member_modifier'''
     if len(p) == 3:
-        p[0] = p[1] + [p[2]]
+        p[0] = p[1]
+        p[0].append(p[2])
     else:
         p[0] = [p[1]]
 
@@ -723,7 +792,8 @@ def p_parameter_list(p):
     '''parameter_list : parameter_list COMMA parameter
                       | parameter'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -822,7 +892,8 @@ def p_dynamic_class_name_variable_properties(p):
     '''dynamic_class_name_variable_properties : dynamic_class_name_variable_properties dynamic_class_name_variable_property
                                               | empty'''
     if len(p) == 3:
-        p[0] = p[1] + [p[2]]
+        p[0] = p[1]
+        p[0].append(p[2])
     else:
         p[0] = []
 
@@ -850,7 +921,8 @@ def p_assignment_list(p):
     '''assignment_list : assignment_list COMMA assignment_list_element
                        | assignment_list_element'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -919,7 +991,8 @@ def p_function_call_variable(p):
 
 def p_function_call_backtick_shell_exec(p):
     'function_call : BACKTICK encaps_list BACKTICK'
-    p[0] = ast.FunctionCall('shell_exec', [ast.Parameter(p[2], False)], lineno=p.lineno(1))
+    p[0] = ast.FunctionCall('shell_exec', [ast.Parameter(decode_encaps(p[2], '`'), False)],
+                            lineno=p.lineno(1))
 
 def p_method_or_not(p):
     '''method_or_not : LPAREN function_call_parameter_list RPAREN
@@ -931,7 +1004,8 @@ def p_variable_properties(p):
     '''variable_properties : variable_properties variable_property
                            | empty'''
     if len(p) == 3:
-        p[0] = p[1] + [p[2]]
+        p[0] = p[1]
+        p[0].append(p[2])
     else:
         p[0] = []
 
@@ -1090,7 +1164,8 @@ def p_function_call_parameter_list(p):
     '''function_call_parameter_list : function_call_parameter_list COMMA function_call_parameter
                                     | function_call_parameter'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -1240,7 +1315,8 @@ def p_isset_variables(p):
     '''isset_variables : isset_variables COMMA variable
                        | variable'''
     if len(p) == 4:
-        p[0] = p[1] + [p[3]]
+        p[0] = p[1]
+        p[0].append(p[3])
     else:
         p[0] = [p[1]]
 
@@ -1306,15 +1382,18 @@ def p_scalar(p):
               | nowdoc
               | class_name_constant'''
     if len(p) == 4:
-        p[0] = p[2]
+        p[0] = decode_encaps(p[2], '"')
     elif len(p) == 5:
         if p[1] == 'b':
-            p[0] = p[3]
+            p[0] = decode_encaps(p[3], '"')
     else:
         p[0] = p[1]
+    if isinstance(p[0], string_type):
+        p[0] = intern_literal(p[0])
 
 def p_scalar_heredoc(p):
     'scalar_heredoc : START_HEREDOC encaps_list END_HEREDOC'
+    p[2] = decode_encaps(p[2], None)
     if isinstance(p[2], ast.BinaryOp):
         # due to how lexer works, the last operation is joining an unnecessary
         # newline character
@@ -1345,7 +1424,7 @@ def p_nowdoc_text_content(p):
 
 def p_scalar_string_varname(p):
     'scalar : STRING_VARNAME'
-    p[0] = ast.Variable('$' + p[1], lineno=p.lineno(1))
+    p[0] = ast.Variable(sys.intern('$' + p[1]), lineno=p.lineno(1))
 
 def p_scalar_namespace_name(p):
     '''scalar : namespace_name
@@ -1354,9 +1433,9 @@ def p_scalar_namespace_name(p):
     if len(p) == 2:
         p[0] = ast.Constant(p[1], lineno=p.lineno(1))
     elif len(p) == 3:
-        p[0] = ast.Constant(p[1] + p[2], lineno=p.lineno(1))
+        p[0] = ast.Constant(sys.intern(p[1] + p[2]), lineno=p.lineno(1))
     else:
-        p[0] = ast.Constant(p[1] + p[2] + p[3], lineno=p.lineno(1))
+        p[0] = ast.Constant(sys.intern(p[1] + p[2] + p[3]), lineno=p.lineno(1))
 
 def p_class_constant(p):
     '''class_constant : class_name DOUBLE_COLON STRING
@@ -1383,9 +1462,9 @@ def p_common_scalar_string(p):
                      | STRING CONSTANT_ENCAPSED_STRING'''
     if len(p) == 3:
         if p[1] == 'b':
-            p[0] = p[2][1:-1].replace("\\'", "'").replace('\\\\', '\\')
+            p[0] = intern_literal(p[2][1:-1].replace("\\'", "'").replace('\\\\', '\\'))
     else:
-        p[0] = p[1][1:-1].replace("\\'", "'").replace('\\\\', '\\')
+        p[0] = intern_literal(p[1][1:-1].replace("\\'", "'").replace('\\\\', '\\'))
 
 def p_common_scalar_magic_line(p):
     'common_scalar : LINE'
@@ -1432,7 +1511,7 @@ def p_static_scalar(p):
     elif len(p) == 3:
         p[0] = ''
     else:
-        p[0] = process_php_string_escapes(p[2])
+        p[0] = intern_literal(process_php_string_escapes(p[2]))
 
 def p_class_name_constant(p):
     'class_name_constant : class_name DOUBLE_COLON CLASS'
@@ -1444,7 +1523,7 @@ def p_static_heredoc(p):
     'static_heredoc : START_HEREDOC multiple_encapsed END_HEREDOC'
     # the last character is a newline because of how the lexer works, but it
     # doesn't belong in the result so drop it
-    p[0] = p[2][:-1]
+    p[0] = intern_literal(process_php_string_escapes(p[2][:-1], None))
 
 def p_multiple_encapsed(p):
     '''multiple_encapsed : multiple_encapsed ENCAPSED_AND_WHITESPACE
@@ -1544,7 +1623,7 @@ def p_namespace_name(p):
                       | STRING
                       | ARRAY'''
     if len(p) == 4:
-        p[0] = p[1] + p[2] + p[3]
+        p[0] = sys.intern(p[1] + p[2] + p[3])
     else:
         p[0] = p[1]
 
@@ -1561,21 +1640,21 @@ def p_encaps_list(p):
 
 def p_encaps_list_string(p):
     'encaps_list : encaps_list ENCAPSED_AND_WHITESPACE'
-    p2 = process_php_string_escapes(p[2])
+    # The escapes are decoded by the rule of the whole string
+    p2 = EncapsedText(p[2])
     if p[1] == '':
-        p[0] = process_php_string_escapes(p[2])
+        p[0] = p2
     else:
         if isinstance(p[1], string_type):
             # if it's only a string so far, just append the contents
-            p[0] = p[1] + process_php_string_escapes(p[2])
+            p[0] = encapsed_text(p[1], p[2])
         elif isinstance(p[1], ast.BinaryOp) and isinstance(p[1].right, string_type):
             # if the last right leaf is a string, extend previous binop
-            p[0] = ast.BinaryOp('.', p[1].left, p[1].right + process_php_string_escapes(p[2]),
+            p[0] = ast.BinaryOp('.', p[1].left, encapsed_text(p[1].right, p[2]),
                                 lineno=p[1].lineno)
         else:
             # worst case - insert a binaryop
-            p[0] = ast.BinaryOp('.', p[1], process_php_string_escapes(p[2]),
-                                lineno=p.lineno(2))
+            p[0] = ast.BinaryOp('.', p[1], p2, lineno=p.lineno(2))
 
 def p_encaps_var(p):
     'encaps_var : VARIABLE'
@@ -1630,9 +1709,162 @@ def p_error(t):
          raise Exception('unexpected EOF while parsing')
 '''
 
+def symbol_span(symbols):
+    """Returns (start, end) of the source code covered by the grammar
+    symbols, or None if they are all empty. Empty productions don't have an
+    endlexpos and their lexpos is not reliable (PLY takes it from the lexer,
+    which is already past the lookahead), so they are skipped"""
+    for symbol in symbols:
+        if hasattr(symbol, 'endlexpos'):
+            start = symbol.lexpos
+            break
+    else:
+        return None
+    for symbol in reversed(symbols):
+        if hasattr(symbol, 'endlexpos'):
+            return start, symbol.endlexpos
+
+def track_spans(rule):
+    """Wraps a grammar rule so that the nodes it builds are given the span
+    of the source code they were parsed from. Requires parsing with
+    tracking=True and a lexer setting endlexpos on the tokens"""
+    def tracking_rule(p):
+        symbols = p.slice
+        result = symbols[0]
+        # Without tracking, PLY gives nonterminals no line number (and
+        # p.lineno() returns 0 for them) unless the rule sets one. Keep it
+        # that way so that the trees are the same with and without spans
+        result.lineno = 0
+        rule(p)
+        span = symbol_span(symbols[1:])
+        if span is None:
+            if hasattr(result, 'endlexpos'):
+                del result.endlexpos
+            return
+        result.lexpos, result.endlexpos = span
+
+        value = result.value
+        if isinstance(value, list) and value and isinstance(value[-1], ast.Node):
+            # List rules ('items : items COMMA item') that build their new
+            # item in place: the item covers everything after the list
+            if len(symbols) > 2 and isinstance(symbols[1].value, list):
+                items = symbols[2:]
+                if items[0].type == 'COMMA':
+                    items = items[1:]
+                span = symbol_span(items)
+                if span is None:
+                    return
+            value = value[-1]
+        if isinstance(value, ast.Node) and value.lexpos is None:
+            value.lexpos, value.endlexpos = span
+            if type(value) is ast.InlineHTML:
+                value.share_source(p.lexer.lexdata)
+    tracking_rule.__name__ = rule.__name__
+    return tracking_rule
+
+# Grammar rules used instead of the default ones by parsers made with
+# concat=True (see make_parser). They build flat Concat and
+# InterpolatedString nodes instead of BinaryOp('.') chains, and are not
+# named p_* so that yacc does not take them as rules of their own
+
+def concat_expr(p):
+    '''expr : expr CONCAT expr
+       static_expr : static_expr CONCAT static_expr'''
+    if type(p[1]) is ast.Concat:
+        p[0] = p[1]
+        p[0].nodes.append(p[3])
+        if p[0].lexpos is not None:
+            # Let track_spans give it the span including the new operand
+            p[0].lexpos = None
+    else:
+        p[0] = ast.Concat([p[1], p[3]], lineno=p.lineno(2))
+
+def interpolated_encaps_list(p):
+    '''encaps_list : encaps_list encaps_var
+                   | empty'''
+    if len(p) == 3:
+        p[0] = p[1]
+        p[0].append(p[2])
+    else:
+        p[0] = []
+
+def interpolated_encaps_list_string(p):
+    'encaps_list : encaps_list ENCAPSED_AND_WHITESPACE'
+    p[0] = p[1]
+    if p[0] and isinstance(p[0][-1], string_type):
+        p[0][-1] = encapsed_text(p[0][-1], p[2])
+    else:
+        p[0].append(EncapsedText(p[2]))
+
+def decode_parts(parts, delimiter):
+    """Decodes the EncapsedTexts of the parts of an encaps_list"""
+    return [decode_text(part, delimiter) if isinstance(part, EncapsedText) else part
+            for part in parts]
+
+def interpolated_string(parts, lineno):
+    """Turns the decoded parts of an encaps_list into an InterpolatedString,
+    or a plain string if nothing is interpolated"""
+    if not parts:
+        return ''
+    if len(parts) == 1 and isinstance(parts[0], string_type):
+        return intern_literal(parts[0])
+    return ast.InterpolatedString(parts, lineno=lineno)
+
+def interpolated_scalar(p):
+    '''scalar : QUOTE encaps_list QUOTE
+              | STRING QUOTE encaps_list QUOTE'''
+    if len(p) == 4:
+        p[0] = interpolated_string(decode_parts(p[2], '"'), p.lineno(1))
+    elif p[1] == 'b':
+        p[0] = interpolated_string(decode_parts(p[3], '"'), p.lineno(2))
+
+def interpolated_heredoc(p):
+    'scalar_heredoc : START_HEREDOC encaps_list END_HEREDOC'
+    parts = decode_parts(p[2], None)
+    # due to how lexer works, the last part ends with an unnecessary newline
+    # character
+    if parts and isinstance(parts[-1], string_type):
+        parts[-1] = parts[-1][:-1]
+        if not parts[-1]:
+            parts.pop()
+    p[0] = interpolated_string(parts, p.lineno(1))
+
+def interpolated_shell_exec(p):
+    'function_call : BACKTICK encaps_list BACKTICK'
+    command = interpolated_string(decode_parts(p[2], '`'), p.lineno(1))
+    p[0] = ast.FunctionCall('shell_exec', [ast.Parameter(command, False)], lineno=p.lineno(1))
+
+# Maps productions to the rules they get with concat=True
+concat_rules = {
+    'expr -> expr CONCAT expr': concat_expr,
+    'static_expr -> static_expr CONCAT static_expr': concat_expr,
+    'encaps_list -> encaps_list encaps_var': interpolated_encaps_list,
+    'encaps_list -> empty': interpolated_encaps_list,
+    'encaps_list -> encaps_list ENCAPSED_AND_WHITESPACE': interpolated_encaps_list_string,
+    'scalar -> QUOTE encaps_list QUOTE': interpolated_scalar,
+    'scalar -> STRING QUOTE encaps_list QUOTE': interpolated_scalar,
+    'scalar_heredoc -> START_HEREDOC encaps_list END_HEREDOC': interpolated_heredoc,
+    'function_call -> BACKTICK encaps_list BACKTICK': interpolated_shell_exec,
+}
+
 # Build the grammar
-def make_parser(debug=True):
-    return yacc.yacc(debug=debug)
+def make_parser(debug=True, spans=False, concat=False):
+    """Builds the parser. With spans, the grammar rules are wrapped to give
+    the nodes their start and end offsets; such a parser must be called
+    with tracking=True. With concat, '.' chains and interpolated strings are
+    parsed to Concat and InterpolatedString nodes (see concat_rules)"""
+    parser = yacc.yacc(debug=debug)
+    if concat:
+        for production in parser.productions:
+            rule = concat_rules.get(production.str)
+            if rule is not None:
+                production.callable = rule
+                production.func = rule.__name__
+    if spans:
+        for production in parser.productions:
+            if production.callable is not None:
+                production.callable = track_spans(production.callable)
+    return parser
 
 def main():
     import argparse
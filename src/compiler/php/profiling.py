@@ -0,0 +1,169 @@
+"""Opt-in profiling of the PHP parser.
+
+A ParseProfile parses with its own instrumented copy of the parser: every
+grammar rule is wrapped to count its reductions and time its semantic
+action, and the lexers it is given count the tokens read in each lexer
+state. The results are kept per file and for the whole corpus, and
+report() ranks them.
+
+    profile = ParseProfile()
+    tree = SyntaxTree(file_handle, profile=profile)
+    print(profile.report())
+"""
+
+import os
+import time
+
+from collections import defaultdict
+
+from . import lalr
+from . import phpparse
+
+
+class RuleStats(object):
+    """Reductions of one production and the time spent in its action"""
+
+    __slots__ = ('count', 'time')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+
+class FileProfile(object):
+    """ Statistics of the files parsed under one name
+
+    Attributes:
+        - rules: Maps production strings (e.g. 'expr -> variable') to
+          RuleStats
+        - states: Maps lexer states to the number of tokens read in them
+        - parse_time: Total time spent parsing (lexing included)
+    """
+
+    def __init__(self):
+        self.rules = defaultdict(RuleStats)
+        self.states = defaultdict(int)
+        self.parse_time = 0.0
+        self.parses = 0
+
+    def add(self, other):
+        for production, stats in other.rules.items():
+            totals = self.rules[production]
+            totals.count += stats.count
+            totals.time += stats.time
+        for state, count in other.states.items():
+            self.states[state] += count
+        self.parse_time += other.parse_time
+        self.parses += other.parses
+
+
+class ParseProfile(object):
+    """ Collects reduction counts, action times and token counts
+
+    Methods:
+        - parse(source_code, lexer, file_name): Parses source_code with the
+          instrumented parser, accounting it to file_name
+        - report(file_name=None, limit=20, sort='time'): Returns the ranked
+          report for a file or (with None) the whole corpus
+
+    Attributes:
+        - corpus: FileProfile with the totals of all the files
+        - files: Maps file names to their FileProfile
+    """
+
+    def __init__(self):
+        self.corpus = FileProfile()
+        self.files = {}
+        # Statistics of the file being parsed
+        self.current = None
+        # Maps production strings to their rule function
+        self.functions = {}
+
+        # Instrument a parser of our own, so that the other parsers don't
+        # pay for the profiling
+        ply_parser = phpparse.make_parser()
+        for production in ply_parser.productions:
+            if production.callable is not None:
+                self.functions[production.str] = production.func
+                production.callable = self.instrument(production.callable, production.str)
+        self.parser = lalr.Parser(ply_parser)
+
+    def instrument(self, rule, production):
+        clock = time.perf_counter
+
+        def profiled_rule(p):
+            start = clock()
+            try:
+                rule(p)
+            finally:
+                stats = self.current.rules[production]
+                stats.count += 1
+                stats.time += clock() - start
+        profiled_rule.__name__ = rule.__name__
+        return profiled_rule
+
+    def count_tokens(self, lexer):
+        """Makes lexer (a FilteredLexer) count the tokens read in each state"""
+        next_lexer_token = lexer.next_lexer_token
+        raw_lexer = lexer.lexer
+
+        def counting_next_lexer_token():
+            state = raw_lexer.lexstate
+            t = next_lexer_token()
+            if t is not None:
+                self.current.states[state] += 1
+            return t
+        lexer.next_lexer_token = counting_next_lexer_token
+
+    def parse(self, source_code, lexer, file_name=None):
+        """lexer should be a fresh clone, e.g. phplex.lexer.clone()"""
+        if hasattr(lexer, 'next_lexer_token'):
+            self.count_tokens(lexer)
+        self.current = FileProfile()
+        start = time.perf_counter()
+        try:
+            return self.parser.parse(source_code, lexer=lexer)
+        finally:
+            self.current.parse_time = time.perf_counter() - start
+            self.current.parses = 1
+            self.corpus.add(self.current)
+            if file_name in self.files:
+                self.files[file_name].add(self.current)
+            else:
+                self.files[file_name] = self.current
+            self.current = None
+
+    def report(self, file_name=None, limit=20, sort='time'):
+        """sort is 'time' or 'count'"""
+        if file_name is None:
+            stats = self.corpus
+            title = f"Parse profile of {len(self.files)} files"
+        else:
+            # SyntaxTree accounts the files to their absolute paths
+            if file_name not in self.files:
+                file_name = os.path.abspath(file_name)
+            stats = self.files[file_name]
+            title = f"Parse profile of {file_name}"
+
+        total_count = sum(rule.count for rule in stats.rules.values()) or 1
+        total_time = sum(rule.time for rule in stats.rules.values()) or 1.0
+        lines = [title,
+                 f"Parse time {stats.parse_time:.3f}s, {total_count} reductions, "
+                 f"{total_time:.3f}s in actions",
+                 "",
+                 f"{'reductions':>10} {'%':>6} {'time (ms)':>10} {'%':>6} {'us/call':>8}  rule: production"]
+
+        key = (lambda item: item[1].time) if sort == 'time' else (lambda item: item[1].count)
+        ranked = sorted(stats.rules.items(), key=key, reverse=True)
+        for production, rule in ranked[:limit]:
+            lines.append(f"{rule.count:>10} {100.0 * rule.count / total_count:>6.2f} "
+                         f"{rule.time * 1000:>10.2f} {100.0 * rule.time / total_time:>6.2f} "
+                         f"{rule.time * 1e6 / rule.count:>8.2f}  "
+                         f"{self.functions[production]}: {production}")
+
+        total_tokens = sum(stats.states.values()) or 1
+        lines.append("")
+        lines.append(f"{'tokens':>10} {'%':>6}  lexer state")
+        for state, count in sorted(stats.states.items(), key=lambda item: item[1], reverse=True):
+            lines.append(f"{count:>10} {100.0 * count / total_tokens:>6.2f}  {state}")
+        return "\n".join(lines)
@@ -1,5 +1,21 @@
 """Base Classes for Different Components"""
 
+from src.compiler.php import phpast
+from src.modules.php import syntax_tree
+
+# How traversers treat SyntaxTrees that are grafted into several places of
+# the tree (e.g. the same file included from many Include nodes):
+#  - visit: walk the subtree again at every site (default)
+#  - once: walk the subtree at its first site only
+#  - replay: walk the subtree at its first site and replay the visitors'
+#    memoized results at every other site
+SHARED_SUBTREE_MODES = ("visit", "once", "replay")
+
+# Kinds of the events recorded for the replay: an item entered (and
+# visited, if it is a Node), or a Node left
+ENTER, LEAVE = "enter", "leave"
+
+
 class Traverser():
     def register_visitor(self, new_visitor) -> None:
         """called when a new Visitor is added to the traverser
@@ -13,8 +29,105 @@ class Traverser():
         """
         pass
 
+    def init_shared_subtrees(self, mode):
+        """Sets up the bookkeeping for the shared subtree 'mode'. Should be
+        called from the __init__ of traversers that support it
+        """
+        if mode not in SHARED_SUBTREE_MODES:
+            raise Exception(f"Unknown shared subtree mode '{mode}'")
+        self.shared_subtrees = mode
+        # Maps ids of the walked subtrees to the subtrees so that the ids
+        # cannot be reused while the traverser is alive
+        self.seen_subtrees = {}
+        # Maps ids of the walked subtrees to (events, memos)
+        self.subtree_memos = {}
+        # Stack of (prefix length, events) for the subtrees being walked,
+        # the events being (kind, item, namespace_stack suffix). Only used
+        # when some visitor does not memoize subtrees itself
+        self.recordings = []
+
+    def is_shared_subtree(self, node):
+        return isinstance(node, syntax_tree.SyntaxTree)
+
+    def begin_traversal(self):
+        """Marks the root as walked, so that included files looping back to
+        it are not walked again in 'once' and 'replay' modes
+        """
+        if self.shared_subtrees != "visit":
+            self.seen_subtrees[id(self.syntax_tree)] = self.syntax_tree
+
+    def record_event(self, item, kind=ENTER):
+        """Records that 'item' was entered (or left) with the current
+        namespace_stack in every subtree that is being walked for the first
+        time
+        """
+        for prefix_length, events in self.recordings:
+            events.append((kind, item, self.namespace_stack[prefix_length:]))
+
+    def begin_subtree(self, subtree):
+        """Called with the namespace_stack of the site before a shared
+        subtree is walked for the first time
+        """
+        self.seen_subtrees[id(subtree)] = subtree
+        for visitor in self.visitors:
+            if visitor.memoizes_subtrees:
+                visitor.enter_subtree(subtree)
+        if not all(visitor.memoizes_subtrees for visitor in self.visitors):
+            self.recordings.append((len(self.namespace_stack), []))
+
+    def end_subtree(self, subtree):
+        """Called after the first walk of a shared subtree is over"""
+        events = None
+        if not all(visitor.memoizes_subtrees for visitor in self.visitors):
+            events = self.recordings.pop()[1]
+        memos = {}
+        for visitor in self.visitors:
+            if visitor.memoizes_subtrees:
+                memos[id(visitor)] = visitor.leave_subtree(subtree)
+        self.subtree_memos[id(subtree)] = (events, memos)
+
+    def replay_subtree(self, subtree):
+        """Called with the namespace_stack of the site instead of walking
+        an already walked shared subtree again
+        """
+        if id(subtree) not in self.subtree_memos:
+            # The subtree includes itself and its first walk is not over yet
+            return
+        events, memos = self.subtree_memos[id(subtree)]
+        for visitor in self.visitors:
+            if visitor.memoizes_subtrees:
+                visitor.replay_subtree(subtree, memos[id(visitor)])
+
+        if events is None:
+            return
+        # Visitors that do not memoize get the recorded calls replayed, in
+        # the order of the first walk (so a node is left after its children
+        # in depth-first traversals)
+        visitors = [visitor for visitor in self.visitors if not visitor.memoizes_subtrees]
+        prefix = [*self.namespace_stack]
+        for kind, item, suffix in events:
+            self.namespace_stack[:] = prefix + suffix
+            self.record_event(item, kind)
+            if kind == LEAVE:
+                for visitor in visitors:
+                    visitor.leave(item)
+                continue
+            for visitor in visitors:
+                visitor.enter(item)
+            if not isinstance(item, phpast.Node):
+                continue
+            for visitor in visitors:
+                item.accept(visitor)
+        self.namespace_stack[:] = prefix
+
 
 class Visitor():
+    # Visitors that set this to True are given the chance to memoize what
+    # they collect inside shared subtrees (see enter_subtree, leave_subtree
+    # and replay_subtree). Otherwise traversers in 'replay' mode record and
+    # replay the enter/visit/leave calls for them
+    memoizes_subtrees = False
+
     def enter(self, current_node):
         """Called when the visitors enters the node. 'current_node' may be of
         any type including Node. This method is optional
@@ -40,3 +153,22 @@ class Visitor():
         (e.g. namespace_stack) required
         """
         pass
+
+    def enter_subtree(self, subtree) -> None:
+        """Called in 'replay' mode before a shared subtree is walked for the
+        first time. The traverser's namespace_stack holds the stack of the
+        site at this point
+        """
+        pass
+
+    def leave_subtree(self, subtree):
+        """Called in 'replay' mode after the first walk of a shared subtree.
+        The returned memo is passed to replay_subtree at every other site
+        """
+        return None
+
+    def replay_subtree(self, subtree, memo) -> None:
+        """Called in 'replay' mode instead of walking a shared subtree again.
+        The traverser's namespace_stack holds the stack of the new site
+        """
+        pass
@@ -0,0 +1,523 @@
+"""Control-flow graphs of functions, methods, closures and files.
+
+A ControlFlowGraph splits a body into basic blocks, numbered from 0. Block
+0 is the entry and block 1 the exit, which is empty and is reached by
+returns, uncaught throws, exits and the end of the body. The blocks hold
+the nodes they run, in order:
+ - simple statements (expressions, Echo, Return, Throw, Global, nested
+   declarations, ...) as they are
+ - for the statements that branch, the expression that decides (a node
+   or a literal): the expr of If, ElseIf, While, DoWhile, Switch and Case,
+   and the test expressions of For (the start and count expressions are
+   statements of their own)
+ - the Foreach node itself, at the head of the loop, standing for fetching
+   the next element into its key and value variables
+ - the Catch nodes, at the start of the handlers, standing for binding the
+   exception to their variable
+The nodes are the nodes of the tree, not copies. Nested functions, classes
+and closures are not part of the graph (closures get graphs of their own).
+
+The graph is stored in flat arrays: the nodes of all the blocks in one
+list and the successors of all the blocks in one array, both indexed
+through arrays of offsets, as in a compressed sparse row matrix.
+
+Graphs are built with build_cfg(node), or through a CFGCache, which builds
+the graph of a function the first time it is asked for and then returns the
+same graph for as long as the structural hash of the function (see
+phpast.Node.structural_hash) does not change:
+
+    cache = CFGCache()
+    cfg = cache.get(function)
+    for index in cfg.reverse_post_order():
+        print(index, cfg.block(index), list(cfg.successors(index)))
+"""
+
+from array import array
+
+from src.compiler.php import phpast
+from src.modules.php import syntax_tree
+
+ENTRY = 0
+EXIT = 1
+
+
+class ControlFlowGraph:
+    """ Basic blocks of a body and the edges between them
+
+    Methods:
+        - block(index): Returns the nodes of a block
+        - successors(index), predecessors(index): Return the indexes of the
+          blocks following (preceding) a block
+        - reverse_post_order(): Returns the indexes of the blocks reachable
+          from the entry, in reverse post-order of a depth-first walk
+        - edges(): Yields all the edges as (block, successor)
+
+    Attributes:
+        - node: The Function, Method, Closure or SyntaxTree the graph is for
+        - nodes: The nodes of all the blocks, block after block
+        - block_starts: Offsets in nodes where the blocks start, with the
+          end of the last block at the end
+        - successor_starts, successor_list: The same for the successors of
+          the blocks
+    """
+
+    def __init__(self, node, nodes, block_starts, successor_starts, successor_list):
+        self.node = node
+        self.nodes = nodes
+        self.block_starts = block_starts
+        self.successor_starts = successor_starts
+        self.successor_list = successor_list
+        self.predecessor_starts = None
+        self.predecessor_list = None
+        self.order = None
+
+    def __len__(self):
+        return len(self.block_starts) - 1
+
+    def block(self, index):
+        return self.nodes[self.block_starts[index]:self.block_starts[index + 1]]
+
+    def successors(self, index):
+        return self.successor_list[self.successor_starts[index]:self.successor_starts[index + 1]]
+
+    def predecessors(self, index):
+        if self.predecessor_starts is None:
+            # Built the first time they are needed
+            counts = [0] * (len(self) + 1)
+            for _, successor in self.edges():
+                counts[successor + 1] += 1
+            for block in range(len(self)):
+                counts[block + 1] += counts[block]
+            predecessor_list = array("I", bytes(4 * len(self.successor_list)))
+            filled = counts[:]
+            for block, successor in self.edges():
+                predecessor_list[filled[successor]] = block
+                filled[successor] += 1
+            self.predecessor_starts = array("I", counts)
+            self.predecessor_list = predecessor_list
+        return self.predecessor_list[self.predecessor_starts[index]:
+                                     self.predecessor_starts[index + 1]]
+
+    def edges(self):
+        for block in range(len(self)):
+            for successor in self.successors(block):
+                yield block, successor
+
+    def reverse_post_order(self):
+        if self.order is None:
+            visited = bytearray(len(self))
+            post_order = []
+            # Each frame is (block, offset of its next successor to visit)
+            visited[ENTRY] = 1
+            stack = [(ENTRY, self.successor_starts[ENTRY])]
+            while stack:
+                block, position = stack[-1]
+                if position < self.successor_starts[block + 1]:
+                    stack[-1] = (block, position + 1)
+                    successor = self.successor_list[position]
+                    if not visited[successor]:
+                        visited[successor] = 1
+                        stack.append((successor, self.successor_starts[successor]))
+                else:
+                    stack.pop()
+                    post_order.append(block)
+            post_order.reverse()
+            self.order = array("I", post_order)
+        return self.order
+
+    def __repr__(self):
+        return f"ControlFlowGraph({type(self.node).__name__}, {len(self)} blocks)"
+
+
+class Target:
+    """Where break and continue go from inside a loop or switch"""
+
+    __slots__ = ("break_block", "continue_block")
+
+    def __init__(self, break_block, continue_block):
+        self.break_block = break_block
+        self.continue_block = continue_block
+
+
+class CFGBuilder:
+    """Builds the ControlFlowGraph of one body. The statements do not
+    recurse on their nesting: the nested statements, and the steps that
+    finish a statement after them, are pushed on a stack of pending work,
+    so that deeply nested code does not hit the recursion limit"""
+
+    def __init__(self):
+        self.blocks = [[], []]
+        self.successors = [[], []]
+        # Block the next statement goes to, None after a jump (a new block
+        # is only started if a statement follows)
+        self.current = ENTRY
+        # Innermost loop or switch last
+        self.targets = []
+        # Number of try bodies the statements are in
+        self.try_depth = 0
+        # Entry blocks of the enclosing finally clauses, innermost last,
+        # and whether a return or throw goes through them
+        self.finally_blocks = []
+        self.finally_leaves = []
+        # Statements (nodes or lists) and steps (functions) still to run,
+        # the next one last
+        self.pending = []
+
+    def new_block(self):
+        self.blocks.append([])
+        self.successors.append([])
+        return len(self.blocks) - 1
+
+    def edge(self, source, target):
+        if source is not None and target not in self.successors[source]:
+            self.successors[source].append(target)
+
+    def add(self, node):
+        if self.current is None:
+            self.current = self.new_block()
+        self.blocks[self.current].append(node)
+
+    def jump(self, target):
+        """Ends the current block with a jump to target"""
+        self.edge(self.current, target)
+        self.current = None
+
+    def start(self, block):
+        """Continues from the current block into block"""
+        self.edge(self.current, block)
+        self.current = block
+
+    def resume(self, block):
+        """Continues in block, with no edge from the current block"""
+        self.current = block
+
+    def leave(self):
+        """Returns the block a return or uncaught throw goes to: the
+        innermost finally clause or the exit"""
+        if self.finally_blocks:
+            self.finally_leaves[-1] = True
+            return self.finally_blocks[-1]
+        return EXIT
+
+    def build(self, node, body):
+        self.schedule(body)
+        self.run()
+        self.jump(EXIT)
+
+        nodes = []
+        block_starts = array("I", [0])
+        successor_list = array("I")
+        successor_starts = array("I", [0])
+        for block, successors in zip(self.blocks, self.successors):
+            nodes.extend(block)
+            block_starts.append(len(nodes))
+            successor_list.extend(successors)
+            successor_starts.append(len(successor_list))
+        return ControlFlowGraph(node, nodes, block_starts, successor_starts, successor_list)
+
+    def schedule(self, *steps):
+        """Runs the statements and steps, in order, before the work already
+        pending"""
+        self.pending.extend(reversed(steps))
+
+    def run(self):
+        pending = self.pending
+        while pending:
+            item = pending.pop()
+            if isinstance(item, list):
+                pending.extend(reversed(item))
+            elif isinstance(item, phpast.Node):
+                self.statement(item)
+            elif callable(item):
+                item()
+
+    def statement(self, node):
+        kind = type(node)
+
+        if kind is phpast.Block or kind is phpast.Namespace:
+            self.schedule(node.nodes or [])
+        elif kind is phpast.Declare:
+            self.schedule(node.node)
+        elif kind is phpast.If:
+            self.if_statement(node)
+        elif kind is phpast.While:
+            self.while_statement(node)
+        elif kind is phpast.DoWhile:
+            self.do_while_statement(node)
+        elif kind is phpast.For:
+            self.for_statement(node)
+        elif kind is phpast.Foreach:
+            self.foreach_statement(node)
+        elif kind is phpast.Switch:
+            self.switch_statement(node)
+        elif kind is phpast.Try:
+            self.try_statement(node)
+        elif kind is phpast.Break or kind is phpast.Continue:
+            self.add(node)
+            levels = node.node if isinstance(node.node, int) and node.node > 0 else 1
+            if levels > len(self.targets):
+                # Not inside enough loops, a fatal error in PHP
+                self.jump(EXIT)
+                return
+            target = self.targets[-levels]
+            self.jump(target.break_block if kind is phpast.Break else target.continue_block)
+        elif kind is phpast.Return or kind is phpast.Exit:
+            self.add(node)
+            self.jump(EXIT if kind is phpast.Exit else self.leave())
+        elif kind is phpast.Throw:
+            self.add(node)
+            if self.try_depth:
+                # Every block of a try body is linked to its handlers
+                self.current = None
+            else:
+                self.jump(self.leave())
+        else:
+            self.add(node)
+
+    def condition(self, expr):
+        """Adds the expr deciding a branch and returns the block it ends"""
+        self.add(expr)
+        return self.current
+
+    def if_statement(self, node):
+        after = self.new_block()
+        branch = self.condition(node.expr)
+
+        def open_clause(clause):
+            nonlocal branch
+            if clause is not node:
+                self.current = self.new_block()
+                self.edge(branch, self.current)
+                branch = self.condition(clause.expr)
+            self.current = self.new_block()
+            self.edge(branch, self.current)
+
+        def open_else():
+            self.current = self.new_block()
+            self.edge(branch, self.current)
+
+        steps = []
+        for clause in [node] + list(node.elseifs or []):
+            steps += [lambda clause=clause: open_clause(clause), clause.node,
+                      lambda: self.jump(after)]
+        if node.else_ is not None:
+            steps += [open_else, node.else_.node, lambda: self.jump(after)]
+        else:
+            steps.append(lambda: self.edge(branch, after))
+        self.schedule(*steps, lambda: self.resume(after))
+
+    def loop(self, head, after, continue_block=None):
+        """Starts the body of a loop, returns the step ending it"""
+        self.targets.append(Target(after, head if continue_block is None else continue_block))
+        self.current = self.new_block()
+        self.edge(head, self.current)
+        return self.targets.pop
+
+    def while_statement(self, node):
+        head = self.new_block()
+        after = self.new_block()
+        self.start(head)
+        self.condition(node.expr)
+        self.edge(head, after)
+        end_loop = self.loop(head, after)
+        self.schedule(node.node, end_loop, lambda: self.jump(head), lambda: self.resume(after))
+
+    def do_while_statement(self, node):
+        body = self.new_block()
+        test = self.new_block()
+        after = self.new_block()
+        self.start(body)
+        self.targets.append(Target(after, test))
+
+        def end_loop():
+            self.targets.pop()
+            self.start(test)
+            self.condition(node.expr)
+            self.edge(test, body)
+            self.edge(test, after)
+            self.current = after
+        self.schedule(node.node, end_loop)
+
+    def for_statement(self, node):
+        for expr in node.start or []:
+            self.add(expr)
+        head = self.new_block()
+        count = self.new_block()
+        after = self.new_block()
+        self.start(head)
+        for expr in node.test or []:
+            self.add(expr)
+        if node.test:
+            # Without a test the loop is only left by a break
+            self.edge(head, after)
+        end_loop = self.loop(head, after, continue_block=count)
+
+        def next_iteration():
+            self.start(count)
+            for expr in node.count or []:
+                self.add(expr)
+            self.jump(head)
+            self.current = after
+        self.schedule(node.node, end_loop, next_iteration)
+
+    def foreach_statement(self, node):
+        self.add(node.expr)
+        head = self.new_block()
+        after = self.new_block()
+        self.start(head)
+        self.add(node)
+        self.edge(head, after)
+        end_loop = self.loop(head, after)
+        self.schedule(node.node, end_loop, lambda: self.jump(head), lambda: self.resume(after))
+
+    def switch_statement(self, node):
+        after = self.new_block()
+        test = self.condition(node.expr)
+        # Continue in a switch acts like break
+        self.targets.append(Target(after, after))
+        default = None
+        previous_body = None
+
+        def open_case(case):
+            nonlocal test, default
+            body = self.new_block()
+            if isinstance(case, phpast.Case):
+                self.current = self.new_block()
+                self.edge(test, self.current)
+                test = self.condition(case.expr)
+                self.edge(test, body)
+            else:
+                default = body
+            # Falls through from the previous case
+            self.current = previous_body
+            self.start(body)
+
+        def close_case():
+            nonlocal previous_body
+            previous_body = self.current
+
+        def end_switch():
+            self.edge(test, after if default is None else default)
+            self.current = previous_body
+            self.jump(after)
+            self.targets.pop()
+            self.current = after
+
+        steps = []
+        for case in node.nodes or []:
+            steps += [lambda case=case: open_case(case), case.nodes or [], close_case]
+        self.schedule(*steps, end_switch)
+
+    def try_statement(self, node):
+        catches = list(node.catches or [])
+        finally_ = getattr(node, "finally")
+        after = self.new_block()
+        handler_blocks = [self.new_block() for _ in catches]
+        finally_block = self.new_block() if finally_ is not None else None
+        end = after if finally_block is None else finally_block
+
+        if finally_block is not None:
+            self.finally_blocks.append(finally_block)
+            self.finally_leaves.append(False)
+        # Any block of the body can throw to any of the handlers, and so can
+        # its first statement, before anything of the body has run
+        entry = self.current
+        first = len(self.blocks)
+        self.try_depth += 1
+        self.start(self.new_block())
+
+        def end_body():
+            self.try_depth -= 1
+            body_end = self.current
+            for block in [entry] + list(range(first, len(self.blocks))):
+                for handler in handler_blocks or [finally_block]:
+                    self.edge(block, handler)
+            if not handler_blocks:
+                # The exceptions go on after the finally clause
+                self.leave()
+            self.current = body_end
+            self.jump(end)
+
+        def open_catch(catch, block):
+            self.current = block
+            self.add(catch)
+
+        leaves = False
+
+        def open_finally():
+            nonlocal leaves
+            self.finally_blocks.pop()
+            leaves = self.finally_leaves.pop()
+            self.current = finally_block
+
+        def end_finally():
+            if leaves:
+                # Continues with the return (or throw) that went through it
+                self.edge(self.current, self.leave())
+            self.jump(after)
+
+        steps = [node.nodes or [], end_body]
+        for catch, block in zip(catches, handler_blocks):
+            steps += [lambda catch=catch, block=block: open_catch(catch, block),
+                      catch.nodes or [], lambda: self.jump(end)]
+        if finally_block is not None:
+            steps += [open_finally, finally_.nodes or [], end_finally]
+        self.schedule(*steps, lambda: self.resume(after))
+
+
+def body_of(node):
+    """Returns the statements a graph is built for"""
+    if isinstance(node, (phpast.Function, phpast.Method, phpast.Closure)):
+        return node.nodes or []
+    if isinstance(node, (syntax_tree.SyntaxTree, phpast.Block)):
+        return node.nodes or []
+    if isinstance(node, list):
+        return node
+    raise Exception(f"No control-flow graph for {type(node).__name__}")
+
+
+def build_cfg(node):
+    """Returns the ControlFlowGraph of a Function, Method, Closure,
+    SyntaxTree (the top-level code of a file) or list of statements"""
+    return CFGBuilder().build(node, body_of(node))
+
+
+class CFGCache:
+    """ ControlFlowGraphs built on demand and kept by the structural hash
+    (with line numbers) of their functions
+
+    Methods:
+        - get(node): Returns the graph of node, building it if the cache has
+          none for its structural hash
+        - clear(): Forgets all the graphs
+
+    Attributes:
+        - graphs: Maps structural hashes to graphs
+        - built, reused: Number of graphs built and returned from the cache
+
+    The hashes of changed nodes must be cleared (see
+    phpast.clear_structural_hashes) for their graphs to be built again. The
+    graph returned for a function may have been built from an equal copy of
+    it (e.g. in a file with the same contents)
+    """
+
+    def __init__(self):
+        self.graphs = {}
+        self.built = 0
+        self.reused = 0
+
+    def get(self, node):
+        if isinstance(node, list):
+            return build_cfg(node)
+        digest = node.structural_hash(with_lineno=True)
+        graph = self.graphs.get(digest)
+        if graph is None:
+            graph = build_cfg(node)
+            self.graphs[digest] = graph
+            self.built += 1
+        else:
+            self.reused += 1
+        return graph
+
+    def clear(self):
+        self.graphs = {}
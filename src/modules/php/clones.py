@@ -0,0 +1,141 @@
+"""Detection of duplicated code (clones) across many trees.
+
+Every function, method, closure, class and block of at least min_size nodes
+is put in a bucket keyed by its structural hash (see
+phpast.Node.structural_hash), so finding the clones takes one pass over
+the trees and no comparison of subtrees with each other. The buckets with
+more than one subtree are the clone groups. Groups whose subtrees are all
+inside subtrees of another group (e.g. the methods of a duplicated class)
+are not reported on their own.
+
+In near-miss mode the identifiers and literals are left out of the hashes,
+so code that was copied and then had its variables renamed or its strings
+and numbers changed is found as well.
+
+    finder = CloneFinder(min_size=30, near_miss=True)
+    for file_path, tree in resource_tree.trees.items():
+        finder.add_tree(file_path, tree)
+    print(finder.report())
+"""
+
+from collections import defaultdict
+
+from src.compiler.php import phpast
+
+# Kinds of subtrees compared
+CLONE_KINDS = (phpast.Function, phpast.Method, phpast.Closure, phpast.Class, phpast.Trait,
+               phpast.Block)
+
+
+class CloneGroup:
+    """ Structurally equal subtrees
+
+    Attributes:
+        - kind: Name of the class of the subtrees (e.g. 'Method')
+        - size: Number of nodes in each subtree
+        - occurrences: List of (file path, node)
+    """
+
+    def __init__(self, kind, size, occurrences):
+        self.kind = kind
+        self.size = size
+        self.occurrences = occurrences
+
+    def __len__(self):
+        return len(self.occurrences)
+
+    def __repr__(self):
+        return f"CloneGroup({self.kind}, size={self.size}, {len(self.occurrences)} occurrences)"
+
+
+class CloneFinder:
+    """ Groups the duplicated subtrees of the trees added to it
+
+    Methods:
+        - add_tree(file_path, tree): Adds the candidate subtrees of tree
+        - groups(): Returns the CloneGroups, the ones with the most
+          duplicated nodes first
+        - report(limit=20): Returns the groups as text
+
+    Attributes:
+        - min_size: Smallest number of nodes of the subtrees compared
+        - near_miss: Whether identifiers and literals are left out
+        - candidates: Number of subtrees compared
+    """
+
+    def __init__(self, min_size=30, near_miss=False, kinds=CLONE_KINDS):
+        self.min_size = min_size
+        self.near_miss = near_miss
+        self.kinds = kinds
+        self.candidates = 0
+        # Maps structural hashes to lists of (file path, node, size, key of
+        # the enclosing candidate or None)
+        self.buckets = defaultdict(list)
+
+    def add_tree(self, file_path, tree):
+        with_details = not self.near_miss
+        # Post-order walk computing the sizes of the subtrees. Each frame is
+        # (node, children, key of the enclosing candidate, children done).
+        # The bodies of expanded includes belong to the included files and
+        # are not walked
+        sizes = {}
+        stack = [(tree, None, None, False)]
+        while stack:
+            node, children, enclosing, children_done = stack.pop()
+            if not children_done:
+                children = node.children()
+                if isinstance(node, (phpast.Include, phpast.Require)):
+                    children = [child for child in children if child is not node.body]
+                stack.append((node, children, enclosing, True))
+                if isinstance(node, self.kinds):
+                    enclosing = (file_path, id(node))
+                stack.extend((child, None, enclosing, False) for child in children)
+                continue
+
+            size = 1
+            for child in children:
+                size += sizes.pop(id(child))
+            sizes[id(node)] = size
+            if size >= self.min_size and isinstance(node, self.kinds):
+                digest = node.structural_hash(with_names=with_details, with_literals=with_details)
+                self.buckets[digest].append((file_path, node, size, enclosing))
+                self.candidates += 1
+
+    def groups(self):
+        cloned = [occurrences for occurrences in self.buckets.values() if len(occurrences) > 1]
+        # Keys of all the subtrees that have clones
+        cloned_keys = set()
+        for occurrences in cloned:
+            cloned_keys.update((file_path, id(node)) for file_path, node, _, _ in occurrences)
+
+        groups = []
+        for occurrences in cloned:
+            if all(enclosing in cloned_keys for _, _, _, enclosing in occurrences):
+                # Part of larger clones
+                continue
+            file_path, node, size, _ = occurrences[0]
+            groups.append(CloneGroup(type(node).__name__, size,
+                                     [(file_path, node) for file_path, node, _, _ in occurrences]))
+        groups.sort(key=lambda group: group.size * (len(group) - 1), reverse=True)
+        return groups
+
+    def report(self, limit=20):
+        groups = self.groups()
+        lines = [f"{len(groups)} clone groups among {self.candidates} subtrees of at least "
+                 f"{self.min_size} nodes" + (" (near-miss)" if self.near_miss else "")]
+        for group in groups[:limit]:
+            lines.append("")
+            lines.append(f"{len(group)} x {group.kind} of {group.size} nodes")
+            for file_path, node in group.occurrences:
+                name = getattr(node, "name", None)
+                lines.append(f"    {file_path}:{node.lineno}" + (f" {name}" if name else ""))
+        return "\n".join(lines)
+
+
+def find_clones(trees, min_size=30, near_miss=False):
+    """Returns the CloneGroups of trees, a dict mapping file paths to trees
+    (e.g. ResourceTree.trees)"""
+    finder = CloneFinder(min_size=min_size, near_miss=near_miss)
+    for file_path, tree in trees.items():
+        finder.add_tree(file_path, tree)
+    return finder.groups()
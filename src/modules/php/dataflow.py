@@ -0,0 +1,727 @@
+"""Dataflow analyses over the control-flow graphs of the cfg module.
+
+A DataflowProblem gives the direction of the analysis, the facts at the
+start (or end) of the body, the meet of the facts of the blocks that flow
+into a block and the transfer function of the blocks. solve() computes the
+facts at the entry and exit of every block with a worklist ordered by the
+reverse post-order of the graph (the post-order for backward problems), so
+that a block is mostly visited after the blocks flowing into it.
+
+Most problems are sets of variables or definitions. They are kept as
+Python ints used as bitsets over a Universe that numbers the variables or
+definitions, so that meets and transfers are a few integer operations
+whatever the size of the sets. A BitsetProblem only needs the gen and kill
+bits of each block. The analyses provided are:
+ - ReachingDefinitions: the assignments whose value can reach a block
+ - LiveVariables: the variables read later, before being assigned again
+ - ConstantPropagation: the variables with a known constant value (facts
+   are dicts, as the values are not a finite set)
+ - TaintedVariables: the variables holding user input, and the sinks they
+   reach (see taint.TaintConfig)
+
+    cfg = build_cfg(function)
+    live = LiveVariables(cfg)
+    result = live.solve()
+    print(live.variables.members(result.entry[ENTRY]))
+
+Only plain variables are tracked. Assignments to array elements and
+properties update the variable holding them without replacing its value,
+and references ('$a = &$b') are not followed.
+"""
+
+import heapq
+
+from collections import defaultdict
+
+from src.compiler.php import phpast
+from src.modules.php import taint
+from src.modules.php.cfg import ENTRY, EXIT
+
+# Kinds of the accesses to variables. An update changes a variable without
+# replacing its whole value (e.g. '$a[] = 1')
+USE = "use"
+DEF = "def"
+UPDATE = "update"
+
+# Nodes that are not run where they appear
+DECLARATIONS = (phpast.Function, phpast.Class, phpast.Interface, phpast.Trait, phpast.Method)
+
+# Marks the variables without a constant value in ConstantPropagation
+NOT_CONSTANT = object()
+
+EMPTY_SOURCES = frozenset()
+
+
+class Universe:
+    """ Numbers the items (variables, definitions, ...) of a bitset
+
+    Methods:
+        - add(item): Numbers item if it is new and returns its number
+        - bit(item): Returns the bitset with only item
+        - mask(items): Returns the bitset with items
+        - members(bits): Returns the items of a bitset, in number order
+
+    Attributes:
+        - items: The items, by number
+    """
+
+    def __init__(self, items=()):
+        self.items = []
+        self.numbers = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        number = self.numbers.get(item)
+        if number is None:
+            number = len(self.items)
+            self.numbers[item] = number
+            self.items.append(item)
+        return number
+
+    def bit(self, item):
+        return 1 << self.numbers[item]
+
+    def mask(self, items):
+        bits = 0
+        for item in items:
+            bits |= 1 << self.numbers[item]
+        return bits
+
+    def members(self, bits):
+        members = []
+        while bits:
+            lowest = bits & -bits
+            members.append(self.items[lowest.bit_length() - 1])
+            bits ^= lowest
+        return members
+
+    @property
+    def full(self):
+        return (1 << len(self.items)) - 1
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.numbers
+
+
+def variable_name(node):
+    if isinstance(node, phpast.Variable) and isinstance(node.name, str):
+        return node.name
+    return None
+
+
+def accesses(node):
+    """Returns the accesses to variables of a node of a block, as a list of
+    (USE, DEF or UPDATE, variable name, node) in the order they are run. The
+    node of a definition is the node assigning it (e.g. the Assignment)"""
+    result = []
+    if isinstance(node, phpast.Foreach):
+        # At the head of a foreach, the node stands for the assignment of
+        # the next element. Its expr and body are in other blocks
+        targets = [node.keyvar, node.valvar]
+        stack = [("target", target, node) for target in reversed(targets) if target is not None]
+    elif isinstance(node, phpast.Catch):
+        stack = [("target", node.var, node)]
+    else:
+        stack = [("walk", node, None)]
+
+    while stack:
+        action, value, assigner = stack.pop()
+        if action == "emit":
+            result.append(value)
+            continue
+        if action == "target":
+            # The variable assigned by assigner
+            if isinstance(value, phpast.ForeachVariable):
+                value = value.name
+            name = variable_name(value)
+            if name is not None:
+                result.append((DEF, name, assigner))
+                continue
+            if isinstance(value, (phpast.ListAssignment, list)):
+                for target in reversed(value.nodes if isinstance(value, phpast.ListAssignment)
+                                       else value):
+                    if target is not None:
+                        stack.append(("target", target, assigner))
+                continue
+            # Element or property of a variable: the variable is updated
+            # after the indexes are evaluated
+            indexes = []
+            while isinstance(value, (phpast.ArrayOffset, phpast.StringOffset,
+                                     phpast.ObjectProperty)):
+                if isinstance(value, phpast.ObjectProperty):
+                    indexes.append(value.name)
+                else:
+                    indexes.append(value.expr)
+                value = value.node
+            name = variable_name(value)
+            if name is not None:
+                stack.append(("emit", (UPDATE, name, assigner), None))
+            else:
+                stack.append(("walk", value, None))
+            stack.extend(("walk", index, None) for index in indexes)
+            continue
+
+        if not isinstance(value, phpast.Node):
+            if isinstance(value, list):
+                stack.extend(("walk", item, None) for item in reversed(value))
+            continue
+        kind = type(value)
+        if kind is phpast.Variable:
+            if isinstance(value.name, str):
+                result.append((USE, value.name, value))
+            else:
+                stack.append(("walk", value.name, None))
+        elif kind is phpast.Assignment or kind is phpast.ListAssignment:
+            stack.append(("target", value.node if kind is phpast.Assignment else value.nodes,
+                          value))
+            stack.append(("walk", value.expr, None))
+        elif kind is phpast.AssignOp:
+            stack.append(("target", value.left, value))
+            stack.append(("walk", value.right, None))
+            stack.append(("walk", value.left, None))
+        elif kind is phpast.PreIncDecOp or kind is phpast.PostIncDecOp:
+            stack.append(("target", value.expr, value))
+            stack.append(("walk", value.expr, None))
+        elif kind is phpast.Unset or kind is phpast.Global:
+            stack.extend(("target", variable, value) for variable in reversed(value.nodes))
+        elif kind is phpast.StaticVariable:
+            result.append((DEF, value.name, value))
+        elif kind is phpast.Closure:
+            for variable in value.vars or []:
+                if isinstance(variable.name, str):
+                    result.append((USE, variable.name, variable))
+                    if variable.is_ref:
+                        result.append((UPDATE, variable.name, value))
+        elif kind is phpast.Include or kind is phpast.Require:
+            # Not the body of an expanded include
+            stack.append(("walk", value.expr, None))
+        elif not isinstance(value, DECLARATIONS):
+            stack.extend(("walk", child, None) for child in reversed(value.children()))
+    return result
+
+
+def block_accesses(cfg):
+    """Returns the accesses (see accesses()) of the nodes of each block"""
+    return [[access for node in cfg.block(block) for access in accesses(node)]
+            for block in range(len(cfg))]
+
+
+def parameter_names(cfg):
+    params = getattr(cfg.node, "params", None) or []
+    return [param.name for param in params
+            if isinstance(param, phpast.FormalParameter) and isinstance(param.name, str)]
+
+
+class DataflowResult:
+    """ Facts computed by solve()
+
+    Attributes:
+        - entry, exit: The facts at the start and end of each block (None
+          for the blocks that are not reached)
+        - visits: Number of blocks visited by the worklist
+    """
+
+    def __init__(self, entry, exit, visits):
+        self.entry = entry
+        self.exit = exit
+        self.visits = visits
+
+
+class DataflowProblem:
+    """ Base class of the dataflow problems
+
+    Methods to override:
+        - top(): The facts of the blocks not visited yet, the identity of
+          meet
+        - boundary(): The facts at the start of the body (at its end for
+          backward problems). Defaults to top()
+        - meet(facts, other): Combines the facts of two blocks
+        - transfer(block, facts): Returns the facts after the block (before
+          it for backward problems), given the facts before it (after it)
+
+    Attributes:
+        - cfg: The ControlFlowGraph
+        - forward: Whether the facts flow along the edges or against them
+    """
+
+    forward = True
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+    def top(self):
+        raise NotImplementedError
+
+    def boundary(self):
+        return self.top()
+
+    def meet(self, facts, other):
+        raise NotImplementedError
+
+    def transfer(self, block, facts):
+        raise NotImplementedError
+
+    def solve(self):
+        return solve(self)
+
+
+def solve(problem):
+    """Returns the DataflowResult of problem"""
+    cfg = problem.cfg
+    order = list(cfg.reverse_post_order())
+    if problem.forward:
+        start, inputs, outputs = ENTRY, cfg.predecessors, cfg.successors
+    else:
+        order.reverse()
+        start, inputs, outputs = EXIT, cfg.successors, cfg.predecessors
+
+    count = len(cfg)
+    rank = [-1] * count
+    for position, block in enumerate(order):
+        rank[block] = position
+    top = problem.top()
+    before = [None] * count
+    after = [None] * count
+    for block in order:
+        after[block] = top
+    meet = problem.meet
+    transfer = problem.transfer
+
+    # Heap of the ranks of the queued blocks, all of them at first (a
+    # sorted list is a heap)
+    heap = list(range(len(order)))
+    queued = bytearray(count)
+    for block in order:
+        queued[block] = 1
+    visits = 0
+    while heap:
+        block = order[heapq.heappop(heap)]
+        queued[block] = 0
+        visits += 1
+        facts = problem.boundary() if block == start else None
+        for source in inputs(block):
+            if rank[source] >= 0:
+                facts = after[source] if facts is None else meet(facts, after[source])
+        if facts is None:
+            facts = top
+        before[block] = facts
+        facts = transfer(block, facts)
+        if facts != after[block]:
+            after[block] = facts
+            for target in outputs(block):
+                if rank[target] >= 0 and not queued[target]:
+                    queued[target] = 1
+                    heapq.heappush(heap, rank[target])
+
+    if problem.forward:
+        return DataflowResult(before, after, visits)
+    return DataflowResult(after, before, visits)
+
+
+class BitsetProblem(DataflowProblem):
+    """ A problem whose facts are bitsets, with gen and kill bits per block:
+    the facts after a block are gen | (facts before & ~kill)
+
+    Attributes:
+        - gen, kill: The bits of each block
+        - may: Whether the meet is the union (facts holding on some path)
+          or the intersection (facts holding on all paths)
+        - universe: The Universe the bits number
+    """
+
+    may = True
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.universe = Universe()
+        self.gen = [0] * len(cfg)
+        self.kill = [0] * len(cfg)
+
+    def top(self):
+        return 0 if self.may else self.universe.full
+
+    def boundary(self):
+        return 0
+
+    def meet(self, facts, other):
+        return facts | other if self.may else facts & other
+
+    def transfer(self, block, facts):
+        return self.gen[block] | (facts & ~self.kill[block])
+
+
+class ReachingDefinitions(BitsetProblem):
+    """ The definitions (assignments, parameters, foreach variables, ...)
+    whose value can reach each block
+
+    Attributes:
+        - definitions: Universe of the definitions, as (variable name,
+          defining node, block). The parameters are defined by their
+          FormalParameters, in no block (None)
+        - definitions_of: Maps the variable names to the bits of their
+          definitions
+    """
+
+    def __init__(self, cfg, accesses_by_block=None):
+        super().__init__(cfg)
+        accesses_by_block = accesses_by_block or block_accesses(cfg)
+        self.definitions = self.universe
+        self.definitions_of = defaultdict(int)
+        self.parameters = 0
+        for param in getattr(cfg.node, "params", None) or []:
+            if isinstance(param, phpast.FormalParameter) and isinstance(param.name, str):
+                bit = 1 << self.definitions.add((param.name, param, None))
+                self.definitions_of[param.name] |= bit
+                self.parameters |= bit
+
+        block_definitions = []
+        for block, block_accesses_ in enumerate(accesses_by_block):
+            definitions = []
+            for kind, name, node in block_accesses_:
+                if kind != USE:
+                    bit = 1 << self.definitions.add((name, node, block))
+                    self.definitions_of[name] |= bit
+                    definitions.append((kind, name, bit))
+            block_definitions.append(definitions)
+
+        for block, definitions in enumerate(block_definitions):
+            gen = kill = 0
+            for kind, name, bit in definitions:
+                if kind == DEF:
+                    others = self.definitions_of[name] & ~bit
+                    gen &= ~others
+                    kill |= others
+                gen |= bit
+            self.gen[block] = gen
+            self.kill[block] = kill
+
+    def boundary(self):
+        return self.parameters
+
+    def reaching(self, facts, name=None):
+        """Returns the definitions in facts, only those of name if given"""
+        if name is not None:
+            facts &= self.definitions_of.get(name, 0)
+        return self.definitions.members(facts)
+
+
+class LiveVariables(BitsetProblem):
+    """ The variables whose value is read later, before being assigned
+    again. Backward problem: result.entry[block] has the variables live at
+    the start of block
+
+    Attributes:
+        - variables: Universe of the variable names
+    """
+
+    forward = False
+
+    def __init__(self, cfg, accesses_by_block=None):
+        super().__init__(cfg)
+        accesses_by_block = accesses_by_block or block_accesses(cfg)
+        self.variables = self.universe
+        for name in parameter_names(cfg):
+            self.variables.add(name)
+        for block, block_accesses_ in enumerate(accesses_by_block):
+            used = defined = 0
+            for kind, name, _ in block_accesses_:
+                bit = 1 << self.variables.add(name)
+                if kind == DEF:
+                    defined |= bit
+                elif not defined & bit:
+                    # Updates keep the rest of the value, which is a use
+                    used |= bit
+            self.gen[block] = used
+            self.kill[block] = defined
+
+
+class ConstantPropagation(DataflowProblem):
+    """ The variables holding a known constant (a number, string, boolean or
+    null) at each point. Facts are dicts mapping the variable names to
+    their constant, the variables without a known constant being left out.
+    None stands for the blocks not reached yet
+    """
+
+    binary_operators = {
+        ".": lambda left, right: phpstr(left) + phpstr(right),
+        "+": lambda left, right: left + right,
+        "-": lambda left, right: left - right,
+        "*": lambda left, right: left * right,
+    }
+
+    def __init__(self, cfg, accesses_by_block=None):
+        super().__init__(cfg)
+        self.accesses_by_block = accesses_by_block or block_accesses(cfg)
+
+    def top(self):
+        return None
+
+    def boundary(self):
+        return {}
+
+    def meet(self, facts, other):
+        if facts is None:
+            return other
+        if other is None:
+            return facts
+        return {name: value for name, value in facts.items()
+                if name in other and same_constant(other[name], value)}
+
+    def transfer(self, block, facts):
+        if facts is None:
+            return None
+        facts = dict(facts)
+        for kind, name, node in self.accesses_by_block[block]:
+            if kind == USE:
+                continue
+            value = NOT_CONSTANT
+            if kind == DEF and isinstance(node, phpast.Assignment) and not node.is_ref:
+                value = self.evaluate(node.expr, facts)
+            elif kind == DEF and isinstance(node, phpast.AssignOp) and \
+                    node.op[:-1] in self.binary_operators:
+                value = self.evaluate(phpast.BinaryOp(node.op[:-1], node.left, node.right), facts)
+            if value is NOT_CONSTANT:
+                facts.pop(name, None)
+            else:
+                facts[name] = value
+        return facts
+
+    def evaluate(self, expr, facts):
+        """Returns the constant value of expr, or NOT_CONSTANT"""
+        # Post-order walk with an explicit stack, for long '.' chains
+        results = []
+        stack = [(expr, False)]
+        while stack:
+            node, operands_done = stack.pop()
+            if not isinstance(node, phpast.Node):
+                results.append(node if isinstance(node, (int, float, str)) else NOT_CONSTANT)
+            elif type(node) is phpast.Variable:
+                results.append(facts.get(node.name, NOT_CONSTANT)
+                               if isinstance(node.name, str) else NOT_CONSTANT)
+            elif type(node) is phpast.Constant:
+                results.append({"true": True, "false": False, "null": None}.get(
+                    node.name.lower(), NOT_CONSTANT) if isinstance(node.name, str) else NOT_CONSTANT)
+            elif type(node) is phpast.BinaryOp and node.op in self.binary_operators:
+                if not operands_done:
+                    stack.append((node, True))
+                    stack.append((node.right, False))
+                    stack.append((node.left, False))
+                    continue
+                right = results.pop()
+                left = results.pop()
+                results.append(self.operate(node.op, left, right))
+            else:
+                return NOT_CONSTANT
+        return results[0]
+
+    def operate(self, op, left, right):
+        if left is NOT_CONSTANT or right is NOT_CONSTANT:
+            return NOT_CONSTANT
+        if op != "." and not all(type(value) in (int, float) for value in (left, right)):
+            # PHP's conversions of strings to numbers are not modelled
+            return NOT_CONSTANT
+        return self.binary_operators[op](left, right)
+
+
+def phpstr(value):
+    if value is True:
+        return "1"
+    if value is False or value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def same_constant(value, other):
+    return type(value) is type(other) and value == other
+
+
+class TaintedVariables(BitsetProblem):
+    """ The variables holding user input, with the sources, sinks and
+    sanitizers of a taint.TaintConfig. Unlike taint.TaintAnalysis it only
+    looks at one body and treats calls of user functions like any other
+    function (their result is tainted if an argument is)
+
+    Methods:
+        - flows(result): Returns the sinks reached by tainted variables as
+          (sink, node, tainted variable names and sources)
+
+    Attributes:
+        - variables: Universe of the variable names
+    """
+
+    def __init__(self, cfg, config=None):
+        super().__init__(cfg)
+        self.config = config or taint.TaintConfig()
+        self.variables = self.universe
+        # Per block, the assignments and sinks in the order they are run:
+        # (target bit or None for sinks, whether the target is replaced, bits
+        # of the variables read, sources read, sink name, node)
+        self.events = [self.compile(cfg.block(block)) for block in range(len(cfg))]
+
+    def transfer(self, block, facts):
+        for bit, replaced, reads, sources, _, _ in self.events[block]:
+            if bit is None:
+                continue
+            if facts & reads or sources:
+                facts |= bit
+            elif replaced:
+                facts &= ~bit
+        return facts
+
+    def flows(self, result):
+        flows = []
+        for block in range(len(self.cfg)):
+            facts = result.entry[block]
+            if facts is None:
+                continue
+            for bit, replaced, reads, sources, sink, node in self.events[block]:
+                if bit is None:
+                    if facts & reads or sources:
+                        flows.append((sink, node, self.variables.members(facts & reads) +
+                                      sorted(sources)))
+                elif facts & reads or sources:
+                    facts |= bit
+                elif replaced:
+                    facts &= ~bit
+        return flows
+
+    def compile(self, nodes):
+        events = []
+        for node in nodes:
+            if isinstance(node, phpast.Foreach):
+                reads, sources = self.reads(node.expr)
+                for kind, name, _ in accesses(node):
+                    events.append((1 << self.variables.add(name), kind == DEF, reads, sources,
+                                   None, node))
+                continue
+            if isinstance(node, phpast.Catch):
+                name = variable_name(node.var)
+                if name is not None:
+                    events.append((1 << self.variables.add(name), True, 0, EMPTY_SOURCES,
+                                   None, node))
+                continue
+            # Post-order walk, the events of the operands first
+            stack = [(node, False)]
+            while stack:
+                value, operands_done = stack.pop()
+                if not isinstance(value, phpast.Node) or isinstance(value, DECLARATIONS) or \
+                        isinstance(value, phpast.Closure):
+                    continue
+                if not operands_done:
+                    stack.append((value, True))
+                    if isinstance(value, (phpast.Include, phpast.Require)):
+                        stack.append((value.expr, False))
+                    else:
+                        stack.extend((child, False) for child in reversed(value.children()))
+                    continue
+                self.compile_node(value, events)
+        return events
+
+    def compile_node(self, node, events):
+        kind = type(node)
+        if kind in (phpast.Assignment, phpast.ListAssignment, phpast.AssignOp, phpast.Unset,
+                    phpast.Global, phpast.PreIncDecOp, phpast.PostIncDecOp):
+            if kind is phpast.AssignOp and node.op not in taint.CLEAN_ASSIGN_OPERATORS:
+                reads, sources = self.reads(node.right)
+                left, _ = self.reads(node.left)
+                reads |= left
+            elif kind is phpast.Assignment or kind is phpast.ListAssignment:
+                reads, sources = self.reads(node.expr)
+            else:
+                reads, sources = 0, EMPTY_SOURCES
+            for access_kind, name, assigner in accesses(node):
+                if access_kind != USE and assigner is node:
+                    events.append((1 << self.variables.add(name), access_kind == DEF, reads,
+                                   sources, None, node))
+            return
+
+        sink = None
+        operands = []
+        if kind is phpast.Echo:
+            sink, operands = "echo", node.nodes
+        elif kind is phpast.Print:
+            sink, operands = "print", [node.node]
+        elif kind is phpast.Exit:
+            sink, operands = node.type or "exit", [node.expr]
+        elif kind is phpast.Eval:
+            sink, operands = "eval", [node.expr]
+        elif kind is phpast.Include or kind is phpast.Require:
+            sink, operands = kind.__name__.lower(), [node.expr]
+        elif kind in (phpast.FunctionCall, phpast.MethodCall, phpast.StaticMethodCall) and \
+                isinstance(node.name, str):
+            sink = node.name.lower() if kind is phpast.FunctionCall else "->" + node.name.lower()
+            operands = node.params or []
+        if sink is None or sink not in self.config.sinks:
+            return
+        reads, sources = 0, EMPTY_SOURCES
+        for operand in operands:
+            operand_reads, operand_sources = self.reads(operand)
+            reads |= operand_reads
+            sources = sources | operand_sources
+        events.append((None, False, reads, sources, sink, node))
+
+    def reads(self, expr):
+        """Returns the bits of the variables and the sources whose values
+        can flow into the value of expr"""
+        config = self.config
+        bits = 0
+        sources = set()
+        stack = [expr]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(node)
+                continue
+            if not isinstance(node, phpast.Node):
+                continue
+            kind = type(node)
+            if kind is phpast.Variable:
+                if isinstance(node.name, str):
+                    if node.name in config.sources:
+                        sources.add(node.name)
+                    bits |= 1 << self.variables.add(node.name)
+            elif kind is phpast.Assignment or kind is phpast.ListAssignment:
+                stack.append(node.expr)
+            elif kind is phpast.AssignOp:
+                stack.append(node.left)
+                stack.append(node.right)
+            elif kind in (phpast.ArrayOffset, phpast.StringOffset, phpast.ObjectProperty):
+                stack.append(node.node)
+            elif kind is phpast.BinaryOp:
+                if node.op not in taint.CLEAN_OPERATORS:
+                    stack.append(node.left)
+                    stack.append(node.right)
+            elif kind is phpast.Cast:
+                if node.type not in taint.CLEAN_CASTS:
+                    stack.append(node.expr)
+            elif kind is phpast.TernaryOp:
+                stack.append(node.expr if node.iftrue is None else node.iftrue)
+                stack.append(node.iffalse)
+            elif kind is phpast.ArrayElement:
+                stack.append(node.value)
+            elif kind in (phpast.FunctionCall, phpast.MethodCall, phpast.StaticMethodCall):
+                if isinstance(node.name, str):
+                    name = (node.name if kind is phpast.FunctionCall else "->" + node.name).lower()
+                    if name in config.sanitizers:
+                        continue
+                    if name in config.sources:
+                        sources.add(name)
+                        continue
+                stack.extend(node.params or [])
+                if kind is phpast.MethodCall:
+                    stack.append(node.node)
+            elif kind in (phpast.UnaryOp, phpast.IsSet, phpast.Empty, phpast.PreIncDecOp,
+                          phpast.PostIncDecOp, phpast.Closure, phpast.Include, phpast.Require,
+                          phpast.Print, phpast.Eval, phpast.Exit) or \
+                    isinstance(node, DECLARATIONS):
+                continue
+            else:
+                stack.extend(node.children())
+        return bits, frozenset(sources)
+
@@ -0,0 +1,251 @@
+"""Discovery of the source files of a project.
+
+Directories are scanned in parallel with os.scandir. Files and directories
+are filtered with gitignore-style patterns, and every discovered file is
+given a parse mode:
+ - full: the file is parsed completely (default)
+ - declarations: only the declarations are parsed, the bodies of functions,
+   methods and closures are dropped (useful for vendor code)
+ - skip: the file is not parsed at all
+"""
+
+import os
+import re
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+PHP_EXTENSIONS = (".php", ".inc", ".phtml", ".module")
+PARSE_MODES = ("full", "declarations", "skip")
+# Version control directories never contain anything worth parsing
+DEFAULT_EXCLUDE = (".git/", ".hg/", ".svn/")
+
+
+def translate_glob(pattern):
+    """Translates the glob part of a gitignore-style pattern to a regex"""
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            regex.append("(?:.*/)?")
+            i += 3
+            continue
+        elif pattern.startswith("**", i):
+            regex.append(".*")
+            i += 2
+            continue
+        elif c == "*":
+            regex.append("[^/]*")
+        elif c == "?":
+            regex.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex.append(re.escape(c))
+            else:
+                char_class = pattern[i + 1:end]
+                if char_class.startswith("!"):
+                    char_class = "^" + char_class[1:]
+                regex.append(f"[{char_class}]")
+                i = end
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return "".join(regex)
+
+
+def content_hash(data):
+    """Returns the hex digest identifying the contents of a file (its raw
+    bytes). Used for the files of a project and by tree_store.TreeStore"""
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_hash(file_path):
+    """Returns the hex digest of the contents of file_path, the same as
+    content_hash of its bytes"""
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as file_handle:
+        for chunk in iter(lambda: file_handle.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Pattern:
+    """ A single gitignore-style pattern matched against paths relative to
+    the root of the project (with '/' as separator)
+
+    - A leading '!' negates the pattern
+    - A trailing '/' only matches directories
+    - Patterns without any other '/' match the name at any depth, otherwise
+      they are anchored to the root
+    """
+
+    def __init__(self, pattern):
+        self.source = pattern
+        self.negated = pattern.startswith("!")
+        if self.negated:
+            pattern = pattern[1:]
+        self.directory_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        regex = translate_glob(pattern.lstrip("/"))
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        self.regex = re.compile(regex + "$")
+
+    def matches(self, relative_path, is_dir=False):
+        if self.directory_only and not is_dir:
+            return False
+        return self.regex.match(relative_path) is not None
+
+    def matches_file(self, relative_path):
+        """Whether the pattern matches the file or one of the directories
+        it is in, as a directory pattern applies to everything below it
+        """
+        if self.matches(relative_path):
+            return True
+        position = relative_path.find("/")
+        while position != -1:
+            if self.matches(relative_path[:position], is_dir=True):
+                return True
+            position = relative_path.find("/", position + 1)
+        return False
+
+    def __repr__(self):
+        return f"Pattern({self.source!r})"
+
+
+def last_match(patterns, relative_path, is_dir=False):
+    """Returns the last pattern (and value) matching relative_path. Each
+    element of 'patterns' is a (Pattern, value) pair
+    """
+    found = None
+    for pattern, value in patterns:
+        if pattern.matches(relative_path, is_dir):
+            found = (pattern, value)
+    return found
+
+
+def last_file_match(patterns, relative_path):
+    """Like last_match, for a file that is also matched by the patterns of
+    the directories it is in
+    """
+    found = None
+    for pattern, value in patterns:
+        if pattern.matches_file(relative_path):
+            found = (pattern, value)
+    return found
+
+
+class FileDiscovery:
+    """ Collects the source files under a directory
+
+    Arguments:
+        - root: Path to the directory (or a single file)
+        - extensions: File extensions that are collected
+        - include: Patterns that files (or the directories they are in)
+          must match (all files if empty)
+        - exclude: gitignore-style patterns for files and directories that
+          are ignored. Excluded directories are not descended into
+        - parse_modes: List of (pattern, mode) pairs. The last pattern
+          matching a file or one of the directories it is in (such as
+          "vendor/") decides the parse mode of the file
+        - workers: Number of threads scanning directories
+        - hash_contents: Whether the contents of the accepted files should be
+          hashed while scanning (see content_hashes)
+
+    Methods:
+        - discover(): Returns a sorted list of (absolute path, parse mode)
+          for all the files that are not skipped
+
+    Attributes:
+        - content_hashes: Maps the discovered files to the hex digest of
+          their contents, if hash_contents is set
+    """
+
+    def __init__(self, root, extensions=PHP_EXTENSIONS, include=(), exclude=DEFAULT_EXCLUDE,
+                 parse_modes=(), workers=None, hash_contents=False):
+        self.root = os.path.abspath(root)
+        self.extensions = tuple(extensions)
+        self.include = [Pattern(pattern) for pattern in include]
+        self.exclude = [(Pattern(pattern), None) for pattern in exclude]
+        self.parse_modes = []
+        for pattern, mode in parse_modes:
+            if mode not in PARSE_MODES:
+                raise Exception(f"Unknown parse mode '{mode}'")
+            self.parse_modes.append((Pattern(pattern), mode))
+        self.workers = workers
+        self.hash_contents = hash_contents
+        self.content_hashes = {}
+        # Files that were found but are not going to be parsed
+        self.skipped = []
+
+    def is_excluded(self, relative_path, is_dir=False):
+        found = last_match(self.exclude, relative_path, is_dir)
+        return found is not None and not found[0].negated
+
+    def parse_mode(self, relative_path):
+        found = last_file_match(self.parse_modes, relative_path)
+        return found[1] if found is not None else "full"
+
+    def accept_file(self, relative_path):
+        """Returns the parse mode of the file or None if it is ignored"""
+        if not relative_path.endswith(self.extensions):
+            return None
+        if self.is_excluded(relative_path):
+            return None
+        if self.include and not any(pattern.matches_file(relative_path) for pattern in self.include):
+            return None
+        return self.parse_mode(relative_path)
+
+    def scan(self, directory, relative_directory):
+        """Scans a single directory. Returns the subdirectories that should
+        be scanned and the accepted files
+        """
+        subdirectories = []
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                relative_path = relative_directory + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if not self.is_excluded(relative_path, is_dir=True):
+                        subdirectories.append((entry.path, relative_path + "/"))
+                elif entry.is_file():
+                    mode = self.accept_file(relative_path)
+                    if mode is None:
+                        continue
+                    files.append((entry.path, mode))
+                    # Hashing here lets the workers read the files in parallel
+                    if self.hash_contents and mode != "skip":
+                        self.content_hashes[entry.path] = file_hash(entry.path)
+        return subdirectories, files
+
+    def discover(self):
+        if os.path.isfile(self.root):
+            mode = self.accept_file(os.path.basename(self.root))
+            found = [] if mode is None else [(self.root, mode)]
+            if self.hash_contents and mode not in (None, "skip"):
+                self.content_hashes[self.root] = file_hash(self.root)
+        elif self.workers == 1:
+            found = []
+            pending = [(self.root, "")]
+            while pending:
+                subdirectories, files = self.scan(*pending.pop())
+                found.extend(files)
+                pending.extend(subdirectories)
+        else:
+            found = []
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                pending = {executor.submit(self.scan, self.root, "")}
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        subdirectories, files = future.result()
+                        found.extend(files)
+                        for directory, relative_directory in subdirectories:
+                            pending.add(executor.submit(self.scan, directory, relative_directory))
+
+        found.sort()
+        self.skipped = [file_path for file_path, mode in found if mode == "skip"]
+        return [(file_path, mode) for file_path, mode in found if mode != "skip"]
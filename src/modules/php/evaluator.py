@@ -0,0 +1,250 @@
+"""Static evaluation of the path expressions of Include/Require nodes.
+
+The evaluator knows about string and number literals, '.' concatenation,
+constants (from define() and const, possibly defined in other files of the
+project), the __DIR__/__FILE__ magic constants and the dirname(), basename()
+and realpath() functions. Results are memoized per expression fingerprint,
+so an expression that appears in many files (or is walked many times) is
+only evaluated once.
+"""
+
+import os
+
+from collections import defaultdict
+
+from src.compiler.php import phpast
+
+# Constants predefined by PHP that are commonly used in include paths
+builtin_constants = {
+    "DIRECTORY_SEPARATOR": "/",
+    "PATH_SEPARATOR": ":",
+}
+
+
+def expression_fingerprint(expr):
+    """Returns a hashable value that is equal for structurally equal
+    expressions (line numbers are ignored)
+    """
+    # Built bottom-up with an explicit stack, so that long '.' chains do not
+    # hit the recursion limit. results holds the fingerprints of the
+    # children of the nodes and lists being completed
+    results = []
+    stack = [(expr, False)]
+    while stack:
+        value, children_done = stack.pop()
+        if isinstance(value, phpast.Node):
+            if children_done:
+                start = len(results) - len(value.fields)
+                fingerprint = (type(value).__name__,) + tuple(results[start:])
+                del results[start:]
+                results.append(fingerprint)
+            else:
+                stack.append((value, True))
+                stack.extend((getattr(value, field), False) for field in reversed(value.fields))
+        elif isinstance(value, list):
+            if children_done:
+                start = len(results) - len(value)
+                fingerprint = tuple(results[start:])
+                del results[start:]
+                results.append(fingerprint)
+            else:
+                stack.append((value, True))
+                stack.extend((item, False) for item in reversed(value))
+        else:
+            results.append(value)
+    return results[0]
+
+
+def uses_magic_constants(expr):
+    """Checks if the value of expr depends on the file it appears in"""
+    stack = [expr]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, phpast.MagicConstant):
+            return True
+        elif isinstance(value, phpast.Node):
+            stack.extend(getattr(value, field) for field in value.fields)
+        elif isinstance(value, list):
+            stack.extend(value)
+    return False
+
+
+class IncludePathEvaluator:
+    """ Reduces include/require expressions to paths
+
+    Methods:
+        - define(name, value, file_path): Defines the constant 'name'. value
+          is the expression node (or literal) assigned to it in file_path
+        - evaluate(expr, file_path): Returns the string that expr evaluates
+          to inside file_path, or None if it cannot be evaluated statically
+        - resolve(path, base_dir): Turns an evaluated path into an absolute
+          path, searching include_paths for paths that are not explicitly
+          relative
+
+    Attributes:
+        - constants: Maps constant names to (value, file_path)
+        - include_paths: Directories searched like PHP's include_path
+        - hits / misses: Counters for the memoized evaluations
+    """
+
+    def __init__(self, constants=None, include_paths=()):
+        self.constants = {}
+        self.include_paths = [os.path.abspath(path) for path in include_paths]
+        # Maps (fingerprint, file_path or None) to (value, constants used)
+        self.cache = {}
+        # Maps constant names to the cache keys that depend on them
+        self.dependents = defaultdict(set)
+        self.resolved = {}
+        self.evaluating = set()
+        self.hits = 0
+        self.misses = 0
+
+        if constants:
+            for name, (value, file_path) in constants.items():
+                self.define(name, value, file_path)
+
+    def define(self, name, value, file_path=None):
+        previous = self.constants.get(name)
+        if previous is not None and previous[0] is value and previous[1] == file_path:
+            return
+        self.constants[name] = (value, file_path)
+        # Forget everything that was evaluated with the previous value
+        for key in self.dependents.pop(name, ()):
+            self.cache.pop(key, None)
+
+    def evaluate(self, expr, file_path):
+        return self.evaluate_cached(expr, file_path, set())
+
+    def evaluate_cached(self, expr, file_path, used_constants):
+        if isinstance(expr, str):
+            return expr
+
+        context = file_path if uses_magic_constants(expr) else None
+        key = (expression_fingerprint(expr), context)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            used_constants.update(cached[1])
+            return cached[0]
+
+        self.misses += 1
+        key_constants = set()
+        value = self.evaluate_expr(expr, file_path, key_constants)
+        self.cache[key] = (value, frozenset(key_constants))
+        for name in key_constants:
+            self.dependents[name].add(key)
+        used_constants.update(key_constants)
+        return value
+
+    def evaluate_expr(self, expr, file_path, used_constants):
+        if isinstance(expr, str):
+            return expr
+
+        elif isinstance(expr, (int, float)) and not isinstance(expr, bool):
+            return str(expr)
+
+        elif isinstance(expr, phpast.Parameter):
+            return self.evaluate_expr(expr.node, file_path, used_constants)
+
+        elif isinstance(expr, (phpast.BinaryOp, phpast.Concat)):
+            # The operands of '.' chains (of any shape) and Concat nodes are
+            # collected with a stack, long chains are too deep to recurse
+            parts = []
+            operands = [expr]
+            while operands:
+                operand = operands.pop()
+                if isinstance(operand, phpast.BinaryOp):
+                    if operand.op != ".":
+                        return None
+                    operands.append(operand.right)
+                    operands.append(operand.left)
+                elif isinstance(operand, phpast.Concat):
+                    # Also covers InterpolatedString
+                    operands.extend(reversed(operand.nodes))
+                else:
+                    part = self.evaluate_expr(operand, file_path, used_constants)
+                    if part is None:
+                        return None
+                    parts.append(part)
+            return "".join(parts)
+
+        elif isinstance(expr, phpast.Constant):
+            return self.evaluate_constant(expr.name, used_constants)
+
+        elif isinstance(expr, phpast.MagicConstant):
+            if file_path is None:
+                return None
+            if expr.name == "__FILE__":
+                return file_path
+            elif expr.name == "__DIR__":
+                return os.path.dirname(file_path)
+            elif expr.name == "__LINE__" and expr.value is not None:
+                return str(expr.value)
+            return None
+
+        elif isinstance(expr, phpast.FunctionCall) and isinstance(expr.name, str):
+            return self.evaluate_call(expr, file_path, used_constants)
+
+        return None
+
+    def evaluate_constant(self, name, used_constants):
+        if name in builtin_constants:
+            return builtin_constants[name]
+
+        used_constants.add(name)
+        definition = self.constants.get(name)
+        if definition is None or name in self.evaluating:
+            return None
+
+        value, defining_file = definition
+        # Magic constants in the value refer to the file defining it
+        self.evaluating.add(name)
+        try:
+            return self.evaluate_cached(value, defining_file, used_constants)
+        finally:
+            self.evaluating.discard(name)
+
+    def evaluate_call(self, expr, file_path, used_constants):
+        function_name = expr.name.lower()
+        if not expr.params:
+            return None
+        argument = self.evaluate_expr(expr.params[0], file_path, used_constants)
+        if argument is None:
+            return None
+
+        if function_name == "dirname":
+            levels = 1
+            if len(expr.params) > 1:
+                levels = expr.params[1].node
+                if not isinstance(levels, int) or levels < 1:
+                    return None
+            for _ in range(levels):
+                argument = os.path.dirname(argument)
+            return argument
+        elif function_name == "basename":
+            return os.path.basename(argument)
+        elif function_name == "realpath":
+            return os.path.normpath(argument)
+        return None
+
+    def resolve(self, path, base_dir):
+        """Returns the absolute path of the file included as 'path' from a
+        file inside base_dir
+        """
+        if os.path.isabs(path):
+            return os.path.normpath(path)
+        if not self.include_paths or path.startswith(("./", "../")):
+            return os.path.normpath(os.path.join(base_dir, path))
+
+        key = (path, base_dir)
+        resolved_path = self.resolved.get(key)
+        if resolved_path is None:
+            for include_path in self.include_paths:
+                candidate = os.path.normpath(os.path.join(include_path, path))
+                if os.path.isfile(candidate):
+                    resolved_path = candidate
+                    break
+            else:
+                resolved_path = os.path.normpath(os.path.join(base_dir, path))
+            self.resolved[key] = resolved_path
+        return resolved_path
@@ -0,0 +1,236 @@
+"""Index of the class hierarchy of a project and method resolution.
+
+A ClassHierarchy is built from a symbols.SymbolTable. It links each class,
+interface and trait to the ones it extends, implements or uses (resolving
+their names in the scope of the declaration), and answers:
+ - ancestors(name) / descendants(name): all the classes, interfaces and
+   traits above (below) a class. Computed once per class and kept as
+   frozensets, so is_subclass(name, ancestor) is a set lookup
+ - method_resolution_order(name): the classes searched for a method, in
+   order: the class itself, the traits it uses, its parent class (and its
+   resolution order) and the interfaces
+ - lookup_method(name, method): the definitions of a method called on an
+   instance of a class, honoring overrides and trait methods (and their
+   aliases). Memoized by (class, method)
+ - dispatch_targets(name, method): the methods a call can run when the
+   object is an instance of the class or of any of its descendants
+
+Classes are named by their fully qualified names, in any case. Classes
+defined more than once in the project (e.g. in copies of a library) are a
+single class with all the definitions.
+
+    hierarchy = ClassHierarchy(resource_tree.symbol_table)
+    for file_path, (method, class_node) in hierarchy.dispatch_targets("App\\Model", "save"):
+        print(file_path, class_node.name, method.lineno)
+"""
+
+from collections import defaultdict
+
+from src.compiler.php import phpast
+from src.modules.php.symbols import symbol_key
+
+
+class ClassHierarchy:
+    """ Class hierarchy of the classes of a SymbolTable
+
+    Methods:
+        - ancestors(name), descendants(name): Return the keys of the classes
+          above (below) a class
+        - is_subclass(name, ancestor): Checks if a class extends, implements
+          or uses another, directly or not
+        - method_resolution_order(name): Returns the keys of the classes
+          searched for methods, in order
+        - lookup_method(name, method): Returns the definitions of a method
+          of a class, as (file path, (Method, Class)) like
+          ResourceTree.function_finder
+        - dispatch_targets(name, method): Same for the class and all its
+          descendants
+        - class_of(node): Returns the key of a Class, Interface or Trait node
+
+    Attributes:
+        - definitions: Maps the keys (lower case fully qualified names) of
+          the classes to their Symbols
+        - extends, implements, traits: Map the keys to the keys of their
+          parents, interfaces and traits. Parents that are not defined in
+          the project (e.g. Exception) have keys as well
+        - children: Maps the keys to the keys of the classes directly below
+    """
+
+    def __init__(self, symbol_table):
+        self.symbol_table = symbol_table
+        self.definitions = {}
+        self.extends = defaultdict(list)
+        self.implements = defaultdict(list)
+        self.traits = defaultdict(list)
+        self.children = defaultdict(list)
+        # Maps the keys to the lower case method names to lists of (file
+        # path, (Method, class node))
+        self.methods = defaultdict(lambda: defaultdict(list))
+        # Maps the keys to the lower case trait method aliases to (trait
+        # key or None, lower case method name)
+        self.aliases = defaultdict(dict)
+        self.node_keys = {}
+
+        self.ancestor_memo = {}
+        self.descendant_memo = {}
+        self.mro_memo = {}
+        self.lookup_memo = {}
+        self.dispatch_memo = {}
+
+        for key, symbols in symbol_table.classes.items():
+            self.definitions[key] = symbols
+            for symbol in symbols:
+                self.add_definition(key, symbol)
+        for key in list(self.definitions):
+            for parent in self.parents(key):
+                self.children[parent].append(key)
+
+    def add_definition(self, key, symbol):
+        node = symbol.node
+        self.node_keys[id(node)] = key
+
+        def resolve(name):
+            return symbol_key("class", self.symbol_table.resolve_class(name, symbol.scope))
+
+        if isinstance(node, phpast.Class):
+            if isinstance(node.extends, str):
+                self.add_link(self.extends[key], resolve(node.extends))
+            for interface in node.implements or []:
+                self.add_link(self.implements[key], resolve(interface))
+        elif isinstance(node, phpast.Interface):
+            # Interfaces extend any number of interfaces
+            extends = node.extends if isinstance(node.extends, list) else [node.extends]
+            for interface in extends:
+                if isinstance(interface, str):
+                    self.add_link(self.extends[key], resolve(interface))
+
+        for trait_use in getattr(node, "traits", None) or []:
+            trait = resolve(trait_use.name) if isinstance(trait_use.name, str) else None
+            if trait is not None:
+                self.add_link(self.traits[key], trait)
+            for rename in trait_use.renames or []:
+                if not isinstance(rename, phpast.TraitModifier) or not isinstance(rename.to, str):
+                    continue
+                source = getattr(rename, "from")
+                # 'Trait::method as alias' names the trait of the method
+                if isinstance(source, phpast.StaticProperty) and \
+                        isinstance(source.node, str) and isinstance(source.name, str):
+                    self.aliases[key][rename.to.lower()] = (resolve(source.node),
+                                                            source.name.lower())
+                elif isinstance(source, str):
+                    self.aliases[key][rename.to.lower()] = (trait, source.lower())
+
+        for statement in node.nodes or []:
+            if isinstance(statement, phpast.Method) and isinstance(statement.name, str):
+                self.methods[key][statement.name.lower()].append(
+                    (symbol.file_path, (statement, node)))
+
+    @staticmethod
+    def add_link(links, key):
+        if key not in links:
+            links.append(key)
+
+    def key(self, name):
+        return symbol_key("class", name.lstrip("\\"))
+
+    def class_of(self, node):
+        return self.node_keys.get(id(node))
+
+    def parents(self, key):
+        return self.extends.get(key, []) + self.traits.get(key, []) + self.implements.get(key, [])
+
+    def ancestors(self, name):
+        key = self.key(name)
+        ancestors = self.ancestor_memo.get(key)
+        if ancestors is None:
+            ancestors = self.closure(key, self.parents, self.ancestor_memo)
+        return ancestors
+
+    def descendants(self, name):
+        key = self.key(name)
+        descendants = self.descendant_memo.get(key)
+        if descendants is None:
+            descendants = self.closure(key, lambda key: self.children.get(key, []),
+                                       self.descendant_memo)
+        return descendants
+
+    def closure(self, key, neighbours, memo):
+        """Returns the keys reachable from key through neighbours, filling
+        memo for key and the keys on the way (post-order walk, cycles of
+        broken code are cut)"""
+        in_progress = set()
+        stack = [(key, False)]
+        while stack:
+            current, neighbours_done = stack.pop()
+            if current in memo:
+                continue
+            if not neighbours_done:
+                if current in in_progress:
+                    continue
+                in_progress.add(current)
+                stack.append((current, True))
+                stack.extend((neighbour, False) for neighbour in neighbours(current)
+                             if neighbour not in memo)
+                continue
+            reachable = set()
+            for neighbour in neighbours(current):
+                reachable.add(neighbour)
+                reachable.update(memo.get(neighbour, ()))
+            reachable.discard(current)
+            memo[current] = frozenset(reachable)
+        return memo[key]
+
+    def is_subclass(self, name, ancestor):
+        return self.key(ancestor) in self.ancestors(name)
+
+    def method_resolution_order(self, name):
+        key = self.key(name)
+        order = self.mro_memo.get(key)
+        if order is not None:
+            return order
+        # Cut cycles of broken code
+        self.mro_memo[key] = (key,)
+        order = [key]
+        for trait in self.traits.get(key, []):
+            order.extend(self.method_resolution_order(trait))
+        for parent in self.extends.get(key, []):
+            order.extend(self.method_resolution_order(parent))
+        for interface in self.implements.get(key, []):
+            order.extend(self.method_resolution_order(interface))
+        order = tuple(dict.fromkeys(order))
+        self.mro_memo[key] = order
+        return order
+
+    def lookup_method(self, name, method):
+        key = (self.key(name), method.lower())
+        found = self.lookup_memo.get(key)
+        if found is not None:
+            return found
+        self.lookup_memo[key] = ()
+        found = ()
+        for class_key in self.method_resolution_order(key[0]):
+            definitions = self.methods.get(class_key, {}).get(key[1])
+            if definitions:
+                found = tuple(definitions)
+                break
+            alias = self.aliases.get(class_key, {}).get(key[1])
+            if alias is not None:
+                trait, trait_method = alias
+                traits = [trait] if trait is not None else self.traits.get(class_key, [])
+                found = tuple(definition for trait in traits
+                              for definition in self.lookup_method(trait, trait_method))
+                if found:
+                    break
+        self.lookup_memo[key] = found
+        return found
+
+    def dispatch_targets(self, name, method):
+        key = (self.key(name), method.lower())
+        targets = self.dispatch_memo.get(key)
+        if targets is None:
+            found = {}
+            for class_key in (key[0],) + tuple(sorted(self.descendants(key[0]))):
+                for definition in self.lookup_method(class_key, key[1]):
+                    found[id(definition[1][0])] = definition
+            targets = self.dispatch_memo[key] = tuple(found.values())
+        return targets
@@ -9,6 +9,13 @@ import sys
 from collections import defaultdict
 
 from src.modules.php import syntax_tree
+from src.modules.php import clones
+from src.modules.php import taint
+from src.modules.php.symbols import SymbolTable
+from src.modules.php.hierarchy import ClassHierarchy
+from src.modules.php.type_inference import TypeInference
+from src.modules.php.serialization import TreeWriter, TreeReader
+from src.modules.php.discovery import FileDiscovery, PHP_EXTENSIONS, DEFAULT_EXCLUDE
 from src.modules.php.visitors.resolvers import ResourceDependencyResolver, TablesBuilder
 from src.modules.php.traversers.bf import BFTraverser
 
@@ -21,33 +28,76 @@ class ResourceTree:
     managing them and performing collective operations on them
 
     Methods:
-        - __init__(self, path, debug=False): Does the necessary initializations
-          and collects the paths for all the PHP files in the project
+        - __init__(self, path, debug=False, ...): Does the necessary
+          initializations and collects the paths for all the PHP files in the
+          project (see discovery.FileDiscovery for the other arguments)
         - build_trees(): Takes the collected paths and builds ASTs for all the
           files in the project.
         - build_tables(): Builds function_table and method_table which
           contain information regarding all the function and method definitions
-          inside the project
+          inside the project, symbol_table, class_hierarchy and
+          type_inference
+        - resolve_dependencies(include_paths=()): Expands the Include/Require
+          nodes of all the trees with the trees of the included files
+        - dump_trees(path) / load_trees(path): Saves the trees to (or restores
+          them from) a file in the binary format of the serialization module,
+          so that they don't have to be parsed again
+        - find_clones(min_size=30, near_miss=False): Returns the groups of
+          duplicated functions, methods, classes and blocks (see
+          clones.CloneFinder)
+        - find_taint_flows(config=None, cache=None): Returns the flows of
+          user input to dangerous functions (see taint.TaintAnalysis)
 
     Attributes:
         - files: Contains the absolute paths for all the collected files
+        - parse_modes: Maps the collected files to their parse mode
+        - content_hashes: Maps the collected files to the hash of their
+          contents (only when deduplicate is set)
         - function_table: Stores information regarding all the function defintions
         - method_table: Stores information regarding all the method defintions
+        - constant_table: Maps the names of the constants defined with define()
+          or const anywhere in the project to (value, file_path)
+        - symbol_table: symbols.SymbolTable of the functions, classes,
+          interfaces, traits and constants by fully qualified name, which
+          resolves names with the namespaces and use declarations of the
+          files
+        - class_hierarchy: hierarchy.ClassHierarchy of the classes of
+          symbol_table, with their ancestors, descendants and methods
+        - type_inference: type_inference.TypeInference, the classes of the
+          objects methods are called on, used to narrow the methods a call
+          can run
     """
 
-    def __init__(self, path, debug=False):
+    def __init__(self, path, debug=False, extensions=PHP_EXTENSIONS, include=(),
+                 exclude=DEFAULT_EXCLUDE, parse_modes=(), workers=None, deduplicate=True):
         """
         Initializes the AST and collects the paths for all the PHP files in 
         the project
         Path should be the relative or absolute path to the root directory
         of the project.
+        include, exclude and parse_modes take gitignore-style patterns
+        relative to the root directory, e.g.
+            exclude=["tests/", "docs/"],
+            parse_modes=[("vendor/**", "declarations")]
+        With deduplicate set, files with identical contents are parsed once
+        and share their nodes (see SyntaxTree.view). Each copy has its own
+        Include/Require nodes, since their bodies depend on the path of the
+        file, but other mutations of the shared nodes are seen from all the
+        copies.
         """
 
         self.debug = debug
         self.files = []
+        self.parse_modes = {}
+        self.content_hashes = {}
+        self.deduplicate = deduplicate
         self.trees = {}
         self.function_table = defaultdict(lambda: {})
         self.method_table = defaultdict(lambda: {})
+        self.constant_table = {}
+        self.symbol_table = SymbolTable()
+        self.class_hierarchy = ClassHierarchy(self.symbol_table)
+        self.type_inference = TypeInference(self.symbol_table, self.class_hierarchy)
         self.dep_table = {}
         self.not_found = []
         self.expr_fails = []
@@ -57,40 +107,53 @@ class ResourceTree:
         if not os.path.exists(path):
             raise InvalidPathException("The path specified does not exist.")
 
-        # If it is a PHP file, simply add it to the files list
-        if os.path.isfile(path) and path.endswith(".php"):
-                self.files.append(os.path.abspath(path))
-        # If it is a directory, recursively look for PHP files and add them
-        else:
-            for current_path, dirs, files in os.walk(path):
-                for current_file in files:
-                    file_path = os.path.join(current_path, current_file)
-                    if file_path.endswith(".php"):
-                        self.files.append(file_path)
-                        self.dep_table[file_path] = []
+        discovery = FileDiscovery(path, extensions=extensions, include=include,
+                                  exclude=exclude, parse_modes=parse_modes,
+                                  workers=workers, hash_contents=deduplicate)
+        for file_path, parse_mode in discovery.discover():
+            self.files.append(file_path)
+            self.parse_modes[file_path] = parse_mode
+            self.dep_table[file_path] = []
+        self.content_hashes = discovery.content_hashes
         # Output Status
         print(f"Total {len(self.files)} PHP files found in the project.")
 
-    def build_trees(self):
+    def build_trees(self, profile=None):
         """ Takes all the collected files in the current ResourceTree and
-        builds SyntaxTrees for all of them"""
+        builds SyntaxTrees for all of them. With profile (a
+        profiling.ParseProfile) the parsing is profiled"""
 
         no_of_files = len(self.files)
 
         if self.trees:
-            self.trees = []
+            self.trees = {}
             print(f"Rebuilding Trees for all {no_of_files} files")
         else:
             print(f"Building Trees for all {no_of_files} files")
 
+        # Maps (content hash, parse mode) to the tree parsed for it
+        parsed = {}
         for file_path in self.files:
-            file_handle = open(file_path)
-            file_tree = syntax_tree.SyntaxTree(file_handle)
+            parse_mode = self.parse_modes[file_path]
+            content_key = (self.content_hashes.get(file_path), parse_mode)
+            if content_key in parsed:
+                self.trees[file_path] = parsed[content_key].view(file_path)
+                continue
+
+            with open(file_path) as file_handle:
+                file_tree = syntax_tree.SyntaxTree(file_handle, parse_mode=parse_mode,
+                                                   profile=profile)
             self.trees[file_path] = file_tree
+            if content_key[0] is not None:
+                parsed[content_key] = file_tree
+
+        if self.deduplicate:
+            print(f"Parsed {len(parsed)} distinct files")
 
     def build_tables(self):
         """Builds function_table and method_table, storing definitions of all 
-        the functions and methods inside the project
+        the functions and methods inside the project, symbol_table,
+        class_hierarchy and type_inference
         """
 
         print("Building Functions and Methods table")
@@ -101,6 +164,73 @@ class ResourceTree:
             tree_traverser.register_visitor(tables_builder)
             tree_traverser.traverse()
 
+        self.symbol_table = SymbolTable()
+        for file_path, tree in self.trees.items():
+            self.symbol_table.add_tree(file_path, tree)
+        self.class_hierarchy = ClassHierarchy(self.symbol_table)
+        self.type_inference = TypeInference(self.symbol_table, self.class_hierarchy)
+
+    def resolve_dependencies(self, include_paths=()):
+        """Expands the Include/Require nodes in all the trees. Should be
+        called after build_tables, so that constants defined anywhere in the
+        project can be used for evaluating the included paths
+        """
+
+        print("Resolving Dependencies")
+
+        resolver = ResourceDependencyResolver(self, debug=self.debug,
+                                              include_paths=include_paths)
+        for file_path in self.trees:
+            # Trees included by other trees are expanded by their own
+            # traversal, and includes that loop back are not followed
+            tree_traverser = BFTraverser(self.trees[file_path], shared_subtrees="once")
+            tree_traverser.register_visitor(resolver)
+            tree_traverser.traverse()
+
+        self.not_found = resolver.not_found
+        self.expr_fails = resolver.expr_fails
+
+    def dump_trees(self, path):
+        """Writes all the trees to the file at path, one record per tree.
+        The bodies of expanded includes are written as references to the
+        records of the included files
+        """
+
+        with open(path, "wb") as file_handle:
+            writer = TreeWriter(file_handle)
+            for file_path in self.trees:
+                writer.write(self.trees[file_path])
+            writer.close()
+
+    def load_trees(self, path):
+        """Replaces the trees with the ones stored by dump_trees"""
+
+        self.trees = {}
+        with open(path, "rb") as file_handle:
+            for file_tree in TreeReader(file_handle):
+                self.trees[file_tree.file_path] = file_tree
+
+        print(f"Loaded Trees for {len(self.trees)} files")
+
+    def find_clones(self, min_size=30, near_miss=False):
+        """Returns the clones.CloneGroups of the trees, the largest first.
+        With near_miss, code that only differs in its identifiers and
+        literals is grouped as well
+        """
+
+        return clones.find_clones(self.trees, min_size=min_size, near_miss=near_miss)
+
+    def find_taint_flows(self, config=None, cache=None):
+        """Returns the taint.TaintFindings of the trees, with the sources,
+        sinks and sanitizers of config (a taint.TaintConfig). Pass the same
+        taint.SummaryCache to later calls to only analyze the functions
+        that changed since
+        """
+
+        if not self.function_table and not self.method_table:
+            self.build_tables()
+        return taint.TaintAnalysis(self, config=config, cache=cache).run()
+
     def function_finder(self, function_name, bound=False, params=-1):
         """
         Returns a generator which iterates over the locations
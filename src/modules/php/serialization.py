@@ -0,0 +1,455 @@
+"""Compact binary serialization of SyntaxTrees.
+
+A stream starts with a header (magic bytes and format version) and is
+followed by any number of records, each holding one value (usually a
+SyntaxTree) and prefixed with its size. Values are encoded as a tag byte
+followed by:
+ - NODE: the kind index, lineno + 1 (0 for None), lexpos + 1 (0 for None)
+   followed by the length of the span if there is one, then every field
+   (and the extra attributes registered for the kind) as values
+ - LIST/TUPLE: the number of items, then the items
+ - STR: the string table index
+ - INT: a zigzag varint, FLOAT: 8 bytes
+ - REF: the index of a node or list written earlier in the same record
+ - FILE: the string table index of the path of a SyntaxTree
+All numbers are LEB128 varints. The node kind and string tables are built
+on the fly: an index equal to the current size of the table defines a new
+entry, which is followed by its length and UTF-8 bytes. Both tables are
+shared by all the records of a stream.
+
+References only point inside their record, so neither the writer nor the
+reader keeps the nodes of earlier records alive, and subtrees shared
+between records are written in each of them. A SyntaxTree inside a record
+(e.g. the body of an expanded include) is written as a FILE reference to
+its path, and read back as the tree of the record of that file (which may
+come later in the stream), or None if the stream has none.
+
+Writing and reading use explicit stacks and work with arbitrarily deep
+trees. Records are checked while reading: a truncated or corrupt record
+raises a SerializationError.
+"""
+
+import struct
+
+from src.compiler.php import phpast
+from src.modules.php import syntax_tree
+
+MAGIC = b"PHPAST\x00"
+FORMAT_VERSION = 3
+
+T_NONE, T_TRUE, T_FALSE, T_INT, T_FLOAT, T_STR, T_LIST, T_TUPLE, T_NODE, T_REF, T_FILE = range(11)
+
+# Flush the output buffer of a writer when it grows larger than this
+FLUSH_SIZE = 1 << 16
+
+float_struct = struct.Struct("<d")
+
+
+class SerializationError(Exception):
+    pass
+
+
+# Maps the names of node kinds to (class, extra attributes). The extra
+# attributes are serialized after the fields
+node_kinds = {}
+
+
+def register_node_class(node_class, extra_attributes=()):
+    """Makes node_class (a subclass of phpast.Node) serializable"""
+    node_kinds[node_class.__name__] = (node_class, tuple(extra_attributes))
+
+
+for kind in vars(phpast).values():
+    if isinstance(kind, type) and issubclass(kind, phpast.Node) and kind is not phpast.Node:
+        register_node_class(kind)
+
+# The nodes of a tree read back are its own, so shared_with is not kept
+register_node_class(syntax_tree.SyntaxTree, ("file_path", "file_location", "file_name",
+                                             "parse_mode", "source_code"))
+
+
+class TreeWriter:
+    """ Writes values to a binary file object as a stream of records
+
+    Methods:
+        - write(value): Writes a record holding value
+        - flush(): Writes the buffered output to the file object
+    """
+
+    def __init__(self, file_handle):
+        self.file_handle = file_handle
+        self.buffer = bytearray(MAGIC)
+        self.write_varint(FORMAT_VERSION)
+        self.output = self.buffer
+        self.kinds = {}
+        self.strings = {}
+        # Maps ids of the nodes and lists of the record being written to
+        # their reference index. The objects are kept alive until the end of
+        # the record, so that the ids stay unique
+        self.refs = {}
+        self.written = []
+
+    def write_varint(self, number):
+        buffer = self.buffer
+        while number > 0x7f:
+            buffer.append((number & 0x7f) | 0x80)
+            number >>= 7
+        buffer.append(number)
+
+    def write_string(self, string):
+        index = self.strings.get(string)
+        if index is not None:
+            self.write_varint(index)
+            return
+        index = len(self.strings)
+        self.strings[string] = index
+        data = string.encode("utf-8", "surrogatepass")
+        self.write_varint(index)
+        self.write_varint(len(data))
+        self.buffer += data
+
+    def write_kind(self, node_class):
+        name = node_class.__name__
+        entry = self.kinds.get(name)
+        if entry is not None:
+            self.write_varint(entry[0])
+            return entry[1]
+        if node_kinds.get(name, (None,))[0] is not node_class:
+            raise SerializationError(f"Node kind {name} is not registered")
+        extra_attributes = node_kinds[name][1]
+        index = len(self.kinds)
+        self.kinds[name] = (index, extra_attributes)
+        self.write_varint(index)
+        self.write_string(name)
+        return extra_attributes
+
+    def write(self, value):
+        # The record is encoded on its own so that its size can be written
+        # in front of it
+        buffer = self.buffer = bytearray()
+        root = value
+        stack = [value]
+        try:
+            self.encode(stack, root, buffer)
+        finally:
+            self.refs = {}
+            self.written = []
+            self.buffer = self.output
+        self.write_varint(len(buffer))
+        self.output += buffer
+        if len(self.output) >= FLUSH_SIZE:
+            self.flush()
+
+    def encode(self, stack, root, buffer):
+        while stack:
+            value = stack.pop()
+            value_type = type(value)
+
+            if value is None:
+                buffer.append(T_NONE)
+            elif value_type is str:
+                buffer.append(T_STR)
+                self.write_string(value)
+            elif value_type is bool:
+                buffer.append(T_TRUE if value else T_FALSE)
+            elif value_type is int:
+                buffer.append(T_INT)
+                self.write_varint(value << 1 if value >= 0 else ((-value) << 1) - 1)
+            elif value_type is float:
+                buffer.append(T_FLOAT)
+                buffer += float_struct.pack(value)
+            elif value_type is tuple:
+                buffer.append(T_TUPLE)
+                self.write_varint(len(value))
+                stack.extend(reversed(value))
+            elif value_type is syntax_tree.SyntaxTree and value is not root:
+                # Other trees (e.g. included files) have records of their own
+                buffer.append(T_FILE)
+                self.write_string(value.file_path)
+            elif value_type is list or isinstance(value, phpast.Node):
+                ref = self.refs.get(id(value))
+                if ref is not None:
+                    buffer.append(T_REF)
+                    self.write_varint(ref)
+                    continue
+                self.refs[id(value)] = len(self.written)
+                self.written.append(value)
+
+                if value_type is list:
+                    buffer.append(T_LIST)
+                    self.write_varint(len(value))
+                    stack.extend(reversed(value))
+                    continue
+
+                buffer.append(T_NODE)
+                extra_attributes = self.write_kind(value_type)
+                lineno = getattr(value, "lineno", None)
+                self.write_varint(0 if lineno is None else lineno + 1)
+                lexpos = value.lexpos
+                if lexpos is None:
+                    buffer.append(0)
+                else:
+                    self.write_varint(lexpos + 1)
+                    self.write_varint(value.endlexpos - lexpos)
+                for attribute in reversed(extra_attributes):
+                    stack.append(getattr(value, attribute, None))
+                for field in reversed(value.fields):
+                    stack.append(getattr(value, field))
+            else:
+                raise SerializationError(f"Cannot serialize values of type {value_type.__name__}")
+
+    def flush(self):
+        self.file_handle.write(self.output)
+        self.output.clear()
+
+    def close(self):
+        self.flush()
+
+
+def decode_varint(data, position):
+    """Decodes the varint at data[position]. Returns (number, new position)"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+class TreeReader:
+    """ Reads the records of a stream written by TreeWriter. Iterating over
+    a TreeReader yields the values of all the remaining records. Only one
+    record at a time is held in memory, besides the SyntaxTrees read so far
+    (by path), which the FILE references of later records point to
+    """
+
+    # Size of the chunks read from the file object
+    chunk_size = 1 << 16
+
+    def __init__(self, file_handle):
+        self.file_handle = file_handle
+        self.data = b""
+        self.position = 0
+        self.kinds = []
+        self.strings = []
+        # Nodes and lists of the record being read
+        self.refs = []
+        # Maps paths to the SyntaxTrees read, and the paths not read yet to
+        # the (container, attribute name or list index) referring to them
+        self.files = {}
+        self.pending_files = {}
+        if not self.fill(len(MAGIC) + 1) or self.data[:len(MAGIC)] != MAGIC:
+            raise SerializationError("Not a serialized syntax tree stream")
+        self.position = len(MAGIC)
+        version = self.read_varint()
+        if version != FORMAT_VERSION:
+            raise SerializationError(f"Unsupported format version {version}")
+
+    def fill(self, size):
+        """Makes sure that at least 'size' unread bytes are buffered.
+        Returns False on EOF
+        """
+        while len(self.data) - self.position < size:
+            chunk = self.file_handle.read(max(self.chunk_size, size))
+            if not chunk:
+                return False
+            self.data = self.data[self.position:] + chunk
+            self.position = 0
+        return True
+
+    def read_varint(self):
+        result = 0
+        shift = 0
+        while True:
+            if not self.fill(1):
+                raise SerializationError("Unexpected end of stream")
+            byte = self.data[self.position]
+            self.position += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def read(self):
+        """Reads the next record"""
+        size = self.read_varint()
+        if not self.fill(size):
+            raise SerializationError("Unexpected end of stream")
+        # Decoded from a copy of the record, so that nothing past its end
+        # can be read
+        data = self.data[self.position:self.position + size]
+        self.position += size
+        self.refs = []
+        try:
+            value, position = self.decode(data, 0)
+        except (IndexError, struct.error):
+            raise SerializationError("Truncated record")
+        except UnicodeDecodeError:
+            raise SerializationError("Corrupt string in record")
+        finally:
+            self.refs = []
+        if position != size:
+            raise SerializationError("Corrupt record, it has trailing bytes")
+        if type(value) is syntax_tree.SyntaxTree:
+            self.add_file(value)
+        return value
+
+    def add_file(self, tree):
+        self.files[tree.file_path] = tree
+        for container, key in self.pending_files.pop(tree.file_path, ()):
+            if type(container) is list:
+                container[key] = tree
+            else:
+                setattr(container, key, tree)
+
+    def read_string(self, data, position, index):
+        """Decodes the string table entry index, which is new if it is the
+        size of the table
+        """
+        if index < len(self.strings):
+            return self.strings[index], position
+        if index != len(self.strings):
+            raise SerializationError("Corrupt string table")
+        length, position = decode_varint(data, position)
+        if position + length > len(data):
+            raise SerializationError("Truncated record")
+        string = bytes(data[position:position + length]).decode("utf-8", "surrogatepass")
+        self.strings.append(string)
+        return string, position + length
+
+    def decode(self, data, position):
+        strings = self.strings
+        refs = self.refs
+        # Path of the FILE reference being handed over, if it is not read yet
+        pending_path = None
+        # Each frame is [container, attribute names or None, items left,
+        # whether the container is a tuple]
+        stack = []
+        while True:
+            tag = data[position]
+            position += 1
+
+            if tag == T_STR:
+                index = data[position]
+                if index < 0x80:
+                    position += 1
+                else:
+                    index, position = decode_varint(data, position)
+                if index < len(strings):
+                    value = strings[index]
+                else:
+                    value, position = self.read_string(data, position, index)
+            elif tag == T_NODE:
+                index, position = decode_varint(data, position)
+                if index < len(self.kinds):
+                    node_class, attributes = self.kinds[index]
+                else:
+                    node_class, attributes, position = self.decode_kind(data, position, index)
+                value = node_class.__new__(node_class)
+                lineno, position = decode_varint(data, position)
+                value.lineno = lineno - 1 if lineno else None
+                if data[position]:
+                    lexpos, position = decode_varint(data, position)
+                    length, position = decode_varint(data, position)
+                    value.lexpos = lexpos - 1
+                    value.endlexpos = lexpos - 1 + length
+                else:
+                    position += 1
+                refs.append(value)
+                if attributes:
+                    stack.append([value, attributes, len(attributes), False])
+                    continue
+            elif tag == T_NONE:
+                value = None
+            elif tag == T_TRUE:
+                value = True
+            elif tag == T_FALSE:
+                value = False
+            elif tag == T_LIST or tag == T_TUPLE:
+                size, position = decode_varint(data, position)
+                value = []
+                if tag == T_LIST:
+                    refs.append(value)
+                if size:
+                    stack.append([value, None, size, tag == T_TUPLE])
+                    continue
+                if tag == T_TUPLE:
+                    value = ()
+            elif tag == T_INT:
+                number, position = decode_varint(data, position)
+                value = number >> 1 if not number & 1 else -((number + 1) >> 1)
+            elif tag == T_FLOAT:
+                value = float_struct.unpack_from(data, position)[0]
+                position += 8
+            elif tag == T_REF:
+                index, position = decode_varint(data, position)
+                if index >= len(refs):
+                    raise SerializationError("Corrupt reference")
+                value = refs[index]
+            elif tag == T_FILE:
+                index, position = decode_varint(data, position)
+                path, position = self.read_string(data, position, index)
+                value = self.files.get(path)
+                if value is None:
+                    pending_path = path
+            else:
+                raise SerializationError(f"Unknown tag {tag}")
+
+            # Hand the value over to the containers that are complete now
+            while stack:
+                frame = stack[-1]
+                container, attributes, items_left, is_tuple = frame
+                if attributes is None:
+                    key = len(container)
+                    container.append(value)
+                else:
+                    key = attributes[len(attributes) - items_left]
+                    setattr(container, key, value)
+                if pending_path is not None:
+                    if is_tuple:
+                        raise SerializationError("Tree referenced from a tuple")
+                    self.pending_files.setdefault(pending_path, []).append((container, key))
+                    pending_path = None
+                frame[2] = items_left - 1
+                if items_left > 1:
+                    break
+                stack.pop()
+                value = tuple(container) if is_tuple else container
+            else:
+                return value, position
+
+    def decode_kind(self, data, position, index):
+        if index != len(self.kinds):
+            raise SerializationError("Corrupt node kind table")
+        # The name of a new kind is written as a string table entry
+        name_index, position = decode_varint(data, position)
+        name, position = self.read_string(data, position, name_index)
+        if name not in node_kinds:
+            raise SerializationError(f"Unknown node kind {name}")
+        node_class, extra_attributes = node_kinds[name]
+        attributes = node_class.fields + list(extra_attributes)
+        self.kinds.append((node_class, attributes))
+        return node_class, attributes, position
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.fill(1):
+            raise StopIteration
+        return self.read()
+
+
+def dump(value, file_handle):
+    """Writes value to the binary file object as a single record stream"""
+    writer = TreeWriter(file_handle)
+    writer.write(value)
+    writer.close()
+
+
+def load(file_handle):
+    """Reads the first record of a stream written by dump"""
+    return TreeReader(file_handle).read()
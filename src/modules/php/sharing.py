@@ -0,0 +1,419 @@
+"""Hash-consed, read-only syntax trees.
+
+Much of a PHP code base is the same few subtrees over and over
+(Variable('$this'), Constant('null'), copied and pasted blocks). An
+Interner turns trees into DAGs in which structurally equal subtrees (see
+phpast.Node.structural_hash) are a single shared node, also across the
+trees of a corpus. As a shared node stands for many places in the code, it
+has no position: the line numbers (and spans) of the nodes of a tree are
+kept in side tables of the SharedTree, in the pre-order of the expanded
+tree.
+
+The shared nodes must not be changed, so a SharedTree is only accessed
+through SharedNode views, which look like the nodes they wrap but are
+read-only and know their own line number:
+
+    interner = Interner()
+    shared = interner.intern(tree)
+    for node in shared.walk():
+        if node.kind is phpast.FunctionCall:
+            print(node.name, node.lineno)
+
+SharedTree.expand() (or SharedNode.expand()) gives an ordinary, mutable
+copy of the tree back.
+"""
+
+from array import array
+
+from src.compiler.php import phpast
+from src.modules.php import syntax_tree
+
+# Attributes kept in the side tables instead of the shared nodes
+position_attributes = ("lineno", "lexpos", "endlexpos")
+
+# Attribute with the structural hash the nodes are interned by
+hash_attribute = phpast.hash_attributes[False, True, True]
+
+# Attributes the traversers set on the nodes they walk. They are neither
+# shared nor copied (nearest_ns_parent points into the original tree)
+traversal_attributes = ("nearest_ns_parent",)
+
+# Maps node classes to the attributes their nodes can have and still be
+# shared. Nodes with other attributes (e.g. SyntaxTrees, with their file
+# names) are copied for every occurrence
+shareable_attributes = {}
+
+
+def shareable(node):
+    node_class = type(node)
+    attributes = shareable_attributes.get(node_class)
+    if attributes is None:
+        attributes = frozenset(node_class.fields + list(position_attributes) + ["_data", "source"] +
+                               list(traversal_attributes) +
+                               list(phpast.hash_attributes.values()))
+        shareable_attributes[node_class] = attributes
+    return vars(node).keys() <= attributes
+
+
+def holding_includes(tree):
+    """Returns the ids of the expanded Includes and Requires of tree (also
+    the ones in their bodies) and of the nodes above them. Their bodies are
+    not part of the structural hashes, so these nodes are not shared"""
+    holding = set()
+    visited = set()
+    stack = [(tree, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if children_done:
+            if isinstance(node, (phpast.Include, phpast.Require)) and node.body is not None or \
+                    any(id(child) in holding for field in node.fields
+                        for child in ordered_nodes(getattr(node, field))):
+                holding.add(id(node))
+            continue
+        # Bodies of circular includes lead back to the trees above them
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        stack.append((node, True))
+        for field in node.fields:
+            stack.extend((child, False) for child in ordered_nodes(getattr(node, field)))
+    return holding
+
+
+def ordered_nodes(value):
+    """Returns the nodes in value (a field value) in pre-order"""
+    if isinstance(value, phpast.Node):
+        return [value]
+    nodes = []
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            if isinstance(item, phpast.Node):
+                nodes.append(item)
+            elif isinstance(item, (list, tuple)):
+                nodes.extend(ordered_nodes(item))
+    return nodes
+
+
+def replace_nodes(value, replace):
+    """Returns a copy of value (a field value) with every node replaced by
+    replace(node), called in pre-order"""
+    if isinstance(value, phpast.Node):
+        return replace(value)
+    if isinstance(value, list):
+        return [replace_nodes(item, replace) for item in value]
+    if isinstance(value, tuple):
+        return tuple(replace_nodes(item, replace) for item in value)
+    return value
+
+
+def copy_node(node, replace, lineno, attributes=()):
+    """Returns a copy of node with the nodes in its fields replaced by
+    replace(node), and the given other attributes. They are set in the same
+    order as the parser sets them and without touching __dict__, so that
+    the copies keep the compact attribute layout of the parsed nodes (with
+    a dict of their own they are more than twice as large)"""
+    copy = node.__class__.__new__(node.__class__)
+    copy.lineno = lineno
+    for field in node.fields:
+        setattr(copy, field, replace_nodes(getattr(node, field), replace))
+    for attribute in attributes:
+        setattr(copy, attribute, getattr(node, attribute))
+    return copy
+
+
+class Interner:
+    """ Table of the shared nodes of any number of trees
+
+    Methods:
+        - intern(tree): Returns a SharedTree for tree (any node), made of
+          the shared nodes
+
+    Attributes:
+        - nodes: Maps structural hashes to the shared nodes
+        - reused: Number of subtrees replaced by a node already in the table
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.reused = 0
+
+    def intern(self, tree):
+        # Hashes all the nodes (but the include bodies) at once, they are
+        # cached on the nodes
+        tree.structural_hash()
+        holding = holding_includes(tree)
+
+        # Post-order walk building the shared nodes bottom-up. Maps the ids
+        # of the nodes of tree to their shared nodes. The root is never
+        # shared, it holds the per-tree attributes (e.g. the file name)
+        shared = {}
+        stack = [(tree, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if id(node) in shared:
+                continue
+            is_shared = node is not tree and id(node) not in holding and shareable(node)
+            if not children_done:
+                if is_shared:
+                    # Hashed here if it is in the body of an include
+                    known = self.nodes.get(node.structural_hash())
+                    if known is not None:
+                        shared[id(node)] = known
+                        self.reused += 1
+                        continue
+                stack.append((node, True))
+                for field in node.fields:
+                    stack.extend((child, False) for child in ordered_nodes(getattr(node, field)))
+                continue
+
+            if is_shared:
+                copy = copy_node(node, lambda child: shared[id(child)], None, [hash_attribute])
+                self.nodes[getattr(node, hash_attribute)] = copy
+            else:
+                # Copied for every occurrence along with its own attributes,
+                # which expand() has to copy as well
+                attributes = tuple(attribute for attribute in vars(node)
+                                   if attribute not in node.fields and
+                                   attribute not in position_attributes and
+                                   attribute not in traversal_attributes and
+                                   attribute not in phpast.hash_attributes.values())
+                copy = copy_node(node, lambda child: shared[id(child)], None, attributes)
+                if isinstance(node, syntax_tree.SyntaxTree):
+                    copy.shared_with = None
+                copy._extra_attributes = attributes
+            shared[id(node)] = copy
+
+        # Pre-order walk of the expanded tree filling the side tables.
+        # Positions are stored + 1, 0 standing for None. A None on the stack
+        # closes the subtree starting at the index below it
+        linenos = array("I")
+        sizes = array("I")
+        lexpos = array("Q")
+        endlexpos = array("Q")
+        spans = False
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                index = stack.pop()
+                sizes[index] = len(linenos) - index
+                continue
+            stack.append(len(linenos))
+            stack.append(None)
+            lineno = getattr(node, "lineno", None)
+            linenos.append(0 if lineno is None else lineno + 1)
+            sizes.append(0)
+            if node.lexpos is None:
+                lexpos.append(0)
+                endlexpos.append(0)
+            else:
+                spans = True
+                lexpos.append(node.lexpos + 1)
+                endlexpos.append(node.endlexpos + 1)
+            for field in reversed(node.fields):
+                stack.extend(reversed(ordered_nodes(getattr(node, field))))
+
+        if not spans:
+            lexpos = endlexpos = None
+        return SharedTree(shared[id(tree)], linenos, sizes, lexpos, endlexpos)
+
+
+class SharedTree:
+    """ A tree made of shared nodes and the positions of its nodes
+
+    Methods:
+        - walk(): Yields SharedNode views of all the nodes in pre-order
+        - expand(): Returns an ordinary (unshared, mutable) copy of the tree
+
+    Attributes:
+        - root: SharedNode view of the root of the tree
+        - linenos, lexpos, endlexpos: The side tables, with the positions of
+          the nodes in pre-order (+ 1, 0 for None). lexpos and endlexpos are
+          None for trees without spans
+        - sizes: Number of nodes in the subtree of each node, in pre-order.
+          The first child of the node at index is at index + 1, the next
+          sibling of a node at index is at index + sizes[index]
+    """
+
+    def __init__(self, root, linenos, sizes, lexpos=None, endlexpos=None):
+        self.linenos = linenos
+        self.sizes = sizes
+        self.lexpos = lexpos
+        self.endlexpos = endlexpos
+        self.root = SharedNode(root, self, 0)
+
+    def walk(self):
+        return self.root.walk()
+
+    def expand(self):
+        return self.root.expand()
+
+    def __len__(self):
+        return len(self.linenos)
+
+
+class SharedNode:
+    """ Read-only view of a shared node at one place of a SharedTree. The
+    fields of the node are available as attributes, with the nodes in them
+    as SharedNodes and the lists as tuples
+
+    Methods:
+        - children(): Returns the views of the nodes held directly in the
+          fields of the node
+        - walk(): Yields the views of this subtree in pre-order
+        - expand(): Returns an ordinary copy of this subtree
+        - generic(with_lineno=False), structural_hash(with_names=True,
+          with_literals=True): Same as for phpast.Node
+
+    Attributes:
+        - shared_node: The shared node, which must not be changed
+        - kind: Class of the node
+        - index: Position of the node in the pre-order of the tree
+        - lineno, lexpos, endlexpos: From the side tables of the tree
+
+    The view keeps its own state in underscored slots, as the fields of the
+    nodes (e.g. 'node') are looked up as attributes
+    """
+
+    __slots__ = ("_shared", "_tree", "_index")
+
+    def __init__(self, node, tree, index):
+        object.__setattr__(self, "_shared", node)
+        object.__setattr__(self, "_tree", tree)
+        object.__setattr__(self, "_index", index)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Shared trees are read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("Shared trees are read-only")
+
+    @property
+    def shared_node(self):
+        return self._shared
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def kind(self):
+        return type(self._shared)
+
+    @property
+    def fields(self):
+        return self._shared.fields
+
+    @property
+    def lineno(self):
+        lineno = self._tree.linenos[self._index]
+        return lineno - 1 if lineno else None
+
+    @property
+    def lexpos(self):
+        if self._tree.lexpos is None or not self._tree.lexpos[self._index]:
+            return None
+        return self._tree.lexpos[self._index] - 1
+
+    @property
+    def endlexpos(self):
+        if self._tree.endlexpos is None or not self._tree.endlexpos[self._index]:
+            return None
+        return self._tree.endlexpos[self._index] - 1
+
+    def __getattr__(self, name):
+        node = self._shared
+        if name in node.fields:
+            sizes = self._tree.sizes
+            index = self._index + 1
+            for field in node.fields:
+                value = getattr(node, field)
+                if field == name:
+                    return self.view(value, index)
+                for child in ordered_nodes(value):
+                    index += sizes[index]
+        # Per-tree attributes of the root, e.g. file_path
+        if not name.startswith("_") and name in getattr(node, "_extra_attributes", ()):
+            return getattr(node, name)
+        raise AttributeError(f"{type(node).__name__} has no attribute {name}")
+
+    def view(self, value, index):
+        """Wraps the nodes of value (a field value), the first one being at
+        index"""
+        tree = self._tree
+        position = [index]
+
+        def wrap(node):
+            view = SharedNode(node, tree, position[0])
+            position[0] += tree.sizes[position[0]]
+            return view
+        value = replace_nodes(value, wrap)
+        return tuple(value) if isinstance(value, list) else value
+
+    def children(self):
+        sizes = self._tree.sizes
+        children = []
+        index = self._index + 1
+        for field in self._shared.fields:
+            for node in ordered_nodes(getattr(self._shared, field)):
+                children.append(SharedNode(node, self._tree, index))
+                index += sizes[index]
+        return children
+
+    def walk(self):
+        stack = [self]
+        while stack:
+            view = stack.pop()
+            yield view
+            stack.extend(reversed(view.children()))
+
+    def expand(self):
+        tree = self._tree
+        sizes = tree.sizes
+        # Post-order walk building the copies bottom-up. Maps the indexes
+        # of the nodes to their copies
+        copies = {}
+        stack = [(self._shared, self._index, False)]
+        while stack:
+            node, index, children_done = stack.pop()
+            if not children_done:
+                stack.append((node, index, True))
+                child_index = index + 1
+                for field in node.fields:
+                    for child in ordered_nodes(getattr(node, field)):
+                        stack.append((child, child_index, False))
+                        child_index += sizes[child_index]
+                continue
+
+            position = [index + 1]
+
+            def replace(child):
+                child_copy = copies.pop(position[0])
+                position[0] += sizes[position[0]]
+                return child_copy
+            lineno = tree.linenos[index]
+            copy = copy_node(node, replace, lineno - 1 if lineno else None,
+                             getattr(node, "_extra_attributes", ()))
+            if tree.lexpos is not None and tree.lexpos[index]:
+                copy.lexpos = tree.lexpos[index] - 1
+                copy.endlexpos = tree.endlexpos[index] - 1
+            copies[index] = copy
+        return copies[self._index]
+
+    def generic(self, with_lineno=False):
+        if with_lineno:
+            return self.expand().generic(with_lineno)
+        return self._shared.generic()
+
+    def structural_hash(self, with_names=True, with_literals=True):
+        return self._shared.structural_hash(with_names=with_names, with_literals=with_literals)
+
+    def __eq__(self, other):
+        return (isinstance(other, SharedNode) and self._tree is other._tree and
+                self._index == other._index)
+
+    def __hash__(self):
+        return hash((id(self._tree), self._index))
+
+    def __repr__(self):
+        return repr(self._shared)
@@ -0,0 +1,252 @@
+"""Project-wide table of the functions, classes, interfaces, traits and
+constants, keyed by their fully qualified names.
+
+Each namespace of each file (the whole file when it has no namespace) is a
+Scope, with the aliases of its use declarations. Names used in a scope are
+resolved to fully qualified names with PHP's rules:
+ - fully qualified names ('\\Foo\\bar') are used as they are
+ - names starting with 'namespace\\' are relative to the namespace
+ - qualified names ('Foo\\bar') start with an alias ('Foo') or are
+   relative to the namespace
+ - unqualified class names are an alias or in the namespace
+ - unqualified function and constant names are in the namespace if they
+   are defined there, else global (PHP's fallback)
+Resolutions are memoized per scope and the definitions are looked up in
+dicts, so both take constant time.
+
+    table = SymbolTable()
+    for file_path, tree in resource_tree.trees.items():
+        table.add_tree(file_path, tree)
+    scope = table.scope_of(function)
+    for symbol in table.find_function("helper", scope):
+        print(symbol.name, symbol.file_path)
+
+The parser does not support 'use function' and 'use const', so the aliases
+of a scope only apply to class and namespace names.
+"""
+
+from collections import defaultdict
+
+from src.compiler.php import phpast
+
+# Class names that are not resolved, they depend on the calling class
+SPECIAL_CLASSES = frozenset(["self", "parent", "static"])
+SPECIAL_CONSTANTS = frozenset(["true", "false", "null"])
+
+
+def qualify(namespace, name):
+    return f"{namespace}\\{name}" if namespace else name
+
+
+def symbol_key(kind, name):
+    """Returns the key of a fully qualified name in the tables. Class and
+    function names are case insensitive, constants only in their namespace"""
+    if kind == "constant":
+        namespace, separator, short_name = name.rpartition("\\")
+        return namespace.lower() + separator + short_name
+    return name.lower()
+
+
+class Scope:
+    """ A namespace of a file
+
+    Attributes:
+        - file_path: The file
+        - namespace: Name of the namespace, None for the global one
+        - aliases: Maps the lower case aliases of the use declarations to
+          the fully qualified names they stand for
+    """
+
+    def __init__(self, file_path, namespace=None):
+        self.file_path = file_path
+        self.namespace = namespace
+        self.aliases = {}
+
+    def __repr__(self):
+        return f"Scope({self.file_path}, {self.namespace})"
+
+
+class Symbol:
+    """ A definition of a function, class, interface, trait or constant
+
+    Attributes:
+        - kind: 'function', 'class', 'interface', 'trait' or 'constant'
+        - name: The fully qualified name, without leading '\\'
+        - node: The Function, Class, Interface, Trait or ConstantDeclaration
+          node, or the value of a define() call
+        - file_path: The file defining it
+        - scope: The Scope it is defined in
+    """
+
+    __slots__ = ("kind", "name", "node", "file_path", "scope")
+
+    def __init__(self, kind, name, node, file_path, scope):
+        self.kind = kind
+        self.name = name
+        self.node = node
+        self.file_path = file_path
+        self.scope = scope
+
+    def __repr__(self):
+        return f"Symbol({self.kind} {self.name} in {self.file_path})"
+
+
+class SymbolTable:
+    """ Definitions of the whole project, keyed by fully qualified name
+
+    Methods:
+        - add_tree(file_path, tree): Adds the definitions and scopes of a file
+        - resolve_class(name, scope), resolve_function(name, scope),
+          resolve_constant(name, scope): Return the fully qualified name a
+          name used in scope stands for
+        - find_class(name, scope), find_function(name, scope),
+          find_constant(name, scope): Return the Symbols a name used in
+          scope stands for (several when it is defined more than once)
+        - lookup(kind, fully_qualified_name): Returns the Symbols with a
+          fully qualified name ('class' for classes, interfaces and traits)
+        - scope_of(node): Returns the Scope of a function or class-like
+          declaration
+
+    Attributes:
+        - functions, classes, constants: Map the keys of the fully
+          qualified names (see symbol_key) to lists of Symbols. Classes,
+          interfaces and traits share a table, as in PHP
+        - scopes: Maps the file paths to the Scopes of the files
+    """
+
+    def __init__(self):
+        self.functions = defaultdict(list)
+        self.classes = defaultdict(list)
+        self.constants = defaultdict(list)
+        self.tables = {"function": self.functions, "class": self.classes,
+                       "constant": self.constants}
+        self.scopes = {}
+        # Maps the ids of the declarations to their scopes
+        self.declaration_scopes = {}
+        # Maps (scope, kind, name) to the resolved names. The fallback of
+        # functions and constants depends on the definitions, so it is
+        # cleared when they change
+        self.memo = {}
+
+    def add_tree(self, file_path, tree):
+        self.memo.clear()
+        scope = Scope(file_path)
+        scopes = [scope]
+        # Files that failed to parse have no nodes
+        for statement in tree.nodes or []:
+            if isinstance(statement, phpast.Namespace):
+                if statement.nodes:
+                    # namespace Foo { ... }
+                    braced_scope = Scope(file_path, statement.name)
+                    scopes.append(braced_scope)
+                    self.collect(statement.nodes, braced_scope)
+                else:
+                    # namespace Foo; applies to the statements that follow
+                    scope = Scope(file_path, statement.name)
+                    scopes.append(scope)
+                continue
+            self.collect([statement], scope)
+        self.scopes[file_path] = scopes
+
+    def add(self, kind, name, node, scope):
+        table = self.tables["class" if kind in ("interface", "trait") else kind]
+        table[symbol_key(kind, name)].append(Symbol(kind, name, node, scope.file_path, scope))
+
+    def collect(self, nodes, scope):
+        stack = list(reversed(nodes))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(reversed(node))
+                continue
+            if not isinstance(node, phpast.Node):
+                continue
+            kind = type(node)
+            if kind is phpast.UseDeclarations:
+                for declaration in node.nodes:
+                    name = declaration.name.lstrip("\\")
+                    alias = declaration.alias or name.rpartition("\\")[2]
+                    scope.aliases[alias.lower()] = name
+                continue
+            if kind is phpast.Include or kind is phpast.Require:
+                # The bodies of expanded includes belong to their files
+                stack.append(node.expr)
+                continue
+
+            if kind is phpast.Function:
+                self.add("function", qualify(scope.namespace, node.name), node, scope)
+                self.declaration_scopes[id(node)] = scope
+            elif kind in (phpast.Class, phpast.Interface, phpast.Trait) and \
+                    isinstance(node.name, str):
+                self.add(kind.__name__.lower(), qualify(scope.namespace, node.name), node, scope)
+                self.declaration_scopes[id(node)] = scope
+            elif kind is phpast.ConstantDeclarations:
+                for declaration in node.nodes:
+                    self.add("constant", qualify(scope.namespace, declaration.name),
+                             declaration, scope)
+                continue
+            elif kind is phpast.FunctionCall and isinstance(node.name, str) and \
+                    node.name.lstrip("\\").lower() == "define" and len(node.params) > 1:
+                name = node.params[0].node
+                if isinstance(name, str):
+                    # Names given to define() are fully qualified
+                    self.add("constant", name.lstrip("\\"), node.params[1].node, scope)
+            stack.extend(reversed(node.children()))
+
+    def scope_of(self, node):
+        return self.declaration_scopes.get(id(node))
+
+    def lookup(self, kind, name):
+        table = self.tables["class" if kind in ("interface", "trait") else kind]
+        return table.get(symbol_key(kind, name), [])
+
+    def resolve(self, kind, name, scope):
+        key = (scope, kind, name)
+        resolved = self.memo.get(key)
+        if resolved is None:
+            resolved = self.memo[key] = self.resolve_name(kind, name, scope)
+        return resolved
+
+    def resolve_name(self, kind, name, scope):
+        namespace = scope.namespace if scope is not None else None
+        if name.startswith("\\"):
+            return name[1:]
+        if name[:10].lower() == "namespace\\":
+            return qualify(namespace, name[10:])
+        lower_name = name.lower()
+        if kind == "class" and lower_name in SPECIAL_CLASSES or \
+                kind == "constant" and lower_name in SPECIAL_CONSTANTS:
+            return name
+
+        first, separator, rest = name.partition("\\")
+        if separator or kind == "class":
+            alias = scope.aliases.get(first.lower()) if scope is not None else None
+            if alias is not None:
+                return alias + separator + rest
+            return qualify(namespace, name)
+
+        # Unqualified function or constant: the one of the namespace if
+        # there is one, else the global one
+        if namespace:
+            qualified = qualify(namespace, name)
+            if symbol_key(kind, qualified) in self.tables[kind]:
+                return qualified
+        return name
+
+    def resolve_class(self, name, scope):
+        return self.resolve("class", name, scope)
+
+    def resolve_function(self, name, scope):
+        return self.resolve("function", name, scope)
+
+    def resolve_constant(self, name, scope):
+        return self.resolve("constant", name, scope)
+
+    def find_class(self, name, scope):
+        return self.lookup("class", self.resolve("class", name, scope))
+
+    def find_function(self, name, scope):
+        return self.lookup("function", self.resolve("function", name, scope))
+
+    def find_constant(self, name, scope):
+        return self.lookup("constant", self.resolve("constant", name, scope))
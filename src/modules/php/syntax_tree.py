@@ -1,29 +1,190 @@
 import sys
 import os
+import copy
 
 from src.compiler.php import phpparse
 from src.compiler.php import phplex
 from src.compiler.php import phpast
+from src.compiler.php import lalr
 
 lexer = phplex.lexer
 lexer.lineno = 1
 
-parser = phpparse.make_parser()
+# Used for the 'declarations' parse mode (see discovery.PARSE_MODES)
+declarations_lexer = phplex.DeclarationsLexer(phplex.full_lexer)
+
+# PLY's tables driven by the faster engine of the lalr module
+parser = lalr.Parser(phpparse.make_parser())
+# Gives the nodes their start and end offsets in the source code
+span_parser = phpparse.make_parser(spans=True)
+# Parsers building Concat and InterpolatedString nodes (see
+# phpparse.concat_rules), keyed by spans and made on first use
+concat_parsers = {}
+
+
+def concat_parser(spans=False):
+    if spans not in concat_parsers:
+        ply_parser = phpparse.make_parser(spans=spans, concat=True)
+        concat_parsers[spans] = ply_parser if spans else lalr.Parser(ply_parser)
+    return concat_parsers[spans]
+
 
 class SyntaxTree(phpast.Node):
     fields = ['nodes']
+    # Set on views to the tree they share their nodes with
+    shared_with = None
 
-    def __init__(self, source_code_handle, debug=False):
-        source_code = source_code_handle.read()
-        nodes = parser.parse(source_code, lexer=lexer.clone(), debug=debug)
+    def __init__(self, source_code_handle, debug=False, source_code=None, parse_mode="full",
+                 spans=False, tokens=None, profile=None, concat=False):
+        # source_code can be passed in by callers that already had to read
+        # the file (e.g. to hash it) so that it is not read twice. With
+        # tokens (a TokenBuffer, see tokenize) the file is not lexed again.
+        # With profile (a profiling.ParseProfile) the file is parsed by the
+        # instrumented parser of the profile. With concat, '.' chains and
+        # interpolated strings become flat Concat and InterpolatedString
+        # nodes (phpast.expand_concats turns them back into BinaryOps)
+        if tokens is not None:
+            source_code = tokens.source
+        if source_code is None:
+            source_code = source_code_handle.read()
+        if tokens is not None:
+            tree_lexer = tokens.lexer()
+        elif parse_mode == "declarations":
+            tree_lexer = declarations_lexer.clone()
+        else:
+            tree_lexer = lexer.clone()
+        if profile is not None:
+            if spans or debug or concat:
+                raise Exception("Profiling does not support spans, debug or concat")
+            nodes = profile.parse(source_code, tree_lexer, os.path.abspath(source_code_handle.name))
+            self.source_code = None
+        elif spans:
+            tree_parser = concat_parser(spans=True) if concat else span_parser
+            nodes = tree_parser.parse(source_code, lexer=tree_lexer, debug=debug, tracking=True)
+            # The nodes only store offsets, their text is sliced from here
+            self.source_code = source_code
+        else:
+            tree_parser = concat_parser() if concat else parser
+            nodes = tree_parser.parse(source_code, lexer=tree_lexer, debug=debug)
+            self.source_code = None
+        self.parse_mode = parse_mode
         self.nodes = nodes
         self.file_location = os.path.abspath(os.path.dirname(source_code_handle.name))
         self.file_path = os.path.abspath(source_code_handle.name)
         self.file_name = os.path.basename(source_code_handle.name)
+        self.shared_with = None
+
+    def text(self, node):
+        """Returns the source code of node. Requires a tree parsed with spans"""
+        if self.source_code is None:
+            raise Exception("The tree was parsed without spans")
+        if node.lexpos is None:
+            return None
+        return self.source_code[node.lexpos:node.endlexpos]
+
+    def position(self, node):
+        """Returns the (line, column) at which node starts. Requires a tree
+        parsed with spans"""
+        if self.source_code is None:
+            raise Exception("The tree was parsed without spans")
+        if node.lexpos is None:
+            return None
+        # Built on first use, most trees are never asked for columns
+        line_index = self.__dict__.get("line_index")
+        if line_index is None:
+            line_index = self.line_index = phplex.LineIndex(self.source_code)
+        return line_index.position(node.lexpos)
+
+    def view(self, file_path):
+        """Returns a SyntaxTree for file_path that shares the nodes of this
+        tree, for files with the same contents. The per-file attributes of
+        the view are its own, and so are its Include/Require nodes (with the
+        nodes above them), because their bodies depend on the path of the
+        file (see copy_includes)
+        """
+        tree_view = SyntaxTree.__new__(SyntaxTree)
+        tree_view.__dict__.update(self.__dict__)
+        tree_view.nodes = copy_includes(self.nodes)
+        tree_view.file_location = os.path.abspath(os.path.dirname(file_path))
+        tree_view.file_path = os.path.abspath(file_path)
+        tree_view.file_name = os.path.basename(file_path)
+        tree_view.shared_with = self if self.shared_with is None else self.shared_with
+        return tree_view
+
+
+def copy_includes(nodes):
+    """Returns a copy of the list of nodes in which the Include/Require
+    nodes, and the nodes on the way from the top to them, are shallow
+    copies. All the other subtrees are shared. The bodies of the copied
+    Include/Require nodes are reset, so that they are resolved again"""
+    # Post-order list of the nodes, built with an explicit stack. The
+    # bodies of the Include/Require nodes belong to other files
+    order = []
+    stack = [(node, False) for node in phpast.nested_nodes(nodes)]
+    while stack:
+        node, children_done = stack.pop()
+        if children_done:
+            order.append(node)
+            continue
+        stack.append((node, True))
+        for field in node.fields:
+            if field == "body" and type(node) in (phpast.Include, phpast.Require):
+                continue
+            stack.extend((child, False) for child in phpast.nested_nodes(getattr(node, field)))
+
+    # Maps the ids of the nodes holding an Include/Require to their copies
+    copies = {}
+
+    def replace(value):
+        if isinstance(value, phpast.Node):
+            return copies.get(id(value), value)
+        if isinstance(value, list) and any(id(node) in copies
+                                           for node in phpast.nested_nodes(value)):
+            return [replace(item) for item in value]
+        return value
+
+    for node in order:
+        if id(node) in copies:
+            continue
+        if type(node) in (phpast.Include, phpast.Require):
+            node_copy = copy.copy(node)
+            node_copy.body = None
+            copies[id(node)] = node_copy
+            continue
+        if not any(id(child) in copies for field in node.fields
+                   for child in phpast.nested_nodes(getattr(node, field))):
+            continue
+        node_copy = copy.copy(node)
+        for field in node.fields:
+            setattr(node_copy, field, replace(getattr(node, field)))
+        copies[id(node)] = node_copy
+    return replace(nodes)
+
+
+def tokenize(source_code, parse_mode="full"):
+    """Lexes source_code into a TokenBuffer that can be passed to SyntaxTree
+    any number of times"""
+    if parse_mode == "declarations":
+        return phplex.TokenBuffer(source_code, declarations_lexer)
+    return phplex.TokenBuffer(source_code)
+
+
+def iter_statements(file_path, parse_mode="full"):
+    """Yields the top-level statements (classes, functions, statements) of
+    the file as soon as each one is parsed. Only the statement being parsed
+    is held in memory besides the source code, so huge files can be
+    processed one statement at a time"""
+    with open(file_path) as file_handle:
+        source_code = file_handle.read()
+    if parse_mode == "declarations":
+        tree_lexer = declarations_lexer.clone()
+    else:
+        tree_lexer = lexer.clone()
+    yield from parser.statements(source_code, lexer=tree_lexer)
 
 
-def build_syntax_tree(file_path, debug=False):
+def build_syntax_tree(file_path, debug=False, spans=False, concat=False):
     if not os.path.isfile(file_path):
         raise Exception("Please specify a File Path")
     file_handle = open(file_path)
-    return SyntaxTree(file_handle)
+    return SyntaxTree(file_handle, spans=spans, concat=concat)
@@ -0,0 +1,748 @@
+"""Interprocedural taint tracking over the trees of a ResourceTree.
+
+Finds flows of user input (sources, e.g. $_GET) to dangerous functions and
+constructs (sinks, e.g. mysqli_query, eval, echo) that do not go through a
+sanitizer (e.g. intval). The sources, sinks and sanitizers are configured
+with a TaintConfig.
+
+Every function, method and file (its top-level code) is a procedure,
+analyzed on its own into a summary:
+ - returns: the taint of its return value, as source names and the
+   indexes of the parameters that flow into it
+ - sinks: the sinks reached (directly or through the functions it calls)
+   by its parameters
+The summary of a function is computed once and applied at each call site
+(the callees are found by name through the function and method tables of
+the ResourceTree). A worklist runs the procedures again when the summary
+of a function they call changes, until nothing changes. Flows from sources
+to sinks are reported as TaintFindings, with the call sites they go
+through.
+
+Inside a procedure the analysis follows the structure of the code: an
+assignment to a variable replaces its taint (so '$id = intval($id)'
+sanitizes $id from there on), the branches of if and switch statements
+are merged and loops are repeated until their taint does not change.
+Array elements and object properties only ever gain taint.
+
+Summaries can be kept in a SummaryCache between runs. A cached summary is
+reused as long as the structural hash of its function (see
+phpast.Node.structural_hash) and of all the functions it calls, directly
+or not, are unchanged.
+
+    analysis = TaintAnalysis(resource_tree)
+    for finding in analysis.run():
+        print(finding)
+"""
+
+from collections import defaultdict, deque
+
+from src.compiler.php import phpast
+
+EMPTY = frozenset()
+
+DEFAULT_SOURCES = frozenset(["$_GET", "$_POST", "$_COOKIE", "$_REQUEST", "$_FILES"])
+
+DEFAULT_SINKS = frozenset([
+    # SQL
+    "mysql_query", "mysql_db_query", "mysql_unbuffered_query", "mysqli_query",
+    "mysqli_multi_query", "mysqli_real_query", "pg_query", "sqlite_query", "mssql_query",
+    "->query", "->multi_query", "->real_query", "->exec",
+    # Code and command execution
+    "eval", "assert", "create_function", "system", "exec", "shell_exec", "passthru", "popen",
+    "proc_open", "pcntl_exec",
+    # Output
+    "echo", "print", "exit", "die", "printf",
+    # File inclusion
+    "include", "require",
+])
+
+DEFAULT_SANITIZERS = frozenset([
+    "intval", "floatval", "boolval", "abs", "round", "number_format", "count", "strlen",
+    "is_numeric", "ctype_digit", "ctype_alnum", "md5", "sha1", "hash", "crc32",
+    "htmlspecialchars", "htmlentities", "strip_tags", "urlencode", "rawurlencode",
+    "addslashes", "mysql_escape_string", "mysql_real_escape_string",
+    "mysqli_real_escape_string", "pg_escape_string", "pg_escape_literal", "sqlite_escape_string",
+    "escapeshellarg", "escapeshellcmd",
+    "->quote", "->escape_string", "->real_escape_string",
+])
+
+# Operators whose result is a number or a boolean
+CLEAN_OPERATORS = frozenset(["==", "!=", "<>", "===", "!==", "<", ">", "<=", ">=", "<=>",
+                             "&&", "||", "and", "or", "xor", "instanceof",
+                             "+", "-", "*", "/", "%", "**", "<<", ">>"])
+CLEAN_ASSIGN_OPERATORS = frozenset(["+=", "-=", "*=", "/=", "%=", "**=", "<<=", ">>="])
+CLEAN_CASTS = frozenset(["int", "integer", "float", "double", "real", "bool", "boolean", "unset"])
+
+# Nodes defining procedures of their own, skipped when met in a body
+DECLARATIONS = (phpast.Function, phpast.Class, phpast.Interface, phpast.Trait, phpast.Method)
+
+
+class TaintConfig:
+    """ Sources, sinks and sanitizers of a TaintAnalysis
+
+    Attributes:
+        - sources: Names of the variables (starting with '$') and functions
+          whose values are tainted
+        - sinks: Names of the functions and constructs (echo, print, exit,
+          die, eval, include, require) that must not get tainted values
+        - sanitizers: Names of the functions whose results are not tainted
+    Method names are written with a leading '->' (e.g. '->query') and match
+    calls of methods and static methods with that name. Function and method
+    names are case insensitive
+    """
+
+    def __init__(self, sources=DEFAULT_SOURCES, sinks=DEFAULT_SINKS,
+                 sanitizers=DEFAULT_SANITIZERS):
+        self.sources = frozenset(name if name.startswith("$") else name.lower()
+                                 for name in sources)
+        self.sinks = frozenset(name.lower() for name in sinks)
+        self.sanitizers = frozenset(name.lower() for name in sanitizers)
+
+    def key(self):
+        return (tuple(sorted(self.sources)), tuple(sorted(self.sinks)),
+                tuple(sorted(self.sanitizers)))
+
+
+class TaintSummary:
+    """ What a procedure does with taint
+
+    Attributes:
+        - returns: Source names and parameter indexes flowing into the
+          return value
+        - sinks: Set of (sink, file path, line, parameter indexes, call
+          path) for the sinks reached by the parameters
+    """
+
+    __slots__ = ("returns", "sinks")
+
+    def __init__(self, returns=EMPTY, sinks=EMPTY):
+        self.returns = returns
+        self.sinks = sinks
+
+    def __eq__(self, other):
+        return self.returns == other.returns and self.sinks == other.sinks
+
+    def __repr__(self):
+        return f"TaintSummary(returns={set(self.returns)}, {len(self.sinks)} sinks)"
+
+
+EMPTY_SUMMARY = TaintSummary()
+
+
+class TaintFinding:
+    """ A flow of sources to a sink
+
+    Attributes:
+        - sink: Name of the sink
+        - file_path, lineno: Where the sink is
+        - sources: Names of the sources reaching it
+        - call_path: (file path, line) of the calls the flow goes through,
+          starting with the one in the procedure that reads the sources.
+          Empty when the sources are read where the sink is
+    """
+
+    def __init__(self, sink, file_path, lineno, sources, call_path=()):
+        self.sink = sink
+        self.file_path = file_path
+        self.lineno = lineno
+        self.sources = sources
+        self.call_path = call_path
+
+    def __repr__(self):
+        via = "".join(f" via {file_path}:{lineno}" for file_path, lineno in self.call_path)
+        return (f"{', '.join(sorted(self.sources))} reaches {self.sink} at "
+                f"{self.file_path}:{self.lineno}{via}")
+
+
+class CacheEntry:
+    __slots__ = ("digest", "summary", "findings", "dependencies", "callees")
+
+    def __init__(self, digest, summary, findings, dependencies, callees):
+        self.digest = digest
+        self.summary = summary
+        self.findings = findings
+        # Maps the (kind, name) of the calls to the digests of the
+        # procedures they resolved to
+        self.dependencies = dependencies
+        self.callees = callees
+
+
+class SummaryCache:
+    """ Summaries and findings of the procedures of earlier runs, keyed by
+    procedure. Pass the same cache to the TaintAnalysis of every run. It is
+    cleared when the configuration changes
+    """
+
+    def __init__(self):
+        self.config_key = None
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def shortest(path, other):
+    return min(path, other, key=lambda call_path: (len(call_path), call_path))
+
+
+def target_key(node):
+    """Returns the name under which the taint of an assigned variable,
+    property or array is kept, or None for dynamic targets"""
+    suffix = ""
+    while True:
+        if isinstance(node, (phpast.ArrayOffset, phpast.StringOffset)):
+            node = node.node
+        elif isinstance(node, phpast.ForeachVariable):
+            node = node.name
+        elif isinstance(node, phpast.ObjectProperty) and isinstance(node.name, str):
+            suffix = "->" + node.name + suffix
+            node = node.node
+        elif isinstance(node, phpast.StaticProperty):
+            if isinstance(node.node, str) and isinstance(node.name, phpast.Variable) and \
+                    isinstance(node.name.name, str):
+                return f"{node.node}::{node.name.name}{suffix}"
+            return None
+        elif isinstance(node, phpast.Variable) and isinstance(node.name, str):
+            return node.name + suffix
+        else:
+            return None
+
+
+def join(envs):
+    """Merges the taint of the variables in envs"""
+    merged = dict(envs[0])
+    for env in envs[1:]:
+        for key, labels in env.items():
+            current = merged.get(key)
+            merged[key] = labels if current is None else current | labels
+    return merged
+
+
+class ProcedureAnalysis:
+    """Analysis of one procedure, with the summaries known so far.
+
+    Taint is a frozenset of labels: source names (str) and parameter
+    indexes (int). The taint of the variables (the env) is a dict mapping
+    their names (see target_key) to their taint"""
+
+    def __init__(self, engine, file_path, params=()):
+        self.engine = engine
+        self.config = engine.config
+        self.file_path = file_path
+        self.env = {}
+        for index, param in enumerate(params):
+            if isinstance(param, phpast.FormalParameter) and isinstance(param.name, str):
+                self.env[param.name] = frozenset([index])
+        self.returns = set()
+        # Maps (sink, file path, line) to [taint, shortest call path]
+        self.sink_hits = {}
+        self.callees = set()
+        # (kind, name) of the resolved calls
+        self.calls = set()
+
+    def run(self, nodes):
+        self.statements(nodes or [], self.env)
+
+    def statements(self, nodes, env):
+        """Returns the env after the statements. The statements do not
+        recurse on their nesting: transfer() yields the nested statements
+        it needs the env after, and their generators are run from a stack
+        here, so that deeply nested code does not hit the recursion limit.
+        The expressions are evaluated with explicit stacks as well"""
+        stack = [self.sequence(nodes, env)]
+        result = None
+        while stack:
+            try:
+                node, env = stack[-1].send(result)
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+                continue
+            stack.append(self.transfer(node, env))
+            result = None
+        return result
+
+    def sequence(self, nodes, env):
+        for node in nodes:
+            env = yield node, env
+        return env
+
+    def transfer(self, node, env):
+        """Generator returning the env after node. Yields (node, env) to
+        get the env after a nested statement"""
+        if isinstance(node, list):
+            return (yield from self.sequence(node, env))
+        if not isinstance(node, phpast.Node) or isinstance(node, DECLARATIONS):
+            return env
+        kind = type(node)
+
+        if kind is phpast.Block or kind is phpast.Namespace:
+            return (yield from self.sequence(node.nodes or [], env))
+        if kind is phpast.If:
+            self.evaluate(node.expr, env)
+            ends = [(yield node.node, dict(env))]
+            for elseif in node.elseifs or []:
+                self.evaluate(elseif.expr, env)
+                ends.append((yield elseif.node, dict(env)))
+            if node.else_ is not None:
+                ends.append((yield node.else_.node, dict(env)))
+            else:
+                ends.append(env)
+            return join(ends)
+        if kind is phpast.While:
+            def body(env):
+                self.evaluate(node.expr, env)
+                return (yield node.node, env)
+            self.evaluate(node.expr, env)
+            return (yield from self.loop(body, env))
+        if kind is phpast.DoWhile:
+            def body(env):
+                env = yield node.node, env
+                self.evaluate(node.expr, env)
+                return env
+            return (yield from self.loop(body, (yield from body(env))))
+        if kind is phpast.For:
+            for expr in node.start or []:
+                self.evaluate(expr, env)
+
+            def body(env):
+                for expr in node.test or []:
+                    self.evaluate(expr, env)
+                env = yield node.node, env
+                for expr in node.count or []:
+                    self.evaluate(expr, env)
+                return env
+            return (yield from self.loop(body, env))
+        if kind is phpast.Foreach:
+            labels = self.evaluate(node.expr, env)
+
+            def body(env):
+                for variable in (node.keyvar, node.valvar):
+                    if variable is not None:
+                        self.assign(variable, labels, env)
+                return (yield node.node, env)
+            return (yield from self.loop(body, env))
+        if kind is phpast.Switch:
+            self.evaluate(node.expr, env)
+            ends = [env]
+            previous = None
+            for case in node.nodes or []:
+                # Falls through from the previous case
+                start = dict(env) if previous is None else join([env, previous])
+                if isinstance(case, phpast.Case):
+                    self.evaluate(case.expr, start)
+                previous = yield case.nodes or [], start
+                ends.append(previous)
+            return join(ends)
+        if kind is phpast.Try:
+            body_end = yield node.nodes or [], dict(env)
+            ends = [body_end]
+            catch_start = join([env, body_end])
+            for catch in node.catches or []:
+                ends.append((yield catch.nodes or [], dict(catch_start)))
+            env = join(ends)
+            # 'finally' is a keyword
+            finally_ = getattr(node, "finally")
+            if finally_ is not None:
+                env = yield finally_.nodes or [], env
+            return env
+        if kind is phpast.Return:
+            self.returns.update(self.evaluate(node.node, env))
+            return env
+        if kind is phpast.Unset:
+            for variable in node.nodes:
+                if isinstance(variable, phpast.Variable):
+                    key = target_key(variable)
+                    if key is not None:
+                        env[key] = EMPTY
+            return env
+        if kind is phpast.Declare:
+            return (yield node.node, env)
+        if kind is phpast.Global or kind is phpast.InlineHTML:
+            return env
+
+        self.evaluate(node, env)
+        return env
+
+    def loop(self, body, env):
+        """Runs body (a generator function of the env, like transfer) until
+        the taint at the start of the loop does not change"""
+        while True:
+            merged = join([env, (yield from body(dict(env)))])
+            if merged == env:
+                return env
+            env = merged
+
+    def assign(self, target, labels, env):
+        if isinstance(target, phpast.ListAssignment):
+            for node in target.nodes:
+                self.assign(node, labels, env)
+            return
+        if isinstance(target, list):
+            for node in target:
+                self.assign(node, labels, env)
+            return
+        key = target_key(target)
+        if key is None:
+            return
+        if isinstance(target, phpast.ForeachVariable):
+            target = target.name
+        if isinstance(target, phpast.Variable):
+            env[key] = labels
+        else:
+            # Other elements or properties keep their taint
+            env[key] = env.get(key, EMPTY) | labels
+
+    def read(self, node, env):
+        """Taint of a variable, or None if the node is not one"""
+        if type(node) is phpast.Variable:
+            name = node.name
+            if not isinstance(name, str):
+                return EMPTY
+            labels = env.get(name, EMPTY)
+            if name in self.config.sources:
+                labels = labels | frozenset([name])
+            return labels
+        if type(node) is phpast.StaticProperty:
+            key = target_key(node)
+            return EMPTY if key is None else env.get(key, EMPTY)
+        return None
+
+    def evaluate(self, expr, env):
+        """Returns the taint of expr, applying its assignments to env and
+        recording the sinks it reaches. Post-order walk with an explicit
+        stack, operands are evaluated left to right"""
+        if not isinstance(expr, phpast.Node):
+            return EMPTY
+        results = {}
+        stack = [(expr, False)]
+        while stack:
+            node, operands_done = stack.pop()
+            if not operands_done:
+                labels = self.read(node, env)
+                if labels is not None:
+                    results[id(node)] = labels
+                    continue
+                if isinstance(node, phpast.Closure):
+                    self.closure(node, env)
+                    continue
+                if isinstance(node, DECLARATIONS):
+                    continue
+                stack.append((node, True))
+                for operand in reversed(self.operands(node)):
+                    stack.append((operand, False))
+                continue
+            results[id(node)] = self.combine(node, results, env)
+        return results.get(id(expr), EMPTY)
+
+    def operands(self, node):
+        kind = type(node)
+        if kind is phpast.Assignment or kind is phpast.ListAssignment:
+            operands = [node.expr]
+        elif kind is phpast.AssignOp:
+            operands = [node.right]
+        elif kind is phpast.Include or kind is phpast.Require:
+            # Not the body of an expanded include
+            operands = [node.expr]
+        else:
+            return node.children()
+        return [operand for operand in operands if isinstance(operand, phpast.Node)]
+
+    def combine(self, node, results, env):
+        """Taint of node from the taint of its operands"""
+        kind = type(node)
+
+        def get(value):
+            return results.get(id(value), EMPTY) if isinstance(value, phpast.Node) else EMPTY
+
+        if kind is phpast.Assignment:
+            labels = get(node.expr)
+            self.assign(node.node, labels, env)
+            return labels
+        if kind is phpast.ListAssignment:
+            labels = get(node.expr)
+            self.assign(node.nodes, labels, env)
+            return labels
+        if kind is phpast.AssignOp:
+            key = target_key(node.left)
+            if node.op in CLEAN_ASSIGN_OPERATORS:
+                labels = EMPTY
+            else:
+                labels = (env.get(key, EMPTY) if key is not None else EMPTY) | get(node.right)
+            if key is not None:
+                env[key] = labels
+            return labels
+        if kind is phpast.BinaryOp:
+            if node.op in CLEAN_OPERATORS:
+                return EMPTY
+            return get(node.left) | get(node.right)
+        if kind is phpast.Cast:
+            return EMPTY if node.type in CLEAN_CASTS else get(node.expr)
+        if kind is phpast.TernaryOp:
+            return (get(node.expr) if node.iftrue is None else get(node.iftrue)) | get(node.iffalse)
+        if kind in (phpast.UnaryOp, phpast.IsSet, phpast.Empty, phpast.PreIncDecOp,
+                    phpast.PostIncDecOp, phpast.Constant, phpast.MagicConstant):
+            return EMPTY
+        if kind is phpast.ArrayOffset or kind is phpast.StringOffset:
+            return get(node.node)
+        if kind is phpast.ObjectProperty:
+            key = target_key(node)
+            return (env.get(key, EMPTY) if key is not None else EMPTY) | get(node.node)
+        if kind is phpast.ArrayElement:
+            return get(node.value)
+        if kind in (phpast.FunctionCall, phpast.MethodCall, phpast.StaticMethodCall):
+            return self.call(node, get)
+
+        if kind is phpast.Echo:
+            labels = EMPTY
+            for value in node.nodes:
+                labels = labels | get(value)
+            self.sink("echo", node, labels)
+            return EMPTY
+        if kind is phpast.Print:
+            self.sink("print", node, get(node.node))
+            return EMPTY
+        if kind is phpast.Exit:
+            self.sink(node.type or "exit", node, get(node.expr))
+            return EMPTY
+        if kind is phpast.Eval:
+            self.sink("eval", node, get(node.expr))
+            return EMPTY
+        if kind is phpast.Include or kind is phpast.Require:
+            self.sink(kind.__name__.lower(), node, get(node.expr))
+            return EMPTY
+
+        labels = EMPTY
+        for child in node.children():
+            labels = labels | get(child)
+        return labels
+
+    def call(self, node, get):
+        args = [get(param) for param in node.params or []]
+        labels = EMPTY
+        for arg in args:
+            labels = labels | arg
+        if isinstance(node, phpast.MethodCall):
+            # Unknown methods of tainted objects return tainted values
+            labels = labels | get(node.node)
+        if not isinstance(node.name, str):
+            return labels
+
+        is_method = not isinstance(node, phpast.FunctionCall)
+        name = ("->" + node.name if is_method else node.name).lower()
+        config = self.config
+        if name in config.sinks:
+            self.sink(name, node, labels)
+        if name in config.sanitizers:
+            return EMPTY
+        if name in config.sources:
+            return frozenset([name])
+
+        kind = "method" if is_method else "function"
+        procedures = self.engine.resolve(kind, node.name)
+        if not procedures:
+            return labels
+        self.calls.add((kind, node.name.lower()))
+        self.callees.update(procedures)
+
+        call_site = ((self.file_path, node.lineno),)
+        labels = EMPTY
+        for procedure in procedures:
+            summary = self.engine.summaries.get(procedure, EMPTY_SUMMARY)
+            for label in summary.returns:
+                if isinstance(label, int):
+                    if label < len(args):
+                        labels = labels | args[label]
+                else:
+                    labels = labels | frozenset([label])
+            for sink, file_path, lineno, params, call_path in summary.sinks:
+                reaching = EMPTY
+                for param in params:
+                    if param < len(args):
+                        reaching = reaching | args[param]
+                self.hit(sink, file_path, lineno, call_site + call_path, reaching)
+        return labels
+
+    def closure(self, node, env):
+        """Analyzes the body of a closure where it is defined, with the
+        variables it imports"""
+        closure_env = {}
+        for variable in node.vars or []:
+            if isinstance(variable.name, str) and variable.name in env:
+                closure_env[variable.name] = env[variable.name]
+        self.statements(node.nodes or [], closure_env)
+
+    def sink(self, name, node, labels):
+        if name in self.config.sinks:
+            self.hit(name, self.file_path, node.lineno, (), labels)
+
+    def hit(self, sink, file_path, lineno, call_path, labels):
+        if not labels:
+            return
+        key = (sink, file_path, lineno)
+        entry = self.sink_hits.get(key)
+        if entry is None:
+            self.sink_hits[key] = [set(labels), call_path]
+        else:
+            entry[0].update(labels)
+            entry[1] = shortest(entry[1], call_path)
+
+    def results(self):
+        """Returns (summary, findings) of the procedure"""
+        sinks = set()
+        findings = []
+        for (sink, file_path, lineno), (labels, call_path) in self.sink_hits.items():
+            params = frozenset(label for label in labels if isinstance(label, int))
+            sources = frozenset(label for label in labels if not isinstance(label, int))
+            if params:
+                sinks.add((sink, file_path, lineno, params, call_path))
+            if sources:
+                findings.append(TaintFinding(sink, file_path, lineno, sources, call_path))
+        return TaintSummary(frozenset(self.returns), frozenset(sinks)), findings
+
+
+class TaintAnalysis:
+    """ Taint analysis of all the trees of a ResourceTree, whose tables
+    (see ResourceTree.build_tables) are used to find the called functions
+
+    Methods:
+        - run(): Analyzes the project and returns the TaintFindings
+        - report(): Returns the findings of the last run as text
+
+    Attributes:
+        - summaries: Maps procedures to their TaintSummary
+        - findings: TaintFindings of the last run
+        - analyzed: Number of procedure analyses run (a procedure is
+          analyzed again when the summary of a function it calls changes)
+        - reused: Number of procedures whose summary came from the cache
+    """
+
+    def __init__(self, resource_tree, config=None, cache=None):
+        self.resource_tree = resource_tree
+        self.config = config or TaintConfig()
+        self.cache = cache
+        self.summaries = {}
+        self.findings = []
+        self.analyzed = 0
+        self.reused = 0
+        # Maps procedures, ('function', file path, name), ('method', file
+        # path, name) or ('main', file path), to (node, body, params)
+        self.procedures = {}
+        # Maps ('function' or 'method', lower case name) to procedures
+        self.by_name = defaultdict(list)
+        self.digests = {}
+
+    def collect_procedures(self):
+        rt = self.resource_tree
+        self.procedures = {}
+        self.by_name = defaultdict(list)
+        for file_path, functions in rt.function_table.items():
+            for name, function in functions.items():
+                key = ("function", file_path, name)
+                self.procedures[key] = (function, function.nodes, function.params)
+                self.by_name["function", name.lower()].append(key)
+        for file_path, methods in rt.method_table.items():
+            for name, (method, _) in methods.items():
+                key = ("method", file_path, name)
+                self.procedures[key] = (method, method.nodes, method.params)
+                self.by_name["method", name.lower()].append(key)
+        for file_path, tree in rt.trees.items():
+            self.procedures["main", file_path] = (tree, tree.nodes, ())
+        self.digests = {key: node.structural_hash(with_lineno=True)
+                        for key, (node, _, _) in self.procedures.items()}
+
+    def resolve(self, kind, name):
+        return self.by_name.get((kind, name.lower()))
+
+    def dependencies(self, calls):
+        return {call: tuple(sorted(self.digests[procedure] for procedure in self.by_name[call]))
+                for call in calls}
+
+    def run(self):
+        self.collect_procedures()
+        self.analyzed = 0
+        self.reused = 0
+        self.summaries = {}
+        findings = {}
+        callers = defaultdict(set)
+
+        valid = {}
+        cache = self.cache
+        if cache is not None:
+            if cache.config_key != self.config.key():
+                cache.config_key = self.config.key()
+                cache.entries = {}
+            for key, entry in cache.entries.items():
+                if key in self.procedures and entry.digest == self.digests[key] and \
+                        self.dependencies(entry.dependencies) == entry.dependencies:
+                    valid[key] = entry
+            # A summary is only valid if the summaries of all the functions
+            # it calls, directly or not, are
+            cached_callers = defaultdict(set)
+            for key, entry in valid.items():
+                for callee in entry.callees:
+                    cached_callers[callee].add(key)
+            stack = [key for key in self.procedures if key not in valid]
+            while stack:
+                for caller in cached_callers.get(stack.pop(), ()):
+                    if caller in valid:
+                        del valid[caller]
+                        stack.append(caller)
+            for key, entry in valid.items():
+                self.summaries[key] = entry.summary
+                findings[key] = entry.findings
+                for callee in entry.callees:
+                    callers[callee].add(key)
+            self.reused = len(valid)
+
+        # Functions and methods first, so that the files mostly see their
+        # final summaries
+        worklist = deque(key for key in self.procedures if key not in valid and key[0] != "main")
+        worklist.extend(key for key in self.procedures if key not in valid and key[0] == "main")
+        queued = set(worklist)
+        while worklist:
+            key = worklist.popleft()
+            queued.discard(key)
+            node, body, params = self.procedures[key]
+            analysis = ProcedureAnalysis(self, key[1], params)
+            analysis.run(body)
+            self.analyzed += 1
+            summary, findings[key] = analysis.results()
+            for callee in analysis.callees:
+                callers[callee].add(key)
+            if cache is not None:
+                cache.entries[key] = CacheEntry(self.digests[key], summary, findings[key],
+                                                self.dependencies(analysis.calls),
+                                                frozenset(analysis.callees))
+            if summary != self.summaries.get(key, EMPTY_SUMMARY):
+                self.summaries[key] = summary
+                for caller in callers[key]:
+                    if caller not in queued:
+                        queued.add(caller)
+                        worklist.append(caller)
+
+        if cache is not None:
+            for key in list(cache.entries):
+                if key not in self.procedures:
+                    del cache.entries[key]
+
+        # The same flow can be found from several procedures
+        unique = {}
+        for procedure_findings in findings.values():
+            for finding in procedure_findings:
+                finding_key = (finding.sink, finding.file_path, finding.lineno, finding.call_path)
+                if finding_key in unique:
+                    unique[finding_key].sources = unique[finding_key].sources | finding.sources
+                else:
+                    unique[finding_key] = TaintFinding(finding.sink, finding.file_path,
+                                                       finding.lineno, finding.sources,
+                                                       finding.call_path)
+        self.findings = sorted(unique.values(), key=lambda finding: (
+            finding.file_path, finding.lineno or 0, finding.sink, finding.call_path))
+        return self.findings
+
+    def report(self):
+        lines = [f"{len(self.findings)} taint flows found ({self.analyzed} procedure analyses, "
+                 f"{self.reused} cached summaries reused)"]
+        lines.extend(repr(finding) for finding in self.findings)
+        return "\n".join(lines)
@@ -4,14 +4,21 @@ import collections
 
 from src.compiler.php import phpast
 
-from src.modules.php.base import Traverser, Visitor
+from src.modules.php.base import Traverser, Visitor, LEAVE
 from src.modules.php import syntax_tree
 
 class BFTraverser(Traverser):
-    """Performs a Breadth-First Traversal on the syntax_tree"""
+    """Performs a Breadth-First Traversal on the syntax_tree
 
-    def __init__(self, syntax_tree, visitors=[]):
+    shared_subtrees is one of the modes in base.SHARED_SUBTREE_MODES and
+    controls how SyntaxTrees grafted into several Include/Require nodes are
+    walked. In 'replay' mode a shared subtree is walked as a whole at its
+    first site, before the traversal goes on with the rest of the queue
+    """
+
+    def __init__(self, syntax_tree, visitors=[], shared_subtrees="visit"):
         self.syntax_tree = syntax_tree
+        self.init_shared_subtrees(shared_subtrees)
         # nearest_ns_parent is the last parent of a node that is a SyntaxTree, Class, 
         # Function or Namespace (Nearest Namespace Parent). For the root
         # node, it is None. Keeping track of the namespace stack in BFT was 
@@ -31,21 +38,43 @@ class BFTraverser(Traverser):
             raise Exception("Visitor already registered with Traverser")
 
     def traverse(self):
+        self.begin_traversal()
+        self.walk(self.syntax_tree)
+
+    def walk(self, root):
         # Queue of Nodes to visit
-        queue = collections.deque([self.syntax_tree])
+        queue = collections.deque([root])
 
         while len(queue):
             current_node = queue.popleft()
 
+            if self.shared_subtrees != "visit" and current_node is not root \
+                    and self.is_shared_subtree(current_node):
+                self.resolve_namespace(current_node)
+                if id(current_node) in self.seen_subtrees:
+                    if self.shared_subtrees == "replay":
+                        self.replay_subtree(current_node)
+                    continue
+                if self.shared_subtrees == "replay":
+                    self.begin_subtree(current_node)
+                    self.walk(current_node)
+                    self.end_subtree(current_node)
+                    continue
+                self.seen_subtrees[id(current_node)] = current_node
+
             # Enter Node
             for visitor in self.visitors:
                 visitor.enter(current_node)
 
             # Only let Node instances past this
             if not isinstance(current_node, phpast.Node):
+                if self.recordings:
+                    self.record_event(current_node)
                 continue
 
             self.resolve_namespace(current_node) # Updates the Namespace Stack
+            if self.recordings:
+                self.record_event(current_node)
 
             # If current node defines a Namespace, change the Nearest
             # Namespace Parent of all the child nodes
@@ -72,6 +101,8 @@ class BFTraverser(Traverser):
                         if isinstance(field_value_node, phpast.Node):
                             field_value_node.nearest_ns_parent = child_nearest_ns_parent
 
+            if self.recordings:
+                self.record_event(current_node, LEAVE)
             for visitor in self.visitors:
                 visitor.leave(current_node)
 
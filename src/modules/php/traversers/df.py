@@ -3,14 +3,20 @@ import os
 
 from src.compiler.php import phpast
 from src.modules.php import syntax_tree
-from src.modules.php.base import Traverser
+from src.modules.php.base import Traverser, LEAVE
 
 class DFTraverser(Traverser):
-    """ Recursive Depth First Traverser"""
+    """ Depth First Traverser
 
-    def __init__(self, syntax_tree, visitors=[]):
+    shared_subtrees is one of the modes in base.SHARED_SUBTREE_MODES and
+    controls how SyntaxTrees grafted into several Include/Require nodes are
+    walked
+    """
+
+    def __init__(self, syntax_tree, visitors=[], shared_subtrees="visit"):
         self.syntax_tree = syntax_tree
         self.namespace_stack = []
+        self.init_shared_subtrees(shared_subtrees)
         for visitor in visitors:
             visitor.register_with(self)
         self.visitors = [*visitors]
@@ -23,40 +29,78 @@ class DFTraverser(Traverser):
             raise Exception("Visitor already registered with Traverser")
 
     def traverse(self, current_node=None):
-        # Visitor Enters
-        for visitor in self.visitors:
-            visitor.enter(current_node)
+        if current_node is None:
+            self.begin_traversal()
 
-        if len(self.namespace_stack) == 0:
-            # On first iteration
-            current_node = self.syntax_tree
+        # Explicit stack instead of recursion, so that deep trees do not hit
+        # the recursion limit. Holds (item, False) for the items still to be
+        # walked and (node, first_walk) pairs for the nodes to be left once
+        # their children are done
+        stack = [(current_node, None)]
+        while stack:
+            current_node, first_walk = stack.pop()
+            if first_walk is not None:
+                self.leave_node(current_node, first_walk)
+                continue
 
-        # Only let Node instances past this
-        if not isinstance(current_node, phpast.Node):
-            return
+            first_walk = False
+            if self.shared_subtrees != "visit" and self.is_shared_subtree(current_node):
+                if id(current_node) in self.seen_subtrees:
+                    if self.shared_subtrees == "replay":
+                        self.replay_subtree(current_node)
+                    continue
+                if self.shared_subtrees == "replay":
+                    self.begin_subtree(current_node)
+                    first_walk = True
+                else:
+                    self.seen_subtrees[id(current_node)] = current_node
 
-        for visitor in self.visitors:
-            # Visitor Visits
-            current_node.accept(visitor)
-
-        if type(current_node) in (syntax_tree.SyntaxTree, phpast.Class, phpast.Function, phpast.Namespace, phpast.Interface):
-            # Update the namespace stack
-            self.namespace_stack.append(current_node)
-
-        # Recurse 
-        for field in current_node.fields:
-            field_value = getattr(current_node, field)
-            if isinstance(field_value, phpast.Node):
-                self.traverse(current_node=field_value)
-            elif isinstance(field_value, list):
-                for node in field_value:
-                    self.traverse(current_node=node)
+            # Visitor Enters
+            for visitor in self.visitors:
+                visitor.enter(current_node)
+
+            if len(self.namespace_stack) == 0:
+                # On first iteration
+                current_node = self.syntax_tree
+
+            if self.recordings:
+                self.record_event(current_node)
+
+            # Only let Node instances past this
+            if not isinstance(current_node, phpast.Node):
+                continue
 
+            for visitor in self.visitors:
+                # Visitor Visits
+                current_node.accept(visitor)
+
+            if type(current_node) in (syntax_tree.SyntaxTree, phpast.Class, phpast.Function, phpast.Namespace, phpast.Interface):
+                # Update the namespace stack
+                self.namespace_stack.append(current_node)
+
+            # The node is left after all of its children
+            stack.append((current_node, first_walk))
+            children = []
+            for field in current_node.fields:
+                field_value = getattr(current_node, field)
+                if isinstance(field_value, phpast.Node):
+                    children.append(field_value)
+                elif isinstance(field_value, list):
+                    children.extend(field_value)
+            stack.extend((child, None) for child in reversed(children))
+
+    def leave_node(self, current_node, first_walk):
         # Remove the current_node from the stack before the traverser
         # gets out of it
         if type(current_node) in (syntax_tree.SyntaxTree, phpast.Class, phpast.Function, phpast.Namespace):
             self.namespace_stack.pop()
 
+        if self.recordings:
+            self.record_event(current_node, LEAVE)
+
         for visitor in self.visitors:
             # Visitor Leaves
             visitor.leave(current_node)
+
+        if first_walk:
+            self.end_subtree(current_node)
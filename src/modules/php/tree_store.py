@@ -0,0 +1,143 @@
+"""Memoized store of SyntaxTrees for the resolvers that expand includes.
+
+Trees are keyed by the normalized path of the file and a hash of its
+contents (discovery.content_hash of its bytes), so a file that is included
+from many places is only parsed once for as long as it does not change on
+disk. Optionally, the parsed trees are also kept in an on-disk cache
+directory so that later runs can skip parsing altogether.
+
+The trees are handed out as they are and the resolvers expand their
+includes in place, so the bodies of the includes depend on the resolution
+that set them. Each DependencyResolver has a store of its own unless one is
+passed to it: only share a store between resolutions of the same project,
+and bound it (max_trees) in long-running processes.
+"""
+
+import io
+import os
+import hashlib
+
+from collections import OrderedDict
+
+from src.modules.php import syntax_tree
+from src.modules.php import serialization
+from src.modules.php.discovery import content_hash
+
+
+class TreeStore:
+    """ Cache of SyntaxTrees keyed by (normalized path, content hash)
+
+    Methods:
+        - get(file_path): Returns the SyntaxTree for file_path, parsing the
+          file only if it has not been seen before or its contents changed
+        - clear(): Drops all the trees held in memory and resets the counters
+
+    Attributes:
+        - cache_dir: Directory of the on-disk cache. None disables it
+        - max_trees: Number of trees kept in memory, the least recently
+          used ones are dropped first. None keeps all of them
+        - hits: Number of lookups answered from memory
+        - disk_hits: Number of lookups answered from the on-disk cache
+        - misses: Number of lookups that required parsing the file
+    """
+
+    # Bumped whenever the layout of the on-disk entries changes
+    cache_version = 4
+
+    def __init__(self, cache_dir=None, debug=False, max_trees=None):
+        self.cache_dir = cache_dir
+        self.debug = debug
+        self.max_trees = max_trees
+        # Maps normalized paths to (stat key, content hash, SyntaxTree), the
+        # most recently used last
+        self.trees = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_dir is not None:
+            self.cache_dir = os.path.abspath(self.cache_dir)
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, file_path):
+        file_path = os.path.normpath(os.path.abspath(file_path))
+        stat_result = os.stat(file_path)
+        stat_key = (stat_result.st_mtime_ns, stat_result.st_size)
+
+        entry = self.trees.get(file_path)
+        # Unchanged mtime and size means the contents do not have to be
+        # read and hashed again
+        if entry is not None and entry[0] == stat_key:
+            self.hits += 1
+            self.trees.move_to_end(file_path)
+            return entry[2]
+
+        with open(file_path, "rb") as file_handle:
+            data = file_handle.read()
+        digest = content_hash(data)
+
+        if entry is not None and entry[1] == digest:
+            # Only the timestamp changed
+            self.hits += 1
+            tree = entry[2]
+        else:
+            tree = self.load(file_path, digest)
+            if tree is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                # Decoded like a file opened in text mode
+                source_code = io.TextIOWrapper(io.BytesIO(data)).read()
+                tree = syntax_tree.SyntaxTree(file_handle, source_code=source_code)
+                self.dump(file_path, digest, tree)
+
+        self.trees[file_path] = (stat_key, digest, tree)
+        self.trees.move_to_end(file_path)
+        if self.max_trees is not None and len(self.trees) > self.max_trees:
+            self.trees.popitem(last=False)
+        return tree
+
+    def clear(self):
+        self.trees.clear()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def cache_path(self, file_path, digest):
+        key = f"{self.cache_version}:{file_path}:{digest}"
+        file_name = hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+        return os.path.join(self.cache_dir, file_name + ".tree")
+
+    def load(self, file_path, digest):
+        if self.cache_dir is None:
+            return None
+        entry_path = self.cache_path(file_path, digest)
+        if not os.path.isfile(entry_path):
+            return None
+        try:
+            with open(entry_path, "rb") as entry_handle:
+                return serialization.load(entry_handle)
+        except Exception:
+            # A corrupt or incompatible entry is simply treated as a miss
+            if self.debug:
+                print(f"Could not load cached tree for {file_path}")
+            return None
+
+    def dump(self, file_path, digest, tree):
+        if self.cache_dir is None:
+            return
+        entry_path = self.cache_path(file_path, digest)
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as entry_handle:
+                serialization.dump(tree, entry_handle)
+            os.replace(temp_path, entry_path)
+        except (OSError, serialization.SerializationError):
+            if self.debug:
+                print(f"Could not cache tree for {file_path}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def __len__(self):
+        return len(self.trees)
+
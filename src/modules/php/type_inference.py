@@ -0,0 +1,384 @@
+"""Intraprocedural inference of the classes of the objects methods are
+called on.
+
+For each function, method and closure (and the top-level code of each
+file) the classes a variable can hold are the union of what is assigned to
+it anywhere in the body (flow-insensitive):
+ - 'new Foo' (and 'new self', 'new static', 'new parent')
+ - another variable, a clone of one, or either branch of a ternary
+ - null, which adds nothing
+ - the exception class of a catch
+ - $this in the methods of a class, and in the closures defined in them
+ - the class type of a parameter
+A variable that also gets anything else (e.g. the result of a call) has an
+unknown class, unless a docblock says what it holds:
+ - '@param Foo $x' in the docblock of the function or method
+ - '@var Foo $x' in a docblock anywhere in the body, or '@var Foo' right
+   before an assignment to a variable
+
+The classes of the receiver of a method call then give the methods it can
+run through the ClassHierarchy (the method of the class or inherited by it,
+or an override in a subclass). When the receiver is unknown, call_targets()
+returns None and callers fall back to matching the method by name.
+
+    inference = TypeInference(resource_tree.symbol_table, resource_tree.class_hierarchy)
+    targets = inference.call_targets(method_call, class_node, file_path)
+
+The parser drops comments, so the docblocks are read by lexing the source of
+the files again (only the files that have any).
+"""
+
+import re
+
+from collections import defaultdict
+
+from src.compiler.php import phpast
+from src.compiler.php import phplex
+from src.modules.php import syntax_tree
+from src.modules.php.symbols import Scope, symbol_key
+
+# Type names that are not classes
+SCALAR_TYPES = frozenset(["int", "integer", "float", "double", "string", "bool", "boolean",
+                          "array", "callable", "iterable", "void", "null", "false", "true",
+                          "resource", "never", "scalar", "number", "numeric"])
+# Type names that say nothing about the class
+ANY_TYPES = frozenset(["mixed", "object"])
+
+PARAM_TAG = re.compile(r"@param\s+([^\s$]+)\s+&?(?:\.\.\.)?(\$\w+)")
+VAR_TAG = re.compile(r"@var\s+(?:([^\s$]+)\s+(\$\w+)|(\$\w+)\s+([^\s$]+)|([^\s$*]+))")
+
+DECLARATIONS = (phpast.Function, phpast.Class, phpast.Interface, phpast.Trait, phpast.Method)
+
+EMPTY = frozenset()
+
+
+def docblocks(source):
+    """Returns a dict mapping the lines of the first tokens after the
+    docblocks of source to the docblocks"""
+    found = {}
+    if "/**" not in source or "@param" not in source and "@var" not in source:
+        return found
+    lexer = phplex.full_lexer.clone()
+    lexer.begin("INITIAL")
+    lexer.lexstatestack = []
+    lexer.input(source)
+    lines = phplex.LineIndex(source)
+    pending = None
+    try:
+        for token in iter(lexer.token, None):
+            if token.type == "DOC_COMMENT":
+                pending = token.value
+            elif pending is not None and token.type not in phplex.unparsed:
+                found[lines.line(token.lexpos)] = pending
+                pending = None
+    except SyntaxError:
+        pass
+    return found
+
+
+class Procedure:
+    """What the inference needs from a function, method, closure or
+    top-level code"""
+
+    def __init__(self, params, body, class_node, scope, docblock, is_static=False, seeds=None):
+        self.params = params
+        self.body = body
+        self.class_node = class_node
+        self.scope = scope
+        self.docblock = docblock
+        self.is_static = is_static
+        # Types of the variables imported by closures
+        self.seeds = seeds or {}
+
+
+class TypeInference:
+    """ Classes of the receivers of method calls
+
+    Methods:
+        - call_targets(call, container, file_path): Returns the methods a
+          MethodCall can run, as (file path, (Method, Class)) like
+          ResourceTree.function_finder, or None if they are not known.
+          container is the innermost Class, Function or SyntaxTree around
+          the call
+        - receiver_types(call): Returns the keys of the classes of the
+          receiver of a call of an analyzed container, None if unknown
+        - analyze(container, file_path): Infers the types of the variables
+          of all the procedures of a Class, Function or SyntaxTree (once
+          per container)
+
+    Attributes:
+        - call_types: Maps the ids of the analyzed MethodCalls to the keys
+          of the classes of their receivers (None when unknown)
+    """
+
+    def __init__(self, symbol_table, hierarchy):
+        self.symbol_table = symbol_table
+        self.hierarchy = hierarchy
+        self.call_types = {}
+        self.analyzed = {}
+        self.docblock_memo = {}
+        self.source_docblocks = {}
+
+    def file_docblocks(self, file_path, tree=None):
+        found = self.docblock_memo.get(file_path)
+        if found is None:
+            source = getattr(tree, "source_code", None)
+            if source is None:
+                try:
+                    with open(file_path, encoding="utf-8", errors="replace") as source_file:
+                        source = source_file.read()
+                except OSError:
+                    source = ""
+            # Copies of a file are lexed once
+            found = self.source_docblocks.get(source)
+            if found is None:
+                found = self.source_docblocks[source] = docblocks(source)
+            self.docblock_memo[file_path] = found
+        return found
+
+    def call_targets(self, call, container, file_path):
+        if not isinstance(call.name, str):
+            return None
+        self.analyze(container, file_path)
+        types = self.call_types.get(id(call))
+        if not types:
+            return None
+        targets = {}
+        for class_key in sorted(types):
+            for definition in self.hierarchy.dispatch_targets(class_key, call.name):
+                targets[id(definition[1][0])] = definition
+        return list(targets.values()) or None
+
+    def receiver_types(self, call):
+        return self.call_types.get(id(call))
+
+    def analyze(self, container, file_path):
+        if id(container) in self.analyzed:
+            return
+        # Keeps the container alive, so that its id is not reused
+        self.analyzed[id(container)] = container
+        found = self.file_docblocks(file_path, container)
+
+        if isinstance(container, syntax_tree.SyntaxTree):
+            for scope, statements in self.sections(container, file_path):
+                self.analyze_procedure(Procedure([], statements, None, scope, None), found)
+        elif isinstance(container, phpast.Function):
+            scope = self.symbol_table.scope_of(container) or Scope(file_path)
+            self.analyze_procedure(Procedure(container.params, container.nodes, None, scope,
+                                             found.get(container.lineno)), found)
+        elif isinstance(container, phpast.Class):
+            scope = self.symbol_table.scope_of(container) or Scope(file_path)
+            for method in container.nodes or []:
+                if isinstance(method, phpast.Method):
+                    self.analyze_procedure(Procedure(
+                        method.params, method.nodes, container, scope, found.get(method.lineno),
+                        is_static="static" in (method.modifiers or [])), found)
+
+    def sections(self, tree, file_path):
+        """Yields the scopes of a file with their top-level statements, the
+        same way as SymbolTable.add_tree"""
+        scopes = self.symbol_table.scopes.get(file_path)
+        if not scopes:
+            yield Scope(file_path), tree.nodes or []
+            return
+        index = 0
+        statements = []
+        for statement in tree.nodes or []:
+            if isinstance(statement, phpast.Namespace):
+                index += 1
+                if statement.nodes:
+                    if index < len(scopes):
+                        yield scopes[index], statement.nodes
+                else:
+                    yield scopes[index - 1], statements
+                    statements = []
+                continue
+            statements.append(statement)
+        yield scopes[min(index, len(scopes) - 1)], statements
+
+    def class_types(self, name, procedure):
+        """Returns the keys of the classes a type name stands for, EMPTY for
+        scalar types and None if unknown"""
+        name = name.strip()
+        lower_name = name.lower().lstrip("?")
+        if lower_name in SCALAR_TYPES or lower_name.endswith("[]"):
+            return EMPTY
+        if lower_name in ANY_TYPES or not lower_name:
+            return None
+        class_key = self.hierarchy.class_of(procedure.class_node) \
+            if procedure.class_node is not None else None
+        if lower_name in ("self", "static", "$this"):
+            return frozenset([class_key]) if class_key else None
+        if lower_name == "parent":
+            parents = self.hierarchy.extends.get(class_key) if class_key else None
+            return frozenset(parents) if parents else None
+        return frozenset([symbol_key("class", self.symbol_table.resolve_class(
+            name.lstrip("?"), procedure.scope))])
+
+    def doc_types(self, type_string, procedure):
+        """Types of a docblock type, e.g. 'Foo|Bar|null'"""
+        types = set()
+        for name in type_string.split("|"):
+            name_types = self.class_types(name, procedure)
+            if name_types is None:
+                return None
+            types.update(name_types)
+        return frozenset(types) if types else None
+
+    def var_tags(self, docblock, procedure):
+        """Returns [(variable name or None, types)] of the @var tags"""
+        tags = []
+        for match in VAR_TAG.finditer(docblock):
+            type_string, name, reversed_name, reversed_type, bare_type = match.groups()
+            if reversed_name:
+                name, type_string = reversed_name, reversed_type
+            tags.append((name, self.doc_types(type_string or bare_type, procedure)))
+        return tags
+
+    def expression(self, expr, procedure):
+        """Returns what expr contributes to the variable it is assigned to:
+        a list of sets of class keys, ('var', name) for other variables and
+        None for unknown values"""
+        contributions = []
+        stack = [expr]
+        while stack:
+            node = stack.pop()
+            kind = type(node)
+            if kind is phpast.New:
+                if isinstance(node.name, str):
+                    contributions.append(self.class_types(node.name, procedure))
+                else:
+                    contributions.append(None)
+            elif kind is phpast.Variable and isinstance(node.name, str):
+                contributions.append(("var", node.name))
+            elif kind is phpast.Clone:
+                stack.append(node.node)
+            elif kind is phpast.Assignment:
+                stack.append(node.expr)
+            elif kind is phpast.TernaryOp:
+                stack.append(node.expr if node.iftrue is None else node.iftrue)
+                stack.append(node.iffalse)
+            elif kind is phpast.Constant and isinstance(node.name, str) and \
+                    node.name.lower() == "null":
+                continue
+            else:
+                contributions.append(None)
+        return contributions
+
+    def analyze_procedure(self, procedure, found):
+        contributions = defaultdict(list)
+        hints = {}
+
+        if procedure.docblock:
+            for match in PARAM_TAG.finditer(procedure.docblock):
+                hints[match.group(2)] = self.doc_types(match.group(1), procedure)
+        for param in procedure.params or []:
+            if not isinstance(param, phpast.FormalParameter) or not isinstance(param.name, str):
+                continue
+            declared = self.class_types(param.type, procedure) \
+                if isinstance(param.type, str) else None
+            contributions[param.name].append(declared or None)
+        for name, types in procedure.seeds.items():
+            contributions[name].append(types)
+        if procedure.class_node is not None and not procedure.is_static:
+            class_key = self.hierarchy.class_of(procedure.class_node)
+            contributions["$this"].append(frozenset([class_key]) if class_key else None)
+
+        calls = []
+        closures = []
+        stack = list(reversed(procedure.body or []))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(reversed(node))
+                continue
+            if not isinstance(node, phpast.Node) or isinstance(node, DECLARATIONS):
+                continue
+            kind = type(node)
+            docblock = found.get(node.lineno) if node.lineno is not None else None
+            if docblock is not None and kind is not phpast.Closure:
+                for name, types in self.var_tags(docblock, procedure):
+                    if name is not None:
+                        hints[name] = types
+                    elif kind is phpast.Assignment and isinstance(node.node, phpast.Variable):
+                        hints[node.node.name] = types
+
+            if kind is phpast.Closure:
+                closures.append(node)
+                continue
+            if kind is phpast.Include or kind is phpast.Require:
+                # Not the body of an expanded include
+                stack.append(node.expr)
+                continue
+            if kind is phpast.MethodCall:
+                calls.append(node)
+            if kind is phpast.Assignment:
+                if isinstance(node.node, phpast.Variable) and isinstance(node.node.name, str):
+                    contributions[node.node.name].extend(self.expression(node.expr, procedure))
+            elif kind is phpast.Catch:
+                name = node.var.name if isinstance(node.var, phpast.Variable) else None
+                if isinstance(name, str):
+                    contributions[name].append(self.class_types(node.class_, procedure)
+                                               if isinstance(node.class_, str) else None)
+            elif kind in (phpast.ListAssignment, phpast.Foreach, phpast.AssignOp, phpast.Global,
+                          phpast.StaticVariable, phpast.PreIncDecOp, phpast.PostIncDecOp):
+                # Variables assigned something else than an object
+                targets = {phpast.ListAssignment: lambda: node.nodes,
+                           phpast.Foreach: lambda: [node.keyvar, node.valvar],
+                           phpast.AssignOp: lambda: [node.left],
+                           phpast.Global: lambda: node.nodes,
+                           phpast.StaticVariable: lambda: [phpast.Variable(node.name)],
+                           phpast.PreIncDecOp: lambda: [node.expr],
+                           phpast.PostIncDecOp: lambda: [node.expr]}[kind]()
+                for target in targets:
+                    if isinstance(target, phpast.ForeachVariable):
+                        target = target.name
+                    if isinstance(target, phpast.Variable) and isinstance(target.name, str):
+                        contributions[target.name].append(None)
+            stack.extend(reversed(node.children()))
+
+        types = self.solve(contributions)
+        types.update(hints)
+
+        for call in calls:
+            receiver = call.node
+            if isinstance(receiver, phpast.Variable) and isinstance(receiver.name, str):
+                receiver_types = types.get(receiver.name)
+            elif isinstance(receiver, phpast.New) and isinstance(receiver.name, str):
+                receiver_types = self.class_types(receiver.name, procedure)
+            else:
+                receiver_types = None
+            self.call_types[id(call)] = receiver_types or None
+
+        for closure in closures:
+            seeds = {}
+            for variable in closure.vars or []:
+                if isinstance(variable.name, str):
+                    seeds[variable.name] = types.get(variable.name)
+            self.analyze_procedure(Procedure(closure.params, closure.nodes, procedure.class_node,
+                                             procedure.scope, found.get(closure.lineno),
+                                             procedure.is_static, seeds), found)
+
+    def solve(self, contributions):
+        """Returns the union of the contributions to each variable (None if
+        unknown), following the assignments of variables to each other"""
+        types = {name: EMPTY for name in contributions}
+        changed = True
+        while changed:
+            changed = False
+            for name, variable_contributions in contributions.items():
+                if types[name] is None:
+                    continue
+                result = set(types[name])
+                for contribution in variable_contributions:
+                    if isinstance(contribution, tuple):
+                        contribution = types.get(contribution[1])
+                    if contribution is None:
+                        result = None
+                        break
+                    result.update(contribution)
+                result = frozenset(result) if result is not None else None
+                if result != types[name]:
+                    types[name] = result
+                    changed = True
+        return types
@@ -43,13 +43,42 @@ class NameFinder(Visitor):
         # None means no match was found
         self.names = {}
         for name in names:
-            self.names[name] = []
+            # Names in the trees are interned, so lookups hit on identity
+            self.names[sys.intern(name)] = []
         self.finished = False
         self.greedy = greedy # False means search should stop at first match
+        self.subtree_starts = []
+
+    memoizes_subtrees = True
 
     def register_with(self, traverser):
         self.traverser = traverser
 
+    def enter_subtree(self, subtree):
+        counts = {name: len(results) for name, results in self.names.items()}
+        self.subtree_starts.append((counts, len(self.traverser.namespace_stack)))
+
+    def leave_subtree(self, subtree):
+        counts, prefix_length = self.subtree_starts.pop()
+        memo = []
+        for name, results in self.names.items():
+            for node_details in results[counts[name]:]:
+                memo.append((name, node_details["node"], node_details["type"],
+                             node_details["namespace_stack"][prefix_length:]))
+        return memo
+
+    def replay_subtree(self, subtree, memo):
+        for name, node, node_type, suffix in memo:
+            if self.finished:
+                return
+            self.names[name].append({
+                "node": node,
+                "type": node_type,
+                "namespace_stack": [*self.traverser.namespace_stack, *suffix]
+            })
+            if not self.greedy:
+                self.finished = True
+
     def visit(self, current_node):
         if not self.finished:
             if isinstance(current_node, phpast.Function):
@@ -114,10 +143,28 @@ class NodeFinder(Visitor):
         self.callback = callback
         self.namespace_stack = []
         self.found = []
+        self.subtree_starts = []
+
+    memoizes_subtrees = True
 
     def register_with(self, traverser):
         self.namespace_stack = traverser.namespace_stack
 
+    def enter_subtree(self, subtree):
+        self.subtree_starts.append((len(self.found), len(self.namespace_stack)))
+
+    def leave_subtree(self, subtree):
+        start, prefix_length = self.subtree_starts.pop()
+        return [(result["node"], result["namespace_stack"][prefix_length:])
+                for result in self.found[start:]]
+
+    def replay_subtree(self, subtree, memo):
+        for node, suffix in memo:
+            self.found.append({
+                "node": node,
+                "namespace_stack": [*self.namespace_stack, *suffix]
+            })
+
     def visit(self, current_node):
         if self.callback(current_node):
             self.found.append({
@@ -138,6 +185,11 @@ class ResourceCallsFinder(NameFinder):
      - match_params: Specifies whether the Finder should only collect definitions
        that have parameters compatible with the function/method calls
 
+    Method calls on objects of known classes (e.g. $this, variables
+    assigned 'new Foo', typed parameters) are only associated with the
+    methods these classes and their subclasses can run (see
+    ResourceTree.type_inference). Other method calls are associated with
+    every method with the same name.
    """
 
     def __init__(self, rt_root, ignore_builtins=True, match_params=False, debug=False):
@@ -148,6 +200,27 @@ class ResourceCallsFinder(NameFinder):
         self.debug = debug
         self.ignore_builtins = ignore_builtins
         self.match_params = match_params
+        self.subtree_starts = []
+
+    def enter_subtree(self, subtree):
+        self.subtree_starts.append((len(self.bound_calls), len(self.unbound_calls),
+                                    len(self.traverser.namespace_stack)))
+
+    def leave_subtree(self, subtree):
+        bound_start, unbound_start, prefix_length = self.subtree_starts.pop()
+        strip = lambda calls: [(call["stack"][prefix_length:], call["found_definitions"])
+                               for call in calls]
+        return (strip(self.bound_calls[bound_start:]),
+                strip(self.unbound_calls[unbound_start:]))
+
+    def replay_subtree(self, subtree, memo):
+        prefix = self.traverser.namespace_stack
+        for calls, memo_calls in zip((self.bound_calls, self.unbound_calls), memo):
+            for suffix, found_definitions in memo_calls:
+                calls.append({
+                    "stack": prefix + suffix,
+                    "found_definitions": found_definitions
+                })
 
     def visit(self, current_node):
         if type(current_node) in (phpast.FunctionCall, phpast.MethodCall):
@@ -158,7 +231,11 @@ class ResourceCallsFinder(NameFinder):
                     return
 
             try:
-                found_definitions = self.rt_root.function_finder(current_node.name, bound=is_bound)
+                found_definitions = None
+                if is_bound:
+                    found_definitions = self.method_candidates(current_node)
+                if not found_definitions:
+                    found_definitions = self.rt_root.function_finder(current_node.name, bound=is_bound)
             except:
                 if self.debug:
                     print("MethodCall Name could not be resolved")
@@ -178,3 +255,18 @@ class ResourceCallsFinder(NameFinder):
                 self.bound_calls.append(call_details)
             else:
                 self.unbound_calls.append(call_details)
+
+    def method_candidates(self, call):
+        """Returns the methods a call can run, from the classes inferred for
+        its receiver, or None if they are not known"""
+        container = file_path = None
+        for node in reversed(self.traverser.namespace_stack):
+            if container is None and isinstance(node, (phpast.Class, phpast.Function,
+                                                       syntax_tree.SyntaxTree)):
+                container = node
+            if isinstance(node, syntax_tree.SyntaxTree):
+                file_path = node.file_path
+                break
+        if container is None:
+            return None
+        return self.rt_root.type_inference.call_targets(call, container, file_path)
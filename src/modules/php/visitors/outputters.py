@@ -2,13 +2,10 @@
 Used for debugging and visualizations
 """
 
-import sys
-# Add compiler path for imports
-sys.path.insert(1, "../../compiler/php")
-
-from base import Visitor
 import graphviz
-import phpast
+
+from src.modules.php.base import Visitor
+from src.compiler.php import phpast
 
 class Printer(Visitor):
     """ Prints out information about the nodes visited for debugging
@@ -5,6 +5,9 @@ import os
 
 from src.modules.php import syntax_tree
 from src.modules.php.base import Visitor
+from src.modules.php.tree_store import TreeStore
+from src.modules.php.evaluator import IncludePathEvaluator
+from src.modules.php.serialization import register_node_class
 from src.compiler.php import phpast
 
 class CircularImport(phpast.Node):
@@ -13,19 +16,57 @@ class CircularImport(phpast.Node):
         self.looping_tree = looping_tree
         self.file_name = os.path.basename(child_path)
 
+register_node_class(CircularImport, ("looping_tree",))
 
 class DependencyResolver(Visitor):
     """Expands the tree by augmenting the ASTs for files added in it using
        Include and Require tags
        Should preceed any visitors that depend on it.
+
+       Included files are looked up in tree_store (by default a store of
+       the resolver's own) so that every distinct file is parsed once no
+       matter how many times it is included. A tree_store passed in is
+       shared with the other resolvers using it, and so are the include
+       bodies set in its trees.
+
+       The included paths are evaluated by an IncludePathEvaluator, which
+       can be shared between resolvers (e.g. one holding the constants of
+       the whole project). include_paths is only used when no evaluator is
+       given.
     """
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, tree_store=None, evaluator=None, include_paths=()):
+        self.tree_store = tree_store if tree_store is not None else TreeStore()
+        if evaluator is None:
+            evaluator = IncludePathEvaluator(include_paths=include_paths)
+        self.evaluator = evaluator
         self.namespace_stack = []
         self.constants = {}
         self.expr_fails = []
         self.not_found = []
         self.debug = debug
         self.current_file_tree = None
+        # Constants defined inside the shared subtrees being walked
+        self.subtree_constants = []
+
+    memoizes_subtrees = True
+
+    def enter_subtree(self, subtree):
+        self.subtree_constants.append([])
+
+    def leave_subtree(self, subtree):
+        return self.subtree_constants.pop()
+
+    def replay_subtree(self, subtree, memo):
+        # Includes inside the subtree are already expanded, only the
+        # constants it defines have to be defined again
+        for constant_name, constant_value, file_path in memo:
+            self.define_constant(constant_name, constant_value, file_path)
+
+    def define_constant(self, constant_name, constant_value, file_path):
+        self.constants[constant_name] = constant_value
+        self.evaluator.define(constant_name, constant_value, file_path)
+        for defined_constants in self.subtree_constants:
+            defined_constants.append((constant_name, constant_value, file_path))
 
     def visit(self, current_node):
         if isinstance(current_node, phpast.Include) or isinstance(current_node, phpast.Require):
@@ -39,8 +80,8 @@ class DependencyResolver(Visitor):
             # Get the Syntax tree for the node (Include/Require) and augment it 
             # to the node by using previous file included as base path
             file_to_build = self.evaluate_require(current_node.expr)
-            dependency_path = os.path.join(self.current_file_tree.file_location, file_to_build)
-            dependency_path = os.path.normpath(dependency_path)
+            dependency_path = self.evaluator.resolve(file_to_build,
+                                                     self.current_file_tree.file_location)
 
             # Counter Circular Imports
             for file_tree in current_tree_stack:
@@ -54,9 +95,14 @@ class DependencyResolver(Visitor):
         elif isinstance(current_node, phpast.FunctionCall):
             if current_node.name == "define":
                 constant_name = current_node.params[0].node
+                file_stack = [tree for tree in self.namespace_stack if \
+                              isinstance(tree, syntax_tree.SyntaxTree)]
+                if not isinstance(constant_name, str) or not file_stack:
+                    return
                 try:
                     constant_value = current_node.params[1].node
-                    self.constants[constant_name] = constant_value
+                    self.define_constant(constant_name, constant_value,
+                                         file_stack[-1].file_path)
                 except:
                     pass
 
@@ -77,45 +123,37 @@ class DependencyResolver(Visitor):
                                    self.current_file_tree.file_path))
 
         else:
-            file_handle = open(dependency_path, "r")
-            sub_ast = syntax_tree.SyntaxTree(file_handle)
-            node.body = sub_ast
+            node.body = self.tree_store.get(dependency_path)
 
     def evaluate_require(self, expr):
         """
         Takes the 'expr' block of a require/include call and
         reduces it to the actual string produced from that expression
         """
-        if isinstance(expr, str):
-            return expr
-
-        elif isinstance(expr, phpast.BinaryOp):
-            if expr.op == ".":
-                return self.evaluate_require(expr.left) + self.evaluate_require(expr.right)
-
-        elif isinstance(expr, phpast.Constant):
-            const_value = self.constants.get(expr.name)
-            if not isinstance(const_value, str):
-                return "[PATH]"
-            if const_value is None:
-                const_value = "[PATH]"
-                self.expr_fails.append((expr, expr.lineno, self.current_file_tree.file_path ))
-            return const_value
-
-        else:
-            self.expr_fails.append((expr, expr.lineno, self.current_file_tree.file_path ))
+        value = self.evaluator.evaluate(expr, self.current_file_tree.file_path)
+        if value is None:
+            self.expr_fails.append((expr, getattr(expr, "lineno", None),
+                                    self.current_file_tree.file_path))
             return "[PATH]"
+        return value
 
 
 class ResourceDependencyResolver(DependencyResolver):
+    """Expands the Include/Require nodes with the trees already built by
+    the ResourceTree. Constants in the included paths are looked up in the
+    constant_table of the whole project
+    """
 
-    def __init__(self, resource_tree_root, debug=False):
+    def __init__(self, resource_tree_root, debug=False, include_paths=()):
         self.rt_root = resource_tree_root
+        self.evaluator = IncludePathEvaluator(constants=resource_tree_root.constant_table,
+                                              include_paths=include_paths)
         self.namespace_stack = []
         self.not_found = []
         self.expr_fails = []
         self.constants = {}
         self.debug = debug
+        self.subtree_constants = []
 
     def follow_dependency(self, node, dependency_path, debug=False):
         try:
@@ -145,6 +183,10 @@ class TablesBuilder(Visitor):
         self.rt_root = rt_root
         self.namespace_stack = []
 
+    # The tables are keyed by the file that holds the definitions, so walking
+    # a shared subtree again would not add anything new
+    memoizes_subtrees = True
+
     def register_with(self, traverser):
         self.namespace_stack = traverser.namespace_stack
 
@@ -167,3 +209,14 @@ class TablesBuilder(Visitor):
             if isinstance(current_node.body, syntax_tree.SyntaxTree):
                 self.rt_root.dep_table[last_file.file_path].append(current_node.body)
 
+        elif isinstance(current_node, phpast.FunctionCall):
+            if current_node.name == "define" and len(current_node.params) > 1:
+                constant_name = current_node.params[0].node
+                if isinstance(constant_name, str):
+                    self.rt_root.constant_table[constant_name] = \
+                        (current_node.params[1].node, last_file.file_path)
+
+        elif isinstance(current_node, phpast.ConstantDeclaration):
+            self.rt_root.constant_table[current_node.name] = \
+                (current_node.initial, last_file.file_path)
+
@@ -0,0 +1,68 @@
+"""Checks of the control-flow graphs built by cfg.build_cfg.
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.compiler.php import phpast
+from src.modules.php import cfg
+from src.modules.php import syntax_tree
+from src.modules.php.dataflow import ReachingDefinitions, TaintedVariables
+
+
+def parse(source):
+    """Returns the SyntaxTree of source, as if read from test.php"""
+    source_handle = io.StringIO(source)
+    source_handle.name = "test.php"
+    return syntax_tree.SyntaxTree(source_handle)
+
+
+def block_of(graph, node_class):
+    """Returns the first block holding a node of node_class"""
+    for block in range(len(graph)):
+        if any(isinstance(node, node_class) for node in graph.block(block)):
+            return block
+    raise AssertionError(f"No {node_class.__name__} in the graph")
+
+
+class TryStatementTest(unittest.TestCase):
+
+    source = ("<?php\n$x = $_GET['q'];\n"
+              "try { $x = intval($x); } catch (Exception $e) { echo $x; }\n")
+
+    def test_handler_reached_from_before_the_body(self):
+        graph = cfg.build_cfg(parse(self.source))
+        before = block_of(graph, phpast.Assignment)
+        handler = block_of(graph, phpast.Catch)
+        self.assertIn(handler, graph.successors(before))
+
+    def test_definitions_before_the_try_reach_the_handler(self):
+        graph = cfg.build_cfg(parse(self.source))
+        problem = ReachingDefinitions(graph)
+        result = problem.solve()
+        handler = block_of(graph, phpast.Catch)
+        lines = sorted(node.lineno for _, node, _ in
+                       problem.reaching(result.entry[handler], "$x"))
+        self.assertEqual(lines, [2, 3])
+
+    def test_taint_before_the_try_reaches_the_handler(self):
+        problem = TaintedVariables(cfg.build_cfg(parse(self.source)))
+        flows = problem.flows(problem.solve())
+        self.assertEqual([(sink, names) for sink, _, names in flows], [("echo", ["$x"])])
+
+    def test_finally_reached_from_before_the_body(self):
+        graph = cfg.build_cfg(parse("<?php\n$x = 1;\ntry { f(); } finally { echo $x; }\n"))
+        before = block_of(graph, phpast.Assignment)
+        self.assertIn(block_of(graph, phpast.Echo), graph.successors(before))
+
+
+if __name__ == "__main__":
+    unittest.main()
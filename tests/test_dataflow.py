@@ -0,0 +1,205 @@
+"""Checks of the dataflow analyses on small fixed bodies.
+
+The facts are looked up at the start of blocks, found by the line of their
+first node.
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.modules.php import cfg
+from src.modules.php import syntax_tree
+from src.modules.php.dataflow import (ConstantPropagation, LiveVariables, ReachingDefinitions,
+                                      TaintedVariables)
+
+LOOP = """<?php
+$i = 0;
+$s = 'a';
+while ($i < 10) {
+    if (f($i)) {
+        $i = $i + 2;
+        continue;
+    }
+    if (g($i)) {
+        $s = 'b';
+        break;
+        $s = 'c';
+    }
+    $i = $i + 1;
+}
+echo $s;
+"""
+
+SWITCH = """<?php
+$s = 'x';
+switch ($k) {
+    case 1:
+        $s = 'a';
+    case 2:
+        $s .= 'b';
+        break;
+    case 3:
+        $s = 'c';
+        break;
+        $s = 'd';
+}
+echo $s;
+"""
+
+FOLDING = """<?php
+$s = 'a';
+$s .= 'b';
+$s .= 1;
+$n = 2;
+$n += 3;
+$n *= 4;
+$u = 'x';
+$u .= $v;
+while (f()) {
+    $w = 1;
+}
+echo $s;
+"""
+
+
+def graph_of(source):
+    """Returns the control-flow graph of the top-level code of source"""
+    source_handle = io.StringIO(source)
+    source_handle.name = "test.php"
+    return cfg.build_cfg(syntax_tree.SyntaxTree(source_handle))
+
+
+def line_block(graph, lineno):
+    """Returns the block starting with a node of line lineno"""
+    for block in range(len(graph)):
+        nodes = graph.block(block)
+        if nodes and getattr(nodes[0], "lineno", None) == lineno:
+            return block
+    raise AssertionError(f"No block starts at line {lineno}")
+
+
+class ReachingDefinitionsTest(unittest.TestCase):
+
+    def lines(self, source, lineno, name):
+        """Returns the lines of the definitions of name reaching the block
+        starting at lineno"""
+        graph = graph_of(source)
+        problem = ReachingDefinitions(graph)
+        facts = problem.solve().entry[line_block(graph, lineno)]
+        return sorted(node.lineno for _, node, _ in problem.reaching(facts, name))
+
+    def test_loop(self):
+        # The definition after the break is never run
+        self.assertEqual(self.lines(LOOP, 16, "$s"), [3, 10])
+        # Both the continue and the end of the body go back to the test
+        self.assertEqual(self.lines(LOOP, 4, "$i"), [2, 6, 14])
+        self.assertEqual(self.lines(LOOP, 16, "$i"), [2, 6, 14])
+
+    def test_switch_fallthrough(self):
+        # Case 2 is entered from its test and from the end of case 1
+        self.assertEqual(self.lines(SWITCH, 7, "$s"), [2, 5])
+        # '.=' replaces the definitions it reads
+        self.assertEqual(self.lines(SWITCH, 14, "$s"), [2, 7, 10])
+
+
+class LiveVariablesTest(unittest.TestCase):
+
+    def live(self, graph, block, at="entry"):
+        """Returns the variables live at the start (or end) of block"""
+        problem = LiveVariables(graph)
+        return sorted(problem.variables.members(getattr(problem.solve(), at)[block]))
+
+    def test_loop(self):
+        graph = graph_of(LOOP)
+        self.assertEqual(self.live(graph, cfg.ENTRY), [])
+        self.assertEqual(self.live(graph, line_block(graph, 4)), ["$i", "$s"])
+        # After the break, $i is not read again
+        self.assertEqual(self.live(graph, line_block(graph, 10)), [])
+        self.assertEqual(self.live(graph, line_block(graph, 16)), ["$s"])
+        # The continue goes back to the test, which reads $i
+        graph = graph_of(LOOP.replace("$i = $i + 2;", "$i = 5;"))
+        self.assertEqual(self.live(graph, line_block(graph, 6)), ["$s"])
+        self.assertEqual(self.live(graph, line_block(graph, 6), "exit"), ["$i", "$s"])
+
+    def test_switch_fallthrough(self):
+        graph = graph_of(SWITCH)
+        self.assertEqual(self.live(graph, cfg.ENTRY), ["$k"])
+        self.assertEqual(self.live(graph, line_block(graph, 5)), [])
+        self.assertEqual(self.live(graph, line_block(graph, 10)), [])
+        # Case 1 falls through to the '.=', which reads $s
+        graph = graph_of(SWITCH.replace("$s = 'a';", "$t = 'a';"))
+        self.assertEqual(self.live(graph, line_block(graph, 5)), ["$s"])
+
+    def test_try(self):
+        # The handler can be entered before the assignment of the body
+        graph = graph_of("<?php\ntry {\n    $x = f();\n} catch (Exception $e) {\n    echo $x;\n}\n")
+        self.assertEqual(self.live(graph, cfg.ENTRY), ["$x"])
+
+
+class ConstantPropagationTest(unittest.TestCase):
+
+    def constants(self, source, lineno):
+        graph = graph_of(source)
+        return ConstantPropagation(graph).solve().entry[line_block(graph, lineno)]
+
+    def test_folding(self):
+        # $u appends a variable without a value and $w is not set when the
+        # loop is not run
+        self.assertEqual(self.constants(FOLDING, 13), {"$s": "ab1", "$n": 20})
+
+    def test_loop(self):
+        # $s is 'a' or 'b', $i is anything
+        self.assertEqual(self.constants(LOOP, 16), {})
+        self.assertEqual(self.constants(LOOP.replace("$s = 'b';", "$s = 'a';"), 16), {"$s": "a"})
+        # Only the code after the break sets 'c'
+        self.assertEqual(self.constants(LOOP, 10), {"$s": "a"})
+
+    def test_switch_fallthrough(self):
+        # 'x' from the test of case 2, 'a' from case 1
+        self.assertEqual(self.constants(SWITCH, 7), {})
+        source = SWITCH.replace("$s = 'x';", "$s = 'a';")
+        self.assertEqual(self.constants(source, 7), {"$s": "a"})
+        # 'ab' from both cases, 'c' from case 3 and 'a' when no case matches
+        self.assertEqual(self.constants(source, 14), {})
+        source = source.replace("$s = 'c';", "$s = 'ab';").replace("case 3:", "default:")
+        self.assertEqual(self.constants(source, 14), {"$s": "ab"})
+
+
+class TaintedVariablesTest(unittest.TestCase):
+
+    def flows(self, source):
+        problem = TaintedVariables(graph_of(source))
+        return [(sink, node.lineno, names) for sink, node, names in
+                problem.flows(problem.solve())]
+
+    def test_loop(self):
+        self.assertEqual(self.flows(LOOP.replace("$s = 'b';", "$s = $_GET['s'];")),
+                         [("echo", 16, ["$s"])])
+        # Only the code after the break reads the input
+        self.assertEqual(self.flows(LOOP.replace("$s = 'c';", "$s = $_GET['s'];")), [])
+        # The taint flows back to the test through the continue
+        source = LOOP.replace("$i = $i + 2;", "$i = $_GET['i'];").replace(
+            "echo $s;", "echo $s;\nsystem($i);")
+        self.assertEqual(self.flows(source), [("system", 17, ["$i"])])
+
+    def test_switch_fallthrough(self):
+        self.assertEqual(self.flows(SWITCH.replace("$s = 'a';", "$s = $_GET['s'];")),
+                         [("echo", 14, ["$s"])])
+        self.assertEqual(self.flows(SWITCH.replace("$s = 'd';", "$s = $_GET['s'];")), [])
+        # The update keeps the taint of the value it appends to
+        self.assertEqual(self.flows(SWITCH.replace("$s = 'x';", "$s = $_GET['s'];")),
+                         [("echo", 14, ["$s"])])
+        self.assertEqual(self.flows(SWITCH.replace(".= 'b'", ".= $_POST['b']")),
+                         [("echo", 14, ["$s"])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+"""Stress checks of deeply nested code.
+
+The synthetic files below nest expressions and statements DEPTH levels
+deep. Every walk over the trees (parsing, traversers, include resolution
+and evaluation, generic, structural hashes, serialization, control-flow
+graphs, taint) must go through them at the default recursion limit.
+
+Run from the root of the repository:
+    python -m unittest tests.test_deep_nesting
+The files can also be written out for other tools with:
+    python tests/test_deep_nesting.py --write DIRECTORY
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.compiler.php import phpast
+from src.modules.php import cfg
+from src.modules.php import serialization
+from src.modules.php import syntax_tree
+from src.modules.php.dataflow import ReachingDefinitions
+from src.modules.php.evaluator import IncludePathEvaluator
+from src.modules.php.resource import ResourceTree
+from src.modules.php.traversers.bf import BFTraverser
+from src.modules.php.traversers.df import DFTraverser
+from src.modules.php.visitors.finders import NodeFinder
+from src.modules.php.visitors.resolvers import DependencyResolver
+
+DEPTH = 10000
+
+
+def concat_chain(depth):
+    """An include of a path made of depth '.' operands"""
+    return "<?php\ninclude " + " . ".join(["'a'"] * depth) + ";\n"
+
+
+def nested_arrays(depth):
+    return "<?php\n$a = " + "array(" * depth + "1" + ")" * depth + ";\n"
+
+
+def nested_calls(depth):
+    return "<?php\n$b = " + "f(" * depth + "$_GET['q']" + ")" * depth + ";\n"
+
+
+def nested_ifs(depth):
+    return ("<?php\nfunction nested_ifs($a) {\n" + "if ($a) {\n" * depth +
+            "$x = $_GET['q'];\n" + "}\n" * depth + "mysqli_query($c, $x);\n}\n")
+
+
+def nested_loops(depth):
+    # Each loop repeats its body until the taint does not change, so the
+    # loops are not as deep as the other constructs
+    return ("<?php\nfunction nested_loops($a) {\n" + "while ($a) {\n" * depth +
+            "$y = $_GET['q'];\n" + "}\n" * depth + "mysqli_query($c, $y);\n}\n")
+
+
+def generate(directory, depth=DEPTH):
+    """Writes the synthetic files to directory, returns their paths by name"""
+    sources = {
+        "concat_chain.php": concat_chain(depth),
+        "nested_arrays.php": nested_arrays(depth),
+        "nested_calls.php": nested_calls(depth),
+        "nested_ifs.php": nested_ifs(depth),
+        "nested_loops.php": nested_loops(min(depth, 400)),
+    }
+    paths = {}
+    for name, source in sources.items():
+        paths[name] = os.path.join(directory, name)
+        with open(paths[name], "w") as file_handle:
+            file_handle.write(source)
+    return paths
+
+
+class DeepNestingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.paths = generate(cls.directory.name)
+        cls.trees = {name: syntax_tree.build_syntax_tree(path)
+                     for name, path in cls.paths.items()}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def depth(self, node):
+        """Depth of the tree below node"""
+        deepest = 0
+        stack = [(node, 1)]
+        while stack:
+            node, depth = stack.pop()
+            deepest = max(deepest, depth)
+            stack.extend((child, depth + 1) for child in node.children())
+        return deepest
+
+    def test_parse(self):
+        for name, tree in self.trees.items():
+            expected = 400 if name == "nested_loops.php" else DEPTH
+            self.assertGreater(self.depth(tree), expected, name)
+
+    def test_traversers(self):
+        for name, tree in self.trees.items():
+            for traverser_class in (BFTraverser, DFTraverser):
+                finder = NodeFinder(lambda node: isinstance(node, phpast.Node))
+                traverser = traverser_class(tree)
+                traverser.register_visitor(finder)
+                traverser.traverse()
+                self.assertGreaterEqual(len(finder.found), self.depth(tree),
+                                        (name, traverser_class.__name__))
+
+    def test_resolver(self):
+        tree = syntax_tree.build_syntax_tree(self.paths["concat_chain.php"])
+        resolver = DependencyResolver()
+        traverser = DFTraverser(tree)
+        traverser.register_visitor(resolver)
+        with contextlib.redirect_stdout(io.StringIO()):
+            traverser.traverse()
+        self.assertFalse(resolver.expr_fails)
+        self.assertEqual(len(resolver.not_found), 1)
+
+    def test_evaluator(self):
+        include = self.trees["concat_chain.php"].nodes[0]
+        value = IncludePathEvaluator().evaluate(include.expr, self.paths["concat_chain.php"])
+        self.assertEqual(value, "a" * DEPTH)
+
+    def test_generic_and_structural_hash(self):
+        # Comparing the nested generic forms would recurse, the hashes of
+        # two parses of the same file are compared instead
+        for name, tree in self.trees.items():
+            self.assertEqual(tree.generic(with_lineno=True)[0], "SyntaxTree")
+            second = syntax_tree.build_syntax_tree(self.paths[name])
+            self.assertEqual(tree.structural_hash(with_lineno=True),
+                             second.structural_hash(with_lineno=True), name)
+
+    def test_serialization(self):
+        for name, tree in self.trees.items():
+            buffer = io.BytesIO()
+            serialization.dump(tree, buffer)
+            buffer.seek(0)
+            loaded = serialization.load(buffer)
+            self.assertEqual(loaded.structural_hash(with_lineno=True),
+                             tree.structural_hash(with_lineno=True), name)
+
+    def test_control_flow_and_dataflow(self):
+        function = self.trees["nested_ifs.php"].nodes[0]
+        graph = cfg.build_cfg(function)
+        self.assertGreater(len(graph), 2 * DEPTH)
+        ReachingDefinitions(graph).solve()
+
+    def test_taint(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            resource_tree = ResourceTree(self.directory.name)
+            resource_tree.build_trees()
+            resource_tree.build_tables()
+        findings = resource_tree.find_taint_flows()
+        self.assertEqual(sorted(os.path.basename(finding.file_path) for finding in findings),
+                         ["nested_ifs.php", "nested_loops.php"])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--write":
+        for path in generate(sys.argv[2]).values():
+            print(path)
+    else:
+        unittest.main()
@@ -0,0 +1,63 @@
+"""Checks of the patterns of discovery.FileDiscovery.
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.modules.php.discovery import FileDiscovery
+
+FILES = ["index.php", "vendor/lib.php", "vendor/pkg/src/deep.php", "src/vendor.php",
+         "src/app/vendor/local.php"]
+
+
+class DirectoryPatternTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name in FILES:
+            path = os.path.join(self.directory.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as file_handle:
+                file_handle.write("<?php\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def modes(self, **arguments):
+        discovery = FileDiscovery(self.directory.name, **arguments)
+        return {os.path.relpath(path, self.directory.name): mode
+                for path, mode in discovery.discover()}
+
+    def test_directory_parse_mode(self):
+        modes = self.modes(parse_modes=[("vendor/", "declarations")])
+        self.assertEqual(modes, {
+            "index.php": "full",
+            "vendor/lib.php": "declarations",
+            "vendor/pkg/src/deep.php": "declarations",
+            "src/vendor.php": "full",
+            "src/app/vendor/local.php": "declarations",
+        })
+
+    def test_anchored_directory_parse_mode(self):
+        modes = self.modes(parse_modes=[("/vendor/", "declarations"), ("vendor/pkg/", "full")])
+        self.assertEqual(modes["vendor/lib.php"], "declarations")
+        self.assertEqual(modes["vendor/pkg/src/deep.php"], "full")
+        self.assertEqual(modes["src/app/vendor/local.php"], "full")
+
+    def test_directory_include(self):
+        modes = self.modes(include=["src/"])
+        # Like in gitignore, a pattern without an inner "/" matches at any depth
+        self.assertEqual(sorted(modes), ["src/app/vendor/local.php", "src/vendor.php",
+                                         "vendor/pkg/src/deep.php"])
+
+
+if __name__ == "__main__":
+    unittest.main()
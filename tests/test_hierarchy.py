@@ -0,0 +1,119 @@
+"""Checks of hierarchy.ClassHierarchy on a small project.
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.modules.php.resource import ResourceTree
+from src.modules.php.traversers.bf import BFTraverser
+from src.modules.php.visitors.finders import ResourceCallsFinder
+
+SOURCE = """<?php
+namespace App;
+
+interface Greets { function hello(); }
+
+trait Hello {
+    function hello() { return 'hello'; }
+    function other() { return 'other'; }
+}
+
+trait Polite {
+    function please() { return 'please'; }
+}
+
+class Base {
+    function save() { return 1; }
+    function hello() { return 'base'; }
+}
+
+class Child extends Base implements Greets {
+    use Hello { hello as hi; }
+    // The trait of a qualified alias is not the one of the use
+    use Polite { Hello::other as aliased; }
+
+    function run() {
+        $this->aliased();
+        $this->hi();
+    }
+}
+
+class Leaf extends Child {
+    function save() { return 2; }
+}
+"""
+
+
+class ClassHierarchyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.file_path = os.path.join(cls.directory.name, "classes.php")
+        with open(cls.file_path, "w") as file_handle:
+            file_handle.write(SOURCE)
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.resource_tree = ResourceTree(cls.directory.name)
+            cls.resource_tree.build_trees()
+            cls.resource_tree.build_tables()
+        cls.hierarchy = cls.resource_tree.class_hierarchy
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def methods(self, definitions):
+        """Returns the definitions as 'class::method' names"""
+        return sorted(f"{class_node.name}::{method.name}"
+                      for _, (method, class_node) in definitions)
+
+    def test_method_resolution_order(self):
+        self.assertEqual(self.hierarchy.method_resolution_order("App\\Leaf"),
+                         ("app\\leaf", "app\\child", "app\\hello", "app\\polite", "app\\base",
+                          "app\\greets"))
+
+    def test_ancestors_and_descendants(self):
+        self.assertEqual(self.hierarchy.ancestors("App\\Leaf"),
+                         {"app\\child", "app\\base", "app\\greets", "app\\hello", "app\\polite"})
+        self.assertEqual(self.hierarchy.descendants("App\\Base"), {"app\\child", "app\\leaf"})
+        self.assertTrue(self.hierarchy.is_subclass("\\App\\Leaf", "App\\Greets"))
+        self.assertFalse(self.hierarchy.is_subclass("App\\Base", "App\\Child"))
+
+    def test_overrides_and_trait_methods(self):
+        lookup = self.hierarchy.lookup_method
+        # Trait methods override the inherited ones
+        self.assertEqual(self.methods(lookup("App\\Child", "hello")), ["Hello::hello"])
+        self.assertEqual(self.methods(lookup("App\\Leaf", "please")), ["Polite::please"])
+        self.assertEqual(self.methods(lookup("App\\Leaf", "save")), ["Leaf::save"])
+        self.assertEqual(self.methods(lookup("App\\Child", "save")), ["Base::save"])
+        self.assertEqual(self.methods(self.hierarchy.dispatch_targets("App\\Base", "save")),
+                         ["Base::save", "Leaf::save"])
+
+    def test_trait_aliases(self):
+        lookup = self.hierarchy.lookup_method
+        self.assertEqual(self.methods(lookup("App\\Child", "hi")), ["Hello::hello"])
+        self.assertEqual(self.methods(lookup("App\\Leaf", "aliased")), ["Hello::other"])
+        self.assertEqual(lookup("App\\Base", "aliased"), ())
+
+    def test_calls_of_aliases(self):
+        finder = ResourceCallsFinder(self.resource_tree)
+        traverser = BFTraverser(self.resource_tree.trees[self.file_path])
+        traverser.register_visitor(finder)
+        traverser.traverse()
+        found = {call["stack"][-1].name: self.methods(call["found_definitions"])
+                 for call in finder.bound_calls}
+        self.assertEqual(found, {"aliased": ["Hello::other"], "hi": ["Hello::hello"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Checks of the streams written by serialization.TreeWriter.
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.compiler.php import phpast
+from src.modules.php import serialization
+from src.modules.php.resource import ResourceTree
+from src.modules.php.visitors.resolvers import CircularImport
+
+SOURCES = {
+    "a.php": "<?php\ninclude 'b.php';\n$a = 1;\n",
+    "b.php": "<?php\ninclude 'c.php';\n$b = 2;\n",
+    "c.php": "<?php\ninclude 'a.php';\n$c = array(1, 2.5, 'c');\n",
+}
+
+
+class TreeStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name, source in SOURCES.items():
+            with open(os.path.join(self.directory.name, name), "w") as file_handle:
+                file_handle.write(source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.resource_tree = ResourceTree(self.directory.name)
+            self.resource_tree.build_trees()
+            self.resource_tree.resolve_dependencies()
+        self.path = os.path.join(self.directory.name, "trees.bin")
+        self.resource_tree.dump_trees(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_include_bodies_are_the_loaded_trees(self):
+        written = dict(self.resource_tree.trees)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.resource_tree.load_trees(self.path)
+        trees = self.resource_tree.trees
+        self.assertEqual(sorted(trees), sorted(written))
+        for file_path, tree in trees.items():
+            self.assertEqual(tree.structural_hash(with_lineno=True),
+                             written[file_path].structural_hash(with_lineno=True))
+            include = tree.nodes[0]
+            self.assertIsInstance(include, phpast.Include)
+            body = include.body
+            if isinstance(body, CircularImport):
+                body = body.looping_tree
+            self.assertIs(trees[body.file_path], body)
+
+    def test_truncated_record(self):
+        # A stream cut between two records is valid, so a single record is
+        # cut anywhere after the header
+        buffer = io.BytesIO()
+        serialization.dump(next(iter(self.resource_tree.trees.values())), buffer)
+        data = buffer.getvalue()
+        for size in range(len(serialization.MAGIC) + 2, len(data)):
+            with self.assertRaises(serialization.SerializationError, msg=size):
+                list(serialization.TreeReader(io.BytesIO(data[:size])))
+
+    def test_corrupt_stream(self):
+        with open(self.path, "rb") as file_handle:
+            data = file_handle.read()
+        start = len(serialization.MAGIC) + 1
+        for position in range(start, len(data)):
+            corrupt = bytearray(data)
+            corrupt[position] ^= 0xff
+            try:
+                list(serialization.TreeReader(io.BytesIO(bytes(corrupt))))
+            except serialization.SerializationError:
+                pass
+
+
+if __name__ == "__main__":
+    unittest.main()
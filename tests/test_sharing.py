@@ -0,0 +1,49 @@
+"""Checks of sharing.Interner on trees of a ResourceTree.
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.modules.php.resource import ResourceTree
+from src.modules.php.sharing import Interner
+
+INCLUDES = os.path.join(ROOT, "examples", "php", "DVWA-master", "dvwa", "includes")
+
+
+class InternAfterTraversalTest(unittest.TestCase):
+
+    def build(self, with_tables):
+        with contextlib.redirect_stdout(io.StringIO()):
+            resource_tree = ResourceTree(INCLUDES)
+            resource_tree.build_trees()
+            if with_tables:
+                resource_tree.build_tables()
+        return resource_tree.trees[os.path.join(INCLUDES, "dvwaPage.inc.php")]
+
+    def intern(self, tree):
+        interner = Interner()
+        shared = interner.intern(tree)
+        return interner, shared
+
+    def test_reuses_nodes_after_build_tables(self):
+        fresh, _ = self.intern(self.build(with_tables=False))
+        traversed, shared = self.intern(self.build(with_tables=True))
+        self.assertGreater(traversed.reused, 0)
+        self.assertEqual((len(traversed.nodes), traversed.reused),
+                         (len(fresh.nodes), fresh.reused))
+        # The copies do not point back into the interned tree
+        for node in shared.walk():
+            self.assertNotIn("nearest_ns_parent", vars(node.shared_node))
+
+
+if __name__ == "__main__":
+    unittest.main()
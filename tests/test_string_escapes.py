@@ -0,0 +1,116 @@
+"""Checks of the escape sequences of each kind of string.
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.compiler.php import phpast
+from src.compiler.php import phplex
+from src.compiler.php import phpparse
+from src.modules.php import syntax_tree
+
+# Text of the string, and its value with each delimiter ('"', '`' and None
+# for heredocs)
+ESCAPES = [
+    (r'a\nb', {'"': 'a\nb', '`': 'a\nb', None: 'a\nb'}),
+    (r'\t\\\$x', {'"': '\t\\$x', '`': '\t\\$x', None: '\t\\$x'}),
+    (r'\101\x42\u{43}', {'"': 'ABC', '`': 'ABC', None: 'ABC'}),
+    (r'q\"q', {'"': 'q"q', '`': 'q\\"q', None: 'q\\"q'}),
+    (r'b\`b', {'"': 'b\\`b', '`': 'b`b', None: 'b\\`b'}),
+    (r'\d\.\z', {'"': '\\d\\.\\z', '`': '\\d\\.\\z', None: '\\d\\.\\z'}),
+]
+
+
+def parse(source, **arguments):
+    source_handle = io.StringIO(source)
+    source_handle.name = "test.php"
+    return syntax_tree.SyntaxTree(source_handle, **arguments).nodes
+
+
+def string_value(node):
+    """The value of a parsed string: a literal, or the strings around a
+    variable"""
+    if isinstance(node, phpast.FunctionCall):
+        node = node.params[0].node
+    if isinstance(node, phpast.BinaryOp):
+        return [string_value(node.left), string_value(node.right)]
+    if isinstance(node, phpast.Concat):
+        return [string_value(item) for item in node.nodes]
+    if isinstance(node, phpast.InterpolatedString):
+        return [string_value(item) for item in node.nodes]
+    if isinstance(node, phpast.Variable):
+        return node.name
+    return node
+
+
+class StringEscapesTest(unittest.TestCase):
+
+    parsers = [{}, {"spans": True}, {"concat": True}, {"concat": True, "spans": True}]
+
+    def sources(self, text):
+        """Assignments of text in each kind of string, by delimiter"""
+        return {
+            '"': '<?php\n$s = "%s";\n' % text,
+            '`': '<?php\n$s = `%s`;\n' % text,
+            None: '<?php\n$s = <<<EOT\n%s\nEOT;\n' % text,
+        }
+
+    def test_process_php_string_escapes(self):
+        for text, values in ESCAPES:
+            for delimiter, value in values.items():
+                self.assertEqual(phpparse.process_php_string_escapes(text, delimiter), value,
+                                 (text, delimiter))
+
+    def test_strings(self):
+        for text, values in ESCAPES:
+            for delimiter, source in self.sources(text).items():
+                for arguments in self.parsers:
+                    node = parse(source, **arguments)[0].expr
+                    self.assertEqual(string_value(node), values[delimiter],
+                                     (text, delimiter, arguments))
+                    self.assertIs(type(string_value(node)), str)
+
+    def test_interpolated_strings(self):
+        for text, values in ESCAPES:
+            for delimiter, source in self.sources(text + '{$v}' + text).items():
+                expected = [values[delimiter], '$v', values[delimiter]]
+                for arguments in self.parsers:
+                    node = parse(source, **arguments)[0].expr
+                    value = string_value(node)
+                    if not arguments.get("concat"):
+                        value = value[0] + value[1:]
+                    self.assertEqual(value, expected, (text, delimiter, arguments))
+
+    def test_static_strings(self):
+        for text, values in ESCAPES:
+            sources = {
+                '"': '<?php\nconst S = "%s";\n' % text,
+                None: '<?php\nconst S = <<<EOT\n%s\nEOT;\n' % text,
+            }
+            for delimiter, source in sources.items():
+                constant = parse(source)[0].nodes[0]
+                self.assertEqual(constant.initial, values[delimiter], (text, delimiter))
+
+    def test_token_values_are_the_source_text(self):
+        text = "".join(text for text, _ in ESCAPES)
+        for source in self.sources(text).values():
+            tokens = syntax_tree.tokenize(source)
+            self.assertEqual(tokens.values, {})
+            lexer = phplex.lexer.clone()
+            lexer.input(source)
+            for token in iter(lexer.token, None):
+                if token.type == "ENCAPSED_AND_WHITESPACE":
+                    self.assertEqual(token.value,
+                                     source[token.lexpos:token.lexpos + len(token.value)])
+
+
+if __name__ == "__main__":
+    unittest.main()
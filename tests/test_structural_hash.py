@@ -0,0 +1,83 @@
+"""Checks of phpast.Node.structural_hash on trees with expanded includes.
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.compiler.php import phpast
+from src.modules.php.resource import ResourceTree
+from src.modules.php.sharing import Interner
+
+SOURCES = {
+    "main.php": "<?php\nif ($a) {\n    include 'lib.php';\n}\nrequire 'other/lib.php';\n",
+    "copy.php": "<?php\nif ($a) {\n    include 'lib.php';\n}\nrequire 'other/lib.php';\n",
+    "lib.php": "<?php\n$b = 1;\n",
+    "other/lib.php": "<?php\n$c = 2;\n",
+}
+
+
+class IncludeBodyHashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name, source in SOURCES.items():
+            path = os.path.join(self.directory.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as file_handle:
+                file_handle.write(source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.resource_tree = ResourceTree(self.directory.name)
+            self.resource_tree.build_trees()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def resolve(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.resource_tree.resolve_dependencies()
+
+    def include_bodies(self, tree):
+        """Returns the paths of the bodies of the includes of tree"""
+        paths = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (phpast.Include, phpast.Require)):
+                paths.append(node.body.file_path if node.body is not None else None)
+            else:
+                stack.extend(node.children())
+        return sorted(paths)
+
+    def test_hash_does_not_depend_on_resolution(self):
+        trees = self.resource_tree.trees
+        before = {path: tree.structural_hash(with_lineno=True) for path, tree in trees.items()}
+        self.resolve()
+        cached = {path: tree.structural_hash(with_lineno=True) for path, tree in trees.items()}
+        for tree in trees.values():
+            phpast.clear_structural_hashes(tree)
+        fresh = {path: tree.structural_hash(with_lineno=True) for path, tree in trees.items()}
+        self.assertEqual(before, cached)
+        self.assertEqual(before, fresh)
+
+    def test_interning_keeps_include_bodies(self):
+        self.resolve()
+        interner = Interner()
+        for tree in self.resource_tree.trees.values():
+            expanded = interner.intern(tree).expand()
+            self.assertEqual(self.include_bodies(expanded), self.include_bodies(tree))
+            self.assertEqual(expanded.structural_hash(with_lineno=True),
+                             tree.structural_hash(with_lineno=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Checks of taint.TaintAnalysis on small projects.
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.modules.php.resource import ResourceTree
+from src.modules.php.taint import SummaryCache, TaintAnalysis
+
+LIB = """<?php
+function fetch($name) {
+    return $name;
+}
+
+function show($value) {
+    echo $value;
+}
+"""
+
+MAIN = """<?php
+function relay($value) {
+    show(fetch($value));
+}
+
+relay($_GET['name']);
+show(intval($_GET['id']));
+$rows = array('id' => $_POST['id']);
+mysqli_query($db, $rows['id']);
+$run = function () use ($rows) {
+    system($rows['id']);
+};
+$safe = array('id' => intval($_POST['id']));
+mysqli_query($db, $safe['id']);
+"""
+
+
+class TaintAnalysisTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.write("lib.php", LIB)
+        self.write("main.php", MAIN)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, source):
+        with open(os.path.join(self.directory.name, name), "w") as file_handle:
+            file_handle.write(source)
+
+    def analysis(self, cache=None):
+        """Returns a TaintAnalysis of the files as they are on disk"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            resource_tree = ResourceTree(self.directory.name)
+            resource_tree.build_trees()
+            resource_tree.build_tables()
+        return TaintAnalysis(resource_tree, cache=cache)
+
+    def findings(self, analysis):
+        """Returns the findings of a run as (sink, file, line, sources,
+        call path lines) tuples"""
+        return [(finding.sink, os.path.basename(finding.file_path), finding.lineno,
+                 sorted(finding.sources), [lineno for _, lineno in finding.call_path])
+                for finding in analysis.run()]
+
+    def test_flows(self):
+        self.assertEqual(self.findings(self.analysis()), [
+            # Through relay() and show()
+            ("echo", "lib.php", 7, ["$_GET"], [6, 3]),
+            ("mysqli_query", "main.php", 9, ["$_POST"], []),
+            ("system", "main.php", 11, ["$_POST"], []),
+        ])
+
+    def test_sanitizer(self):
+        self.write("main.php", "<?php\nshow(intval($_GET['id']));\n"
+                               "echo htmlspecialchars(fetch($_GET['name']));\n")
+        self.assertEqual(self.findings(self.analysis()), [])
+
+    def test_cache(self):
+        cache = SummaryCache()
+        first = self.analysis(cache)
+        expected = self.findings(first)
+        self.assertEqual(first.reused, 0)
+
+        second = self.analysis(cache)
+        self.assertEqual(self.findings(second), expected)
+        self.assertEqual(second.analyzed, 0)
+        self.assertEqual(second.reused, len(second.procedures))
+
+        # fetch() sanitizes its result now: it, the code of lib.php holding
+        # it, relay() and main.php are analyzed again, show() is not
+        self.write("lib.php", LIB.replace("return $name;", "return intval($name);"))
+        third = self.analysis(cache)
+        self.assertEqual(self.findings(third), expected[1:])
+        self.assertEqual(third.reused, 1)
+        self.assertEqual(third.analyzed, len(third.procedures) - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Checks of the shared subtree modes of the traversers.
+
+Run from the root of the repository:
+    python -m unittest discover tests
+"""
+
+import collections
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.compiler.php import phpast
+from src.modules.php.base import Visitor
+from src.modules.php.resource import ResourceTree
+from src.modules.php.traversers.bf import BFTraverser
+from src.modules.php.traversers.df import DFTraverser
+
+SOURCES = {
+    "main.php": ("<?php\nfunction a() {\n    include 'lib.php';\n}\n"
+                 "class B {\n    function c() {\n        require 'lib.php';\n    }\n}\n"
+                 "include 'lib.php';\n"),
+    "lib.php": ("<?php\nfunction f($x) {\n    return $x;\n}\n"
+                "class K {\n    function m() {\n        echo 1;\n    }\n}\n"),
+}
+
+
+class EventRecorder(Visitor):
+    """Records the enter, visit and leave calls with the namespace_stack"""
+
+    def __init__(self):
+        self.events = []
+        self.traverser = None
+
+    def register_with(self, traverser):
+        self.traverser = traverser
+
+    def record(self, kind, node):
+        self.events.append((kind, id(node), tuple(map(id, self.traverser.namespace_stack))))
+
+    def enter(self, current_node):
+        self.record("enter", current_node)
+
+    def visit(self, current_node):
+        self.record("visit", current_node)
+
+    def leave(self, current_node):
+        self.record("leave", current_node)
+
+
+class SharedSubtreeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        for name, source in SOURCES.items():
+            with open(os.path.join(cls.directory.name, name), "w") as file_handle:
+                file_handle.write(source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            resource_tree = ResourceTree(cls.directory.name)
+            resource_tree.build_trees()
+            resource_tree.resolve_dependencies()
+        cls.tree = resource_tree.trees[os.path.join(cls.directory.name, "main.php")]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def events(self, traverser_class, mode):
+        recorder = EventRecorder()
+        traverser = traverser_class(self.tree, shared_subtrees=mode)
+        traverser.register_visitor(recorder)
+        traverser.traverse()
+        return recorder.events
+
+    def test_include_bodies_are_shared(self):
+        bodies = set()
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (phpast.Include, phpast.Require)):
+                bodies.add(id(node.body))
+            else:
+                stack.extend(node.children())
+        self.assertEqual(len(bodies), 1)
+
+    def test_depth_first_replay(self):
+        visit = self.events(DFTraverser, "visit")
+        self.assertEqual(self.events(DFTraverser, "replay"), visit)
+
+    def test_breadth_first_replay(self):
+        # The shared subtree is walked as a whole at its first site in
+        # 'replay' mode, so only the events themselves are the same. The
+        # stacks are not compared: in 'visit' mode the nodes of a shared
+        # subtree have the nearest_ns_parent of the site queued last
+        visit = self.events(BFTraverser, "visit")
+        replay = self.events(BFTraverser, "replay")
+        self.assertEqual(collections.Counter(event[:2] for event in replay),
+                         collections.Counter(event[:2] for event in visit))
+        # A node is left right after it is visited, before its children
+        for previous, event in zip(replay, replay[1:]):
+            if event[0] == "leave":
+                self.assertEqual(previous, ("visit",) + event[1:])
+
+
+if __name__ == "__main__":
+    unittest.main()